@@ -0,0 +1,67 @@
+"""
+This script compares the time it takes to clone a feedstock with the full
+history versus the shallow, single-branch clones used by the action.
+
+It builds a local bare repo with a long synthetic history (each commit rewrites
+a binary blob) and clones it over `file://` so that git uses the same transport
+code paths as for a remote. Run it like
+
+    python tests/run_clone_benchmark.py --num-commits 5000 --blob-size 65536
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from webservices_dispatch_action.git_utils import clone_feedstock
+from webservices_dispatch_action.tests.conftest import make_bare_repo_with_history
+
+
+def _objects_size(git_dir):
+    tot = 0
+    for root, _, files in os.walk(os.path.join(git_dir, "objects")):
+        for fname in files:
+            tot += os.path.getsize(os.path.join(root, fname))
+    return tot
+
+
+parser = argparse.ArgumentParser(
+    description="Compare full and shallow clone times of a feedstock",
+)
+parser.add_argument("--num-commits", type=int, default=2000)
+parser.add_argument("--blob-size", type=int, default=32 * 1024)
+parser.add_argument("--repeats", type=int, default=3)
+args = parser.parse_args()
+
+modes = [
+    ("full", dict(depth=0, filter_spec="")),
+    ("full+blob:none", dict(depth=0, filter_spec="blob:none")),
+    ("depth=1", dict(depth=1, filter_spec="")),
+    ("depth=1+blob:none", dict(depth=1, filter_spec="blob:none")),
+]
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    print(
+        "making repo with %d commits of %d bytes each..."
+        % (args.num_commits, args.blob_size),
+        flush=True,
+    )
+    remote = "file://" + make_bare_repo_with_history(
+        os.path.join(tmpdir, "remote.git"),
+        args.num_commits,
+        blob_size=args.blob_size,
+    )
+
+    for name, kwargs in modes:
+        times = []
+        for i in range(args.repeats):
+            dest = os.path.join(tmpdir, "%s-%d" % (name, i))
+            t0 = time.perf_counter()
+            git_repo = clone_feedstock(remote, dest, "main", **kwargs)
+            times.append(time.perf_counter() - t0)
+        print(
+            "%-20s best %8.3fs  objects %12d bytes"
+            % (name, min(times), _objects_size(git_repo.git_dir)),
+            flush=True,
+        )
@@ -0,0 +1,214 @@
+"""
+This script measures the end-to-end latency and throughput of dispatches
+without touching GitHub.
+
+It starts the fake GitHub in `webservices_dispatch_action/tests/fake_github.py`,
+makes a fixture feedstock with an open PR for each event, and runs the action's
+`main` for each event with `GITHUB_API_URL` and `GITHUB_SERVER_URL` pointed at
+the fake. By default, `conda smithy rerender` is replaced by a fake `conda` that
+commits a single file, so that the numbers measure the dispatcher itself
+(clone, API calls, push and comment) rather than smithy. Run it like
+
+    python tests/run_dispatch_benchmark.py --num-events 20 --max-p95 10
+
+Each event is run in a fresh process, as in GitHub Actions, unless
+`--mode inprocess` is given. With `--max-p95`, the script exits with 1 if the
+95th percentile latency is higher, so it can be used as a regression gate.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from webservices_dispatch_action.tests.conftest import GIT_ENV
+from webservices_dispatch_action.tests.fake_github import (
+    FakeGithubServer,
+    fixture_feedstock_files,
+    make_fake_conda,
+)
+
+MAIN_CMD = [
+    sys.executable,
+    "-c",
+    "from webservices_dispatch_action.__main__ import main; main()",
+]
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    idx = min(int(round(q * (len(values) - 1))), len(values) - 1)
+    return values[idx]
+
+
+def _make_events(server, num_events, num_outputs, num_commits):
+    events = []
+    for i in range(num_events):
+        name = "fixture-pkg-%d" % i
+        files = fixture_feedstock_files(name, num_outputs=num_outputs)
+        base = "conda-forge/%s-feedstock" % name
+        head = "regro/%s-feedstock" % name
+        server.add_repo(base, files=files)
+        server.add_repo(head, files=files, num_commits=num_commits)
+        server.add_branch(head, "pr-branch")
+        server.add_pull(base, 1, head, "pr-branch")
+        events.append(
+            {
+                "action": "rerender",
+                "client_payload": {"pr": 1},
+                "repository": {"full_name": base},
+            }
+        )
+    return events
+
+
+def _run_event(server, event, event_path, env, mode):
+    head = event["repository"]["full_name"].replace("conda-forge/", "regro/")
+    old_sha = server.head_sha(head, "pr-branch")
+
+    with open(event_path, "w") as fp:
+        json.dump(event, fp)
+
+    t0 = time.perf_counter()
+    if mode == "subprocess":
+        ret = subprocess.run(MAIN_CMD, env=env, capture_output=True)
+        ok = ret.returncode == 0
+        if not ok:
+            print(ret.stderr.decode("utf-8")[-2000:], file=sys.stderr)
+    else:
+        from webservices_dispatch_action.__main__ import main
+
+        try:
+            main()
+        except Exception as e:
+            print("event failed: %r" % e, file=sys.stderr)
+            ok = False
+        else:
+            ok = True
+    latency = time.perf_counter() - t0
+
+    # the rerender has to have been pushed
+    if ok and server.head_sha(head, "pr-branch") == old_sha:
+        print("event did not push to %s" % head, file=sys.stderr)
+        ok = False
+    return latency, ok
+
+
+parser = argparse.ArgumentParser(
+    description="Benchmark dispatches end to end against a fake GitHub",
+)
+parser.add_argument("--num-events", type=int, default=10)
+parser.add_argument(
+    "--num-outputs",
+    type=int,
+    default=0,
+    help="the number of extra outputs in each fixture recipe",
+)
+parser.add_argument(
+    "--num-commits",
+    type=int,
+    default=1,
+    help="the length of the history of each fixture feedstock",
+)
+parser.add_argument(
+    "--mode",
+    choices=["subprocess", "inprocess"],
+    default="subprocess",
+    help="run each event in a fresh process or all of them in this one",
+)
+parser.add_argument(
+    "--real-smithy",
+    action="store_true",
+    help="use the installed conda-smithy instead of a fake rerender",
+)
+parser.add_argument(
+    "--max-p95",
+    type=float,
+    default=None,
+    help="exit with 1 if the 95th percentile latency in seconds is higher",
+)
+parser.add_argument(
+    "--output",
+    type=str,
+    default=None,
+    help="a JSON file to write the results to",
+)
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    with FakeGithubServer(os.path.join(tmpdir, "github")) as server:
+        print("making %d fixture feedstocks..." % args.num_events, flush=True)
+        events = _make_events(
+            server, args.num_events, args.num_outputs, args.num_commits
+        )
+
+        event_path = os.path.join(tmpdir, "event.json")
+        env = {
+            **os.environ,
+            **GIT_ENV,
+            **server.env(),
+            "GITHUB_EVENT_PATH": event_path,
+            "GITHUB_EVENT_NAME": "repository_dispatch",
+            "INPUT_GITHUB_TOKEN": "fake-gha-token",
+            "INPUT_RERENDERING_GITHUB_TOKEN": "fake-app-token",
+        }
+        if not args.real_smithy:
+            bin_dir = os.path.join(tmpdir, "bin")
+            make_fake_conda(bin_dir)
+            env["PATH"] = bin_dir + os.pathsep + env["PATH"]
+        if args.mode == "inprocess":
+            os.environ.update(env)
+
+        print("running %d events (%s)..." % (len(events), args.mode), flush=True)
+        latencies = []
+        num_failed = 0
+        t0 = time.perf_counter()
+        for event in events:
+            latency, ok = _run_event(server, event, event_path, env, args.mode)
+            latencies.append(latency)
+            num_failed += 0 if ok else 1
+            print(
+                "    %s: %8.3fs %s"
+                % (event["repository"]["full_name"], latency, "ok" if ok else "FAILED"),
+                flush=True,
+            )
+        total = time.perf_counter() - t0
+        num_requests = len(server.requests)
+
+results = {
+    "mode": args.mode,
+    "num_events": len(latencies),
+    "num_failed": num_failed,
+    "latencies": latencies,
+    "mean": sum(latencies) / len(latencies),
+    "p50": _percentile(latencies, 0.5),
+    "p95": _percentile(latencies, 0.95),
+    "max": max(latencies),
+    "events_per_second": len(latencies) / total,
+    "api_requests_per_event": num_requests / len(latencies),
+}
+
+print(" ")
+print(
+    "latency mean %8.3fs  p50 %8.3fs  p95 %8.3fs  max %8.3fs"
+    % (results["mean"], results["p50"], results["p95"], results["max"])
+)
+print(
+    "throughput %8.3f events/s  %5.1f API requests/event  %d failed"
+    % (
+        results["events_per_second"],
+        results["api_requests_per_event"],
+        num_failed,
+    ),
+    flush=True,
+)
+
+if args.output is not None:
+    with open(args.output, "w") as fp:
+        json.dump(results, fp, indent=2)
+
+if num_failed or (args.max_p95 is not None and results["p95"] > args.max_p95):
+    sys.exit(1)
@@ -0,0 +1,535 @@
+"""
+This script times each phase of a dispatch on synthetic feedstocks of
+different sizes, stores the results per commit and compares them against an
+earlier run so that regressions are visible.
+
+The phases are
+
+ - `clone`: `git_utils.clone_feedstock` of the feedstock,
+ - `ensure_output_validation_is_on`: turning on output validation in
+   `conda-forge.yml` and staging it,
+ - `rerender_workflow_check`: `rerendering.rerender` without the permission to
+   change workflows, with a fake `conda smithy` that rewrites every variant
+   file in `.ci_support` and a workflow, so that the time is spent finding
+   and undoing the workflow changes,
+ - `rerender_no_workflow_changes`: the same, but with a rerender that leaves
+   the workflows alone, as most do,
+ - `update_version`: `version_updater.update_version` rewriting the recipe to
+   a new version and committing it (skipped if conda-forge-tick is not
+   installed), and
+ - `comment_and_push`: `utils.comment_and_push_if_changed` pushing a commit
+   and commenting on a PR of the fake GitHub in
+   `webservices_dispatch_action/tests/fake_github.py`.
+
+Along with the time, the number of processes each phase starts from Python
+(including GitPython's git processes) is counted.
+
+A feedstock size sets the number of outputs in the recipe, the number of
+variant files in `.ci_support` and the length of the history. Run it like
+
+    python tests/run_phase_benchmarks.py --sizes small,large --save
+    # ... change some code ...
+    python tests/run_phase_benchmarks.py --sizes small,large --compare main
+
+With `--save`, the results are written to `<results-dir>/<commit>.json`.
+With `--compare`, the median of each phase is compared to the results saved
+for the given commit (or branch, tag or JSON file) and the script exits with 1
+if any phase got slower than `--max-regression` times its old median.
+"""
+
+import argparse
+import datetime
+import hashlib
+import http.server
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+
+from github import Github
+
+from webservices_dispatch_action import global_sensitive_env
+from webservices_dispatch_action.git_utils import clone_feedstock
+from webservices_dispatch_action.rerendering import (
+    ensure_output_validation_is_on,
+    rerender,
+)
+from webservices_dispatch_action.tests.conftest import (
+    GIT_ENV,
+    make_bare_repo_with_history,
+)
+from webservices_dispatch_action.tests.fake_github import (
+    FakeGithubServer,
+    fixture_feedstock_files,
+)
+from webservices_dispatch_action.utils import comment_and_push_if_changed
+
+SIZES = {
+    "small": {"num_outputs": 0, "num_variants": 4, "num_commits": 10},
+    "medium": {"num_outputs": 20, "num_variants": 50, "num_commits": 200},
+    "large": {"num_outputs": 100, "num_variants": 300, "num_commits": 2000},
+}
+
+PHASES = [
+    "clone",
+    "ensure_output_validation_is_on",
+    "rerender_workflow_check",
+    "rerender_no_workflow_changes",
+    "update_version",
+    "comment_and_push",
+]
+
+# a stand-in for `conda smithy rerender` that rewrites every variant and
+# workflow file like a rerender after a pinning change does
+FAKE_CONDA_SCRIPT = """\
+#!/bin/sh
+set -e
+stamp="$$-$(date +%s%N)"
+files=".ci_support/*.yaml"
+if [ "${FAKE_SMITHY_CHANGE_WORKFLOWS}" = "1" ]; then
+    files="${files} .github/workflows/*.yml"
+fi
+for f in ${files}; do
+    echo "# rerendered $stamp" >> "$f"
+done
+git add .ci_support .github
+git commit -q -m "MNT: Re-rendered with fake conda-smithy"
+"""
+
+VARIANT_YAML = """\
+c_compiler:
+- gcc
+c_compiler_version:
+- '13'
+channel_sources:
+- conda-forge
+channel_targets:
+- conda-forge main
+python:
+- 3.%d.* *_cpython
+target_platform:
+- linux-64
+"""
+
+WORKFLOW_YAML = """\
+name: Build conda package
+on: [push, pull_request]
+jobs:
+  build:
+    runs-on: ubuntu-latest
+    steps:
+      - uses: actions/checkout@v4
+"""
+
+
+class _TarballHandler(http.server.BaseHTTPRequestHandler):
+    # serves the same source tarball for any URL so that the version updater
+    # can hash the new source without the network
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = self.server.tarball
+        self.send_response(200)
+        self.send_header("Content-Type", "application/gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _start_tarball_server():
+    data = b"print('hello')\n"
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tf:
+        info = tarfile.TarInfo("fixture-pkg/setup.py")
+        info.size = len(data)
+        tf.addfile(info, io.BytesIO(data))
+
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _TarballHandler)
+    httpd.daemon_threads = True
+    httpd.tarball = buf.getvalue()
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, hashlib.sha256(httpd.tarball).hexdigest()
+
+
+def _feedstock_files(name, size, source_url, source_sha256):
+    files = fixture_feedstock_files(name, num_outputs=size["num_outputs"])
+    files["recipe/meta.yaml"] = (
+        files["recipe/meta.yaml"]
+        .replace(
+            "https://example.com/{{ name }}",
+            source_url + "/{{ name }}",
+        )
+        .replace("0" * 64, source_sha256)
+    )
+    files["conda-forge.yml"] = (
+        "conda_forge_output_validation: false\n"
+        "provider:\n  linux_aarch64: default\n  linux_ppc64le: default\n"
+        "bot:\n  automerge: true\n"
+    )
+    for i in range(size["num_variants"]):
+        files[".ci_support/linux_64_python3.%d.yaml" % i] = VARIANT_YAML % i
+    files[".github/workflows/conda-build.yml"] = WORKFLOW_YAML
+    return files
+
+
+class _Context:
+    def __init__(self, tmpdir, server, size_name, size, source_url, source_sha256):
+        self.tmpdir = tmpdir
+        self.server = server
+        self.size_name = size_name
+        self.name = "fixture-pkg-%s" % size_name
+        self.base = "conda-forge/%s-feedstock" % self.name
+        self.head = "regro/%s-feedstock" % self.name
+
+        files = _feedstock_files(self.name, size, source_url, source_sha256)
+        for full_name in [self.base, self.head]:
+            pth = server.repo_path(full_name)
+            os.makedirs(os.path.dirname(pth), exist_ok=True)
+            make_bare_repo_with_history(
+                pth, size["num_commits"], blob_size=1024, files=files
+            )
+        server.add_branch(self.head, "pr-branch")
+        server.add_pull(self.base, 1, self.head, "pr-branch")
+        self.remote = "%s/%s.git" % (server.server_url, self.base)
+        self._num_clones = 0
+
+    def clone_dir(self):
+        self._num_clones += 1
+        return os.path.join(
+            self.tmpdir, "clones", "%s-%d" % (self.size_name, self._num_clones)
+        )
+
+    def clone(self, remote=None, branch="main"):
+        return clone_feedstock(remote or self.remote, self.clone_dir(), branch)
+
+
+def _setup_clone(ctx):
+    dest = ctx.clone_dir()
+    return lambda: clone_feedstock(ctx.remote, dest, "main")
+
+
+def _setup_ensure_output_validation_is_on(ctx):
+    git_repo = ctx.clone()
+    return lambda: ensure_output_validation_is_on(git_repo)
+
+
+def _setup_rerender(ctx, change_workflows):
+    git_repo = ctx.clone()
+    os.environ["FAKE_SMITHY_CHANGE_WORKFLOWS"] = "1" if change_workflows else "0"
+    # older versions of the workflow check ran git in the working directory
+    os.chdir(git_repo.working_dir)
+
+    def _run():
+        changed, rerender_error, info_message = rerender(git_repo, False)
+        assert changed and not rerender_error
+        assert (info_message is not None) == change_workflows
+
+    return _run
+
+
+def _setup_rerender_workflow_check(ctx):
+    return _setup_rerender(ctx, True)
+
+
+def _setup_rerender_no_workflow_changes(ctx):
+    return _setup_rerender(ctx, False)
+
+
+def _setup_update_version(ctx):
+    from webservices_dispatch_action.version_updater import update_version
+
+    git_repo = ctx.clone()
+
+    def _run():
+        changed, version_error = update_version(
+            git_repo, ctx.base, input_version="2.0.0"
+        )
+        assert changed and not version_error
+
+    return _run
+
+
+def _setup_comment_and_push(ctx):
+    owner, repo = ctx.head.split("/")
+    git_repo = ctx.clone(
+        remote="%s/%s.git" % (ctx.server.server_url, ctx.head), branch="pr-branch"
+    )
+    with open(os.path.join(git_repo.working_dir, "rerender.txt"), "w") as fp:
+        fp.write(str(time.time()))
+    git_repo.git.add("rerender.txt")
+    git_repo.git.commit("-q", "-m", "rerender")
+
+    gh = Github("fake-gha-token", base_url=ctx.server.api_url)
+    pull = gh.get_repo(ctx.base).get_pull(1)
+
+    def _run():
+        push_error = comment_and_push_if_changed(
+            action="rerender",
+            changed=True,
+            error=False,
+            git_repo=git_repo,
+            pull=pull,
+            pr_branch="pr-branch",
+            pr_owner=owner,
+            pr_repo=repo,
+            repo_name=ctx.base,
+            close_pr_if_no_changes_or_errors=False,
+            help_message="",
+            info_message="benchmark",
+        )
+        assert not push_error
+
+    return _run
+
+
+SETUPS = {
+    "clone": _setup_clone,
+    "ensure_output_validation_is_on": _setup_ensure_output_validation_is_on,
+    "rerender_workflow_check": _setup_rerender_workflow_check,
+    "rerender_no_workflow_changes": _setup_rerender_no_workflow_changes,
+    "update_version": _setup_update_version,
+    "comment_and_push": _setup_comment_and_push,
+}
+
+
+_NUM_SUBPROCESSES = [0]
+
+_execute_child = subprocess.Popen._execute_child
+
+
+def _counting_execute_child(self, *args, **kwargs):
+    # counts every process started from Python, GitPython's included
+    _NUM_SUBPROCESSES[0] += 1
+    return _execute_child(self, *args, **kwargs)
+
+
+subprocess.Popen._execute_child = _counting_execute_child
+
+
+def _time_phase(ctx, phase, repeats):
+    times = []
+    num_subprocesses = []
+    old_cwd = os.getcwd()
+    try:
+        for _ in range(repeats):
+            run = SETUPS[phase](ctx)
+            n0 = _NUM_SUBPROCESSES[0]
+            t0 = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - t0)
+            num_subprocesses.append(_NUM_SUBPROCESSES[0] - n0)
+    finally:
+        os.chdir(old_cwd)
+    return times, num_subprocesses
+
+
+def _git_output(*args):
+    try:
+        return subprocess.run(
+            ["git"] + list(args),
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _load_baseline(results_dir, ref):
+    if os.path.exists(ref):
+        pth = ref
+    else:
+        sha = _git_output("rev-parse", "--verify", ref + "^{commit}") or ref
+        pth = os.path.join(results_dir, sha + ".json")
+    with open(pth) as fp:
+        return json.load(fp)
+
+
+def _compare(baseline, results, max_regression):
+    print(" ")
+    print("compared to %s:" % baseline["commit"])
+    regressed = []
+    for key, res in results.items():
+        if key not in baseline["results"]:
+            print("%-48s %10s" % (key, "new"))
+            continue
+        old = baseline["results"][key]["median"]
+        ratio = res["median"] / old if old > 0 else float("inf")
+        flag = ""
+        if max_regression is not None and ratio > max_regression:
+            flag = "REGRESSED"
+            regressed.append(key)
+        print(
+            "%-48s %8.4fs -> %8.4fs  x%5.2f  subprocesses %3s -> %3d %s"
+            % (
+                key,
+                old,
+                res["median"],
+                ratio,
+                baseline["results"][key].get("subprocesses", "?"),
+                res["subprocesses"],
+                flag,
+            ),
+            flush=True,
+        )
+    return regressed
+
+
+parser = argparse.ArgumentParser(
+    description="Time each phase of a dispatch on synthetic feedstocks",
+)
+parser.add_argument(
+    "--sizes",
+    type=str,
+    default="small,medium",
+    help="a comma-separated list of feedstock sizes (%s)" % ", ".join(SIZES),
+)
+parser.add_argument(
+    "--phases",
+    type=str,
+    default=",".join(PHASES),
+    help="a comma-separated list of phases to time",
+)
+parser.add_argument("--repeats", type=int, default=5)
+parser.add_argument(
+    "--results-dir",
+    type=str,
+    default=".benchmarks",
+    help="the directory with the saved results of each commit",
+)
+parser.add_argument(
+    "--save",
+    action="store_true",
+    help="save the results for the current commit to the results directory",
+)
+parser.add_argument(
+    "--compare",
+    type=str,
+    default=None,
+    help="a commit, branch, tag or results file to compare against",
+)
+parser.add_argument(
+    "--max-regression",
+    type=float,
+    default=1.25,
+    help="with --compare, exit with 1 if a median is this many times slower",
+)
+args = parser.parse_args()
+
+sizes = args.sizes.split(",")
+phases = args.phases.split(",")
+for size_name in sizes:
+    if size_name not in SIZES:
+        parser.error("unknown size %r" % size_name)
+for phase in phases:
+    if phase not in SETUPS:
+        parser.error("unknown phase %r" % phase)
+if "update_version" in phases:
+    try:
+        import conda_forge_tick  # noqa: F401
+    except ImportError:
+        print("conda-forge-tick is not installed, skipping update_version")
+        phases.remove("update_version")
+
+# read before the benchmark changes directories
+commit = _git_output("rev-parse", "HEAD")
+baseline = (
+    _load_baseline(args.results_dir, args.compare) if args.compare is not None else None
+)
+results_dir = os.path.abspath(args.results_dir)
+
+os.environ.update(GIT_ENV)
+global_sensitive_env.classified_info.update(
+    {
+        "INPUT_GITHUB_TOKEN": "fake-gha-token",
+        "INPUT_RERENDERING_GITHUB_TOKEN": "fake-app-token",
+    }
+)
+
+results = {}
+with tempfile.TemporaryDirectory() as tmpdir:
+    bin_dir = os.path.join(tmpdir, "bin")
+    os.makedirs(bin_dir)
+    with open(os.path.join(bin_dir, "conda"), "w") as fp:
+        fp.write(FAKE_CONDA_SCRIPT)
+    os.chmod(os.path.join(bin_dir, "conda"), 0o755)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+
+    tarball_httpd, tarball_sha256 = _start_tarball_server()
+    source_url = "http://127.0.0.1:%d" % tarball_httpd.server_address[1]
+
+    with FakeGithubServer(os.path.join(tmpdir, "github")) as server:
+        os.environ.update(server.env())
+        for size_name in sizes:
+            print(
+                "making a %s feedstock (%s)..."
+                % (
+                    size_name,
+                    ", ".join("%s=%d" % kv for kv in SIZES[size_name].items()),
+                ),
+                flush=True,
+            )
+            ctx = _Context(
+                tmpdir,
+                server,
+                size_name,
+                SIZES[size_name],
+                source_url,
+                tarball_sha256,
+            )
+            for phase in phases:
+                times, num_subprocesses = _time_phase(ctx, phase, args.repeats)
+                key = "%s[%s]" % (phase, size_name)
+                results[key] = {
+                    "median": statistics.median(times),
+                    "min": min(times),
+                    "times": times,
+                    "subprocesses": max(num_subprocesses),
+                }
+                print(
+                    "%-48s median %8.4fs  best %8.4fs  subprocesses %3d"
+                    % (
+                        key,
+                        results[key]["median"],
+                        results[key]["min"],
+                        results[key]["subprocesses"],
+                    ),
+                    flush=True,
+                )
+
+    tarball_httpd.shutdown()
+    tarball_httpd.server_close()
+
+if args.save:
+    if commit is None:
+        sys.exit("cannot save results outside of a git repo")
+    os.makedirs(results_dir, exist_ok=True)
+    pth = os.path.join(results_dir, commit + ".json")
+    with open(pth, "w") as fp:
+        json.dump(
+            {
+                "commit": commit,
+                "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "sizes": {size_name: SIZES[size_name] for size_name in sizes},
+                "repeats": args.repeats,
+                "results": results,
+            },
+            fp,
+            indent=2,
+        )
+    print(" ")
+    print("saved results to %s" % pth)
+
+if baseline is not None:
+    if _compare(baseline, results, args.max_regression):
+        sys.exit(1)
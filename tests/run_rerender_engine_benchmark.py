@@ -0,0 +1,114 @@
+"""
+This script compares the latency of running `conda smithy rerender` in a
+subprocess versus calling smithy in a forked child, on a small fixture
+feedstock.
+
+It needs conda-smithy and conda-forge-pinning installed in the active env.
+Run it like
+
+    python tests/run_rerender_engine_benchmark.py --repeats 5
+
+smithy is imported up front, as the worker does, so the fork engine shows
+what a warm worker pays for each rerender.
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+from webservices_dispatch_action.rerendering import preload, run_conda_smithy_rerender
+
+META_YAML = """\
+{% set name = "fixture-pkg" %}
+{% set version = "1.0.0" %}
+
+package:
+  name: {{ name|lower }}
+  version: {{ version }}
+
+source:
+  url: https://pypi.io/packages/source/f/fixture-pkg/fixture-pkg-{{ version }}.tar.gz
+  sha256: 0000000000000000000000000000000000000000000000000000000000000000
+
+build:
+  number: 0
+  noarch: python
+  script: {{ PYTHON }} -m pip install . -vv
+
+requirements:
+  host:
+    - python >=3.8
+    - pip
+  run:
+    - python >=3.8
+
+test:
+  imports:
+    - fixture_pkg
+
+about:
+  home: https://github.com/conda-forge/webservices-dispatch-action
+  license: BSD-3-Clause
+  license_file: LICENSE
+  summary: a fixture package
+
+extra:
+  recipe-maintainers:
+    - conda-forge/core
+"""
+
+
+def _git(*args, cwd):
+    subprocess.run(["git"] + list(args), cwd=cwd, check=True, capture_output=True)
+
+
+def _make_fixture_feedstock(pth):
+    os.makedirs(os.path.join(pth, "recipe"))
+    with open(os.path.join(pth, "recipe", "meta.yaml"), "w") as fp:
+        fp.write(META_YAML)
+    with open(os.path.join(pth, "conda-forge.yml"), "w") as fp:
+        fp.write("conda_forge_output_validation: true\n")
+    _git("init", "-q", "-b", "main", cwd=pth)
+    _git("add", ".", cwd=pth)
+    _git("commit", "-q", "-m", "initial commit", cwd=pth)
+
+
+def _time_engine(engine, fixture, tmpdir, repeats):
+    os.environ["CF_WEBSERVICES_RERENDER_ENGINE"] = engine
+    times = []
+    for i in range(repeats):
+        dest = os.path.join(tmpdir, "%s-%d" % (engine, i))
+        _git("clone", "-q", fixture, dest, cwd=tmpdir)
+        t0 = time.perf_counter()
+        ret = run_conda_smithy_rerender(dest)
+        times.append(time.perf_counter() - t0)
+        assert ret == 0, "rerender failed with engine %s!" % engine
+    return times
+
+
+parser = argparse.ArgumentParser(
+    description="Compare subprocess and forked conda-smithy rerenders",
+)
+parser.add_argument("--repeats", type=int, default=3)
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    fixture = os.path.join(tmpdir, "fixture-pkg-feedstock")
+    _make_fixture_feedstock(fixture)
+
+    results = {}
+    preload()
+    for engine in ["subprocess", "fork"]:
+        print("rerendering with the %s engine..." % engine, flush=True)
+        results[engine] = _time_engine(engine, fixture, tmpdir, args.repeats)
+
+    print(" ")
+    for engine, times in results.items():
+        warm = times[1:] or times
+        print(
+            "%-12s first %8.3fs  warm mean %8.3fs  warm best %8.3fs"
+            % (engine, times[0], sum(warm) / len(warm), min(warm)),
+            flush=True,
+        )
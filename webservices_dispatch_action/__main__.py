@@ -1,221 +1,127 @@
+import contextlib
 import json
 import logging
 import os
 import pprint
-import subprocess
 import tempfile
 
-from git import Repo
-
 import webservices_dispatch_action
-from webservices_dispatch_action.api_sessions import (
-    create_api_sessions,
-    get_actor_token,
-)
-from webservices_dispatch_action.rerendering import (
-    rerender,
-)
-from webservices_dispatch_action.utils import comment_and_push_if_changed
+from webservices_dispatch_action import metrics, profiling, recording
+from webservices_dispatch_action.pr_context import load_pr_context
+from webservices_dispatch_action.tracing import span
 
 LOGGER = logging.getLogger(__name__)
 
+# the handlers are looked up by name in `webservices_dispatch_action.handlers`,
+# which is only imported once an event is known to be valid
+DISPATCH_ACTION_HANDLERS = {
+    "rerender": "handle_rerender",
+    "version_update": "handle_version_update",
+}
 
-def main():
-    logging.basicConfig(level=logging.INFO)
+CLOSED_PR_ERRORS = {
+    "rerender": "Closed PRs cannot be rerendered!",
+    "version_update": "Closed PRs cannot have their version updated!",
+}
 
-    LOGGER.info("making API clients")
 
-    with webservices_dispatch_action.sensitive_env():
-        _, gh = create_api_sessions(os.environ["INPUT_GITHUB_TOKEN"])
+def validate_event(event_name, event_data):
+    """Check that an event can be processed, without any API calls.
 
-    with open(os.environ["GITHUB_EVENT_PATH"], "r") as fp:
-        event_data = json.load(fp)
-    event_name = os.environ["GITHUB_EVENT_NAME"].lower()
+    Raises a `ValueError` for unsupported events or actions and for
+    malformed payloads.
+    """
+    if event_name not in ["repository_dispatch"]:
+        raise ValueError("GitHub event %s cannot be processed!" % event_name)
 
+    if event_data.get("action", None) not in DISPATCH_ACTION_HANDLERS:
+        raise ValueError(
+            "Dispatch action %s cannot be processed!" % event_data.get("action", None)
+        )
+
+    try:
+        int(event_data["client_payload"]["pr"])
+        event_data["repository"]["full_name"].split("/")
+    except (KeyError, TypeError, ValueError, AttributeError):
+        raise ValueError("Dispatch event payload is malformed!")
+
+
+def handle_event(gh, event_name, event_data):
+    """Process a single GitHub event.
+
+    Parameters
+    ----------
+    gh : github.MainClass.Github
+        A `Github` object from the PyGithub package.
+    event_name : str
+        The name of the GitHub event (e.g., `repository_dispatch`).
+    event_data : dict
+        The event payload, as found in the file at `GITHUB_EVENT_PATH`.
+    """
     LOGGER.info("github event: %s", event_name)
     LOGGER.info("github event data:\n%s\n", pprint.pformat(event_data))
 
-    if event_name in ["repository_dispatch"]:
-        if event_data["action"] == "rerender":
-            pr_num = int(event_data["client_payload"]["pr"])
-            repo_name = event_data["repository"]["full_name"]
-
-            gh_repo = gh.get_repo(repo_name)
-            pr = gh_repo.get_pull(pr_num)
-
-            if pr.state == "closed":
-                raise ValueError("Closed PRs cannot be rerendered!")
-
-            with tempfile.TemporaryDirectory() as tmpdir:
-                # clone the head repo
-                pr_branch = pr.head.ref
-                pr_owner = pr.head.repo.owner.login
-                pr_repo = pr.head.repo.name
-                repo_url = "https://github.com/%s/%s.git" % (
-                    pr_owner,
-                    pr_repo,
-                )
-                feedstock_dir = os.path.join(
-                    tmpdir,
-                    pr_repo,
-                )
-                git_repo = Repo.clone_from(
-                    repo_url,
-                    feedstock_dir,
-                    branch=pr_branch,
-                )
-
-                # rerender
-                _, _, can_change_workflows = get_actor_token()
-                changed, rerender_error, info_message = rerender(
-                    git_repo, can_change_workflows
-                )
-
-                # comment
-                push_error = comment_and_push_if_changed(
-                    action="rerender",
-                    changed=changed,
-                    error=rerender_error,
-                    git_repo=git_repo,
-                    pull=pr,
-                    pr_branch=pr_branch,
-                    pr_owner=pr_owner,
-                    pr_repo=pr_repo,
-                    repo_name=repo_name,
-                    close_pr_if_no_changes_or_errors=False,
-                    help_message=" or you can try [rerendeing locally](%s)"
-                    % (
-                        "https://conda-forge.org/docs/maintainer/updating_pkgs.html"
-                        "#rerendering-with-conda-smithy-locally"
-                    ),
-                    info_message=info_message,
-                )
-
-                if rerender_error or push_error:
-                    raise RuntimeError(
-                        "Rerendering failed! error in push|rerender: %s|%s"
-                        % (
-                            push_error,
-                            rerender_error,
-                        ),
-                    )
-        elif event_data["action"] == "version_update":
-            pr_num = int(event_data["client_payload"]["pr"])
-            repo_name = event_data["repository"]["full_name"]
-            input_version = event_data["client_payload"].get("input_version", None)
-
-            gh_repo = gh.get_repo(repo_name)
-            pr = gh_repo.get_pull(pr_num)
-
-            if pr.state == "closed":
-                raise ValueError("Closed PRs cannot have their version updated!")
-
-            with tempfile.TemporaryDirectory() as tmpdir:
-                # clone the head repo
-                pr_branch = pr.head.ref
-                pr_owner = pr.head.repo.owner.login
-                pr_repo = pr.head.repo.name
-                repo_url = "https://github.com/%s/%s.git" % (
-                    pr_owner,
-                    pr_repo,
-                )
-                feedstock_dir = os.path.join(
-                    tmpdir,
-                    pr_repo,
-                )
-                git_repo = Repo.clone_from(
-                    repo_url,
-                    feedstock_dir,
-                    branch=pr_branch,
-                )
-
-                _, _, can_change_workflows = get_actor_token()
-
-                # update version
-                curr_head = git_repo.active_branch.commit
-                cmd = (
-                    f"run-webservices-dispatch-action-version-updater "
-                    f"--feedstock-dir {feedstock_dir} "
-                    f"--repo-name {repo_name}"
-                )
-                if input_version:
-                    cmd += f" --input-version {input_version}"
-                LOGGER.info(f"Running command {cmd}")
-                ret = subprocess.run(
-                    cmd,
-                    shell=True,
-                    env=os.environ,
-                )
-                if ret.returncode != 0:
-                    version_error = True
-                    version_changed = False
-                elif git_repo.active_branch.commit == curr_head:
-                    version_error = False
-                    version_changed = False
-                else:
-                    version_error = False
-                    version_changed = True
-
-                version_push_error = comment_and_push_if_changed(
-                    action="update the version",
-                    changed=version_changed,
-                    error=version_error,
-                    git_repo=git_repo,
-                    pull=pr,
-                    pr_branch=pr_branch,
-                    pr_owner=pr_owner,
-                    pr_repo=pr_repo,
-                    repo_name=repo_name,
-                    close_pr_if_no_changes_or_errors=True,
-                    help_message="",
-                    info_message="",
-                )
-
-                if version_error or version_push_error:
-                    raise RuntimeError(
-                        "Updating version failed! error in "
-                        "push|version update: %s|%s"
-                        % (
-                            version_push_error,
-                            version_error,
-                        ),
-                    )
-
-                if version_changed:
-                    # rerender
-                    rerender_changed, rerender_error, info_message = rerender(
-                        git_repo, can_change_workflows
-                    )
-                    rerender_push_error = comment_and_push_if_changed(
-                        action="rerender",
-                        changed=rerender_changed,
-                        error=rerender_error,
-                        git_repo=git_repo,
-                        pull=pr,
-                        pr_branch=pr_branch,
-                        pr_owner=pr_owner,
-                        pr_repo=pr_repo,
-                        repo_name=repo_name,
-                        close_pr_if_no_changes_or_errors=False,
-                        help_message=" or you can try [rerendeing locally](%s)"
-                        % (
-                            "https://conda-forge.org/docs/maintainer/updating_pkgs.html"
-                            "#rerendering-with-conda-smithy-locally"
-                        ),
-                        info_message=info_message,
-                    )
-
-                    if rerender_error or rerender_push_error:
-                        raise RuntimeError(
-                            "Rerendering failed! error in push|rerender: %s|%s"
-                            % (
-                                push_error,
-                                rerender_error,
-                            ),
-                        )
-        else:
+    with span("dispatch", event=event_name) as dispatch_span:
+        try:
+            validate_event(event_name, event_data)
+        except ValueError:
+            dispatch_span.set_attributes(outcome="invalid")
+            raise
+
+        action = event_data["action"]
+        repo_name = event_data["repository"]["full_name"]
+        pr_num = int(event_data["client_payload"]["pr"])
+        dispatch_span.set_attributes(action=action, repo=repo_name, pr=pr_num)
+
+        with span("load_pr_context"):
+            ctx = load_pr_context(gh, repo_name, pr_num)
+        if ctx.state == "closed":
+            dispatch_span.set_attributes(outcome="closed_pr")
+            raise ValueError(CLOSED_PR_ERRORS[action])
+        if ctx.head_owner is None or ctx.head_repo is None:
+            # the fork of the PR head was deleted, so there is nothing to clone
+            dispatch_span.set_attributes(outcome="missing_head_repo")
             raise ValueError(
-                "Dispatch action %s cannot be processed!" % event_data["action"]
+                "The repository of the head of PR %s#%d no longer exists!"
+                % (repo_name, pr_num)
             )
-    else:
-        raise ValueError("GitHub event %s cannot be processed!" % event_name)
+
+        # imported here since the handlers pull in git, conda-smithy, etc.
+        with span("import_handlers"):
+            from webservices_dispatch_action import handlers
+
+        getattr(handlers, DISPATCH_ACTION_HANDLERS[action])(gh, event_data, ctx)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    with open(os.environ["GITHUB_EVENT_PATH"], "r") as fp:
+        event_data = json.load(fp)
+    event_name = os.environ["GITHUB_EVENT_NAME"].lower()
+
+    # reject events we cannot process before doing any work
+    validate_event(event_name, event_data)
+
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(profiling.profile("dispatch"))
+
+        if metrics.get_metrics_file() is not None:
+            # collect the metrics of the forked version updater too
+            metrics.set_process_dir(stack.enter_context(tempfile.TemporaryDirectory()))
+            stack.callback(metrics.set_process_dir, None)
+            stack.callback(metrics.write_metrics_file)
+
+        record_path = recording.get_record_path()
+        if record_path is not None:
+            stack.enter_context(recording.record(record_path, event_name, event_data))
+
+        LOGGER.info("making API clients")
+
+        # imported here since PyGithub and requests are slow to import
+        from webservices_dispatch_action.api_sessions import create_api_sessions
+
+        with webservices_dispatch_action.sensitive_env():
+            _, gh = create_api_sessions(os.environ["INPUT_GITHUB_TOKEN"])
+
+        handle_event(gh, event_name, event_data)
@@ -1,36 +1,89 @@
+import hashlib
 import os
+import threading
 import time
 
 import requests
 import urllib3.util.retry
-from github import Github
 
 from . import sensitive_env
+from .github_http import PooledGithub, get_session
 
+# stop using a token this many seconds before it expires
+TOKEN_EXPIRY_MARGIN = 120
 
-def get_actor_token():
+# maps a hash of a rerendering token to the time at which it expires
+_TOKEN_EXPIRY_CACHE = {}
+_TOKEN_EXPIRY_CACHE_LOCK = threading.Lock()
+
+
+def get_github_api_url():
+    """Get the URL of the GitHub API from `GITHUB_API_URL` (default
+    `https://api.github.com`)."""
+    return (os.environ.get("GITHUB_API_URL", "") or "https://api.github.com").rstrip(
+        "/"
+    )
+
+
+def _hash_token(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def clear_actor_token_cache():
+    """Forget the expiry times of all of the tokens probed so far."""
+    with _TOKEN_EXPIRY_CACHE_LOCK:
+        _TOKEN_EXPIRY_CACHE.clear()
+
+
+def get_actor_token(force_refresh=False):
+    """Get the actor and token to push with.
+
+    The rerendering token is probed once to find when it expires and that time
+    is cached, so later calls do not make any API requests until shortly
+    before the token expires.
+
+    Parameters
+    ----------
+    force_refresh : bool, optional
+        If True, probe the rerendering token even if it was probed before.
+
+    Returns
+    -------
+    actor : str
+        The actor to push as.
+    token : str
+        The token to push with.
+    can_change_workflows : bool
+        True if the token can change the GitHub Actions workflows.
+    """
     with sensitive_env():
         # we use the token reset time as a proxy for when it expires
         # by default the app tokens have 1 hour and that is the same as the token
         # reset time.
         # I could not figure out how to get the actual reset time.
         now = time.time()
-        reset_time = now - 10  # default the token to "expired"
-        if (
-            "INPUT_RERENDERING_GITHUB_TOKEN" in os.environ
-            and len(os.environ["INPUT_RERENDERING_GITHUB_TOKEN"]) > 0
-        ):
-            try:
-                # make sure the token works
-                gh = Github(os.environ["INPUT_RERENDERING_GITHUB_TOKEN"])
-                reset_time = gh.rate_limiting_resettime
-            except Exception:
-                gh = None
-        else:
-            gh = None
+        reset_time = None
+        token = os.environ.get("INPUT_RERENDERING_GITHUB_TOKEN", "")
+        if len(token) > 0:
+            key = _hash_token(token)
+            with _TOKEN_EXPIRY_CACHE_LOCK:
+                if force_refresh:
+                    _TOKEN_EXPIRY_CACHE.pop(key, None)
+                reset_time = _TOKEN_EXPIRY_CACHE.get(key, None)
+
+            if reset_time is None or reset_time - TOKEN_EXPIRY_MARGIN <= now:
+                try:
+                    # make sure the token works
+                    gh = PooledGithub(token, base_url=get_github_api_url())
+                    reset_time = gh.rate_limiting_resettime
+                except Exception:
+                    reset_time = None
+                else:
+                    with _TOKEN_EXPIRY_CACHE_LOCK:
+                        _TOKEN_EXPIRY_CACHE[key] = reset_time
 
-        if gh is not None and reset_time > now:
-            return "x-access-token", os.environ["INPUT_RERENDERING_GITHUB_TOKEN"], True
+        if reset_time is not None and reset_time > now:
+            return "x-access-token", token, True
         else:
             return "x-access-token", os.environ["INPUT_GITHUB_TOKEN"], False
 
@@ -48,13 +101,18 @@ def create_api_sessions(github_token):
     session : requests.Session
         A `requests` session w/ the beta `check_run` API configured.
     gh : github.MainClass.Github
-        A `Github` object from the PyGithub package.
+        A `Github` object from the PyGithub package, which uses the shared
+        HTTP layer (see `github_http.PooledGithub`).
     """
     # based on
     #  https://alexwlchan.net/2019/03/
     #    creating-a-github-action-to-auto-merge-pull-requests/
     # with lots of edits
+    retry = urllib3.util.retry.Retry(total=10, backoff_factor=0.1)
+
+    # share the connection pool with the rest of the GitHub calls
     sess = requests.Session()
+    sess.mount("https://", get_session(retry=retry).get_adapter("https://"))
     sess.headers = {
         "Accept": "; ".join(
             [
@@ -77,8 +135,6 @@ def create_api_sessions(github_token):
     sess.hooks["response"].append(raise_for_status)
 
     # build a github object too
-    gh = Github(
-        github_token, retry=urllib3.util.retry.Retry(total=10, backoff_factor=0.1)
-    )
+    gh = PooledGithub(github_token, base_url=get_github_api_url(), retry=retry)
 
     return sess, gh
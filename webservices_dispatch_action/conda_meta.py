@@ -0,0 +1,105 @@
+import glob
+import importlib.resources
+import json
+import logging
+import os
+import sys
+
+LOGGER = logging.getLogger(__name__)
+
+# the package metadata of the conda-forge channel, as read by conda-smithy to
+# find the latest conda-forge-pinning
+CHANNEL_PACKAGE_URL = "https://api.anaconda.org/package/conda-forge/%s"
+
+CHANNEL_PACKAGE_TIMEOUT = 30
+
+# the package data file with the package versions the image is pinned to
+PKG_VERSIONS_RESOURCE = "pkg_versions.json"
+
+
+def get_conda_prefix():
+    """Get the prefix of the active conda environment."""
+    return os.environ.get("CONDA_PREFIX", sys.prefix)
+
+
+def get_installed_version(name, prefix=None):
+    """Get the version of a conda package from the env metadata, without calling conda.
+
+    Parameters
+    ----------
+    name : str
+        The name of the package.
+    prefix : str, optional
+        The prefix of the environment. Defaults to the active environment.
+
+    Returns
+    -------
+    version : str or None
+        The installed version or None if the package is not installed.
+    """
+    prefix = prefix or get_conda_prefix()
+    # the file names are <name>-<version>-<build>.json and names can have dashes
+    for fname in glob.glob(os.path.join(prefix, "conda-meta", name + "-*.json")):
+        if os.path.basename(fname).rsplit("-", 2)[0] != name:
+            continue
+        with open(fname, "r") as fp:
+            return json.load(fp)["version"]
+    return None
+
+
+def _version_key(version):
+    return tuple(int(part) for part in version.split("."))
+
+
+def get_latest_channel_version(name):
+    """Get the latest version of a package on the conda-forge channel.
+
+    This is how `conda smithy rerender` finds the conda-forge-pinning it
+    downloads and renders against: one call to the anaconda.org API, skipping
+    files labeled `broken`. Only versions made of numbers (e.g.,
+    `2024.08.01.06.03.20`) are supported.
+
+    Parameters
+    ----------
+    name : str
+        The name of the package.
+
+    Returns
+    -------
+    version : str or None
+        The latest version or None if it cannot be found.
+    """
+    # imported here since the environment check uses this module too
+    import requests
+
+    try:
+        resp = requests.get(CHANNEL_PACKAGE_URL % name, timeout=CHANNEL_PACKAGE_TIMEOUT)
+        resp.raise_for_status()
+        versions = [
+            f["version"]
+            for f in resp.json()["files"]
+            if "broken" not in f.get("labels", ())
+        ]
+        return max(versions, key=_version_key)
+    except Exception as e:
+        LOGGER.warning("could not get the latest version of %s: %r", name, e)
+        return None
+
+
+def load_pkg_versions(pth=None):
+    """Load the package versions the image is pinned to from `pkg_versions.json`.
+
+    The file is read from the package data unless a path is given. Raises
+    `FileNotFoundError` if it cannot be found (e.g., the package was installed
+    without its data), since an empty pin list would match any environment.
+    """
+    if pth is None:
+        data = (
+            importlib.resources.files(__package__)
+            .joinpath(PKG_VERSIONS_RESOURCE)
+            .read_text()
+        )
+    else:
+        with open(pth, "r") as fp:
+            data = fp.read()
+    return json.loads(data)
@@ -0,0 +1,104 @@
+import sys
+
+import click
+
+from .conda_meta import get_conda_prefix, get_installed_version, load_pkg_versions
+
+# entries of `pkg_versions.json` that are not packages
+NON_PACKAGE_KEYS = ["conda-forge-webservices-update-timestamp"]
+
+
+def check_env(pkg_versions=None, prefix=None):
+    """Compare the packages installed in an environment to `pkg_versions.json`.
+
+    Only the conda metadata of the environment is read, so this takes a few
+    milliseconds.
+
+    Parameters
+    ----------
+    pkg_versions : dict, optional
+        The pinned package versions. Defaults to the contents of
+        `pkg_versions.json`, which must exist.
+    prefix : str, optional
+        The prefix of the environment. Defaults to the active environment.
+
+    Returns
+    -------
+    mismatches : dict
+        A dict mapping the name of each package whose installed version does
+        not match the pin to a tuple of `(pinned version, installed version)`.
+        The installed version is None if the package is not installed.
+    """
+    if pkg_versions is None:
+        pkg_versions = load_pkg_versions()
+    prefix = prefix or get_conda_prefix()
+
+    mismatches = {}
+    for name, version in sorted(pkg_versions.items()):
+        if name in NON_PACKAGE_KEYS:
+            continue
+        installed = get_installed_version(name, prefix=prefix)
+        if installed != version:
+            mismatches[name] = (version, installed)
+    return mismatches
+
+
+@click.command()
+@click.option(
+    "--prefix",
+    default=None,
+    type=str,
+    help="The prefix of the environment to check (default: the active one)",
+)
+@click.option(
+    "--pkg-versions",
+    "pkg_versions_path",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="The path to the pinned versions (default: the packaged pkg_versions.json)",
+)
+@click.option(
+    "--specs",
+    is_flag=True,
+    help="Print the specs of the packages to install, one per line",
+)
+@click.option(
+    "--pinned",
+    is_flag=True,
+    help=(
+        "Print the specs of every pinned package, one per line, for conda's "
+        "conda-meta/pinned file, without checking the environment"
+    ),
+)
+def main(prefix, pkg_versions_path, specs, pinned):
+    """Check the environment against the pinned package versions.
+
+    Exits with 1 if any pinned package has a different version installed, or
+    with 2 if the pinned versions cannot be loaded.
+    """
+    try:
+        pkg_versions = load_pkg_versions(pkg_versions_path)
+    except (OSError, ValueError) as e:
+        click.echo("could not load the pinned package versions: %s" % e, err=True)
+        sys.exit(2)
+
+    if pinned:
+        for name, version in sorted(pkg_versions.items()):
+            if name not in NON_PACKAGE_KEYS:
+                click.echo("%s==%s" % (name, version))
+        sys.exit(0)
+
+    mismatches = check_env(pkg_versions=pkg_versions, prefix=prefix)
+
+    for name, (version, installed) in mismatches.items():
+        if specs:
+            click.echo("%s==%s" % (name, version))
+        else:
+            click.echo(
+                "%s: pinned %s, installed %s" % (name, version, installed), err=True
+            )
+
+    if not mismatches and not specs:
+        click.echo("the environment matches the pinned package versions", err=True)
+
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,162 @@
+import fcntl
+import logging
+import os
+import re
+import shutil
+import time
+from contextlib import contextmanager
+
+from git import Repo
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 5 * 1024**3
+
+REPO_KEY_RE = re.compile(r"^[A-Za-z0-9_.-]+/[A-Za-z0-9_.-]+$")
+
+
+def dir_size(pth):
+    """Get the total size in bytes of the files under a directory."""
+    tot = 0
+    for root, _, files in os.walk(pth):
+        for fname in files:
+            try:
+                tot += os.lstat(os.path.join(root, fname)).st_size
+            except FileNotFoundError:
+                pass
+    return tot
+
+
+class GitMirrorCache:
+    """An on-disk cache of bare mirrors of feedstock repos.
+
+    Each repo is stored as a bare repo at `<cache_dir>/<owner>/<repo>.git` that
+    tracks all of the branches of the remote and is fetched incrementally. Access
+    to a mirror is serialized across processes with a lock file next to it, and
+    the least recently used mirrors are removed once the cache is bigger than
+    `max_size` bytes.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The directory holding the mirrors.
+    max_size : int, optional
+        The maximum total size of the cache in bytes.
+    """
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def mirror_path(self, repo_key):
+        if not REPO_KEY_RE.match(repo_key) or ".." in repo_key:
+            raise ValueError("Invalid repo key %r for the git cache!" % repo_key)
+        return os.path.join(self.cache_dir, repo_key + ".git")
+
+    def _stamp_path(self, mirror_path):
+        return os.path.join(mirror_path, "last-used")
+
+    @contextmanager
+    def lock(self, repo_key, blocking=True):
+        """Hold an exclusive lock on the mirror for `repo_key`.
+
+        If `blocking` is False and the lock is held elsewhere, yields False
+        instead of waiting.
+        """
+        lock_path = self.mirror_path(repo_key) + ".lock"
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, "a") as fp:
+            flags = fcntl.LOCK_EX
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(fp.fileno(), flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+
+    def has_mirror(self, repo_key):
+        """Return True if the cache has a mirror for `repo_key`."""
+        return os.path.exists(os.path.join(self.mirror_path(repo_key), "HEAD"))
+
+    def update(self, repo_key, repo_url):
+        """Create or incrementally fetch the mirror for `repo_key`.
+
+        The caller must hold the lock for `repo_key`.
+
+        Returns
+        -------
+        mirror_path : str
+            The path to the bare mirror.
+        """
+        pth = self.mirror_path(repo_key)
+        if self.has_mirror(repo_key):
+            LOGGER.info("fetching into git cache for %s", repo_key)
+            mirror = Repo(pth)
+            mirror.remotes.origin.set_url(repo_url)
+            mirror.git.fetch("--prune", "origin")
+        else:
+            LOGGER.info("populating git cache for %s", repo_key)
+            shutil.rmtree(pth, ignore_errors=True)
+            mirror = Repo.clone_from(repo_url, pth, bare=True)
+            with mirror.config_writer() as cfg:
+                cfg.set_value('remote "origin"', "fetch", "+refs/heads/*:refs/heads/*")
+
+        with open(self._stamp_path(pth), "w") as fp:
+            fp.write(str(time.time()))
+        return pth
+
+    def _mirrors(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for owner in os.listdir(self.cache_dir):
+            owner_dir = os.path.join(self.cache_dir, owner)
+            if not os.path.isdir(owner_dir):
+                continue
+            for name in os.listdir(owner_dir):
+                if name.endswith(".git"):
+                    yield owner + "/" + name[: -len(".git")]
+
+    def evict(self, keep=()):
+        """Remove the least recently used mirrors until the cache fits.
+
+        Mirrors in `keep` and mirrors locked by other processes are never removed.
+        """
+        entries = []
+        for repo_key in self._mirrors():
+            pth = self.mirror_path(repo_key)
+            try:
+                last_used = os.path.getmtime(self._stamp_path(pth))
+            except OSError:
+                last_used = 0
+            entries.append((last_used, repo_key, dir_size(pth)))
+
+        tot = sum(e[2] for e in entries)
+        for _, repo_key, size in sorted(entries):
+            if tot <= self.max_size:
+                break
+            if repo_key in keep:
+                continue
+            with self.lock(repo_key, blocking=False) as locked:
+                if not locked:
+                    continue
+                LOGGER.info("evicting %s (%d bytes) from git cache", repo_key, size)
+                shutil.rmtree(self.mirror_path(repo_key), ignore_errors=True)
+                tot -= size
+
+        return tot
+
+
+def get_git_cache():
+    """Get the git cache configured in the environment, if any."""
+    cache_dir = os.environ.get("CF_WEBSERVICES_GIT_CACHE_DIR", "")
+    if not cache_dir:
+        return None
+    max_size = int(
+        os.environ.get("CF_WEBSERVICES_GIT_CACHE_MAX_SIZE", DEFAULT_MAX_SIZE)
+    )
+    return GitMirrorCache(cache_dir, max_size=max_size)
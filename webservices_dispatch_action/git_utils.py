@@ -0,0 +1,197 @@
+import io
+import logging
+import os
+import shutil
+import stat
+
+from git import Blob, GitCommandError, Repo
+from gitdb import IStream, LooseObjectDB
+
+from .git_cache import dir_size, get_git_cache
+from .metrics import CACHE_LOOKUPS
+from .recording import record_cloned_repo
+from .tracing import is_enabled as tracing_is_enabled
+from .tracing import set_span_attributes
+
+LOGGER = logging.getLogger(__name__)
+
+# conda-smithy commits on top of the cloned head and the rerender logic only
+# ever looks at HEAD~1 (the cloned head itself), so one commit is enough.
+DEFAULT_CLONE_DEPTH = 1
+
+# how many times we will try to deepen a shallow clone before giving up
+MAX_DEEPEN_ATTEMPTS = 8
+
+
+def get_clone_depth():
+    """Get the clone depth from the environment. A depth of 0 means a full clone."""
+    return int(os.environ.get("CF_WEBSERVICES_CLONE_DEPTH", DEFAULT_CLONE_DEPTH))
+
+
+def get_clone_filter():
+    """Get the partial clone filter (e.g., `blob:none`) from the environment."""
+    return os.environ.get("CF_WEBSERVICES_CLONE_FILTER", "") or None
+
+
+def clone_feedstock(
+    repo_url, feedstock_dir, branch, depth=None, filter_spec=None, repo_key=None
+):
+    """Clone a single branch of a feedstock, fetching as little as possible.
+
+    If a git cache is configured via `CF_WEBSERVICES_GIT_CACHE_DIR` and
+    `repo_key` is given, the cached mirror of the repo is fetched incrementally
+    and the clone is made from it. The `origin` remote of the clone always
+    points at `repo_url`.
+
+    Parameters
+    ----------
+    repo_url : str
+        The URL of the repo to clone.
+    feedstock_dir : str
+        The directory to clone into.
+    branch : str
+        The branch to clone.
+    depth : int, optional
+        The number of commits of history to fetch. If not given, the value from
+        `CF_WEBSERVICES_CLONE_DEPTH` is used. Zero means fetch the full history.
+    filter_spec : str, optional
+        A partial clone filter like `blob:none`. If not given, the value from
+        `CF_WEBSERVICES_CLONE_FILTER` is used.
+    repo_key : str, optional
+        The `owner/repo` key of the repo in the git cache.
+
+    Returns
+    -------
+    git_repo : git.Repo
+        The cloned repo.
+    """
+    if depth is None:
+        depth = get_clone_depth()
+    if filter_spec is None:
+        filter_spec = get_clone_filter()
+
+    kwargs = {"branch": branch, "single_branch": True}
+    if depth > 0:
+        kwargs["depth"] = depth
+
+    cache = get_git_cache() if repo_key is not None else None
+    if cache is not None:
+        try:
+            with cache.lock(repo_key):
+                CACHE_LOOKUPS.inc(
+                    cache="git",
+                    result="hit" if cache.has_mirror(repo_key) else "miss",
+                )
+                mirror_path = cache.update(repo_key, repo_url)
+                LOGGER.info("cloning branch %s from git cache", branch)
+                git_repo = Repo.clone_from(
+                    "file://" + mirror_path, feedstock_dir, **kwargs
+                )
+            git_repo.remotes.origin.set_url(repo_url)
+        except Exception as e:
+            LOGGER.warning("could not use the git cache for %s: %r", repo_key, e)
+            shutil.rmtree(feedstock_dir, ignore_errors=True)
+        else:
+            cache.evict(keep=(repo_key,))
+            _set_clone_span_attributes(git_repo, "git_cache")
+            record_cloned_repo(repo_url, git_repo, branch, repo_key=repo_key)
+            return git_repo
+
+    if filter_spec:
+        kwargs["filter"] = filter_spec
+
+    LOGGER.info(
+        "cloning branch %s (depth=%s, filter=%s)", branch, depth or "full", filter_spec
+    )
+    git_repo = Repo.clone_from(repo_url, feedstock_dir, **kwargs)
+    _set_clone_span_attributes(git_repo, "remote")
+    record_cloned_repo(repo_url, git_repo, branch, repo_key=repo_key)
+    return git_repo
+
+
+def _set_clone_span_attributes(git_repo, source):
+    # only walk the clone if the span goes somewhere
+    if tracing_is_enabled():
+        set_span_attributes(source=source, bytes=dir_size(git_repo.git_dir))
+
+
+def is_shallow(git_repo):
+    """Return True if the repo is a shallow clone."""
+    return os.path.exists(os.path.join(git_repo.git_dir, "shallow"))
+
+
+def _rev_exists(git_repo, rev):
+    try:
+        git_repo.git.rev_parse("--verify", "--quiet", rev + "^{commit}")
+    except GitCommandError:
+        return False
+    else:
+        return True
+
+
+def ensure_history(git_repo, rev):
+    """Make sure `rev` can be resolved, deepening a shallow clone if needed.
+
+    Parameters
+    ----------
+    git_repo : git.Repo
+        The repo to check.
+    rev : str
+        The revision that has to exist, e.g. `HEAD~1`.
+
+    Returns
+    -------
+    exists : bool
+        True if the revision exists once this function returns.
+    """
+    deepen_by = max(get_clone_depth(), 1)
+    for _ in range(MAX_DEEPEN_ATTEMPTS):
+        if _rev_exists(git_repo, rev):
+            return True
+
+        if not is_shallow(git_repo):
+            return False
+
+        LOGGER.info("deepening shallow clone by %d commits to find %s", deepen_by, rev)
+        try:
+            git_repo.git.fetch(
+                "--deepen=%d" % deepen_by,
+                "origin",
+                git_repo.active_branch.name,
+            )
+        except GitCommandError as e:
+            LOGGER.warning("could not deepen shallow clone: %r", e)
+            return False
+        deepen_by *= 2
+
+    return _rev_exists(git_repo, rev)
+
+
+def stage_files(git_repo, paths):
+    """Stage files like `git add` without starting any git processes.
+
+    The blobs are written to the loose object store in Python (GitPython would
+    start a `git hash-object` for each file) and then added to the index.
+
+    Parameters
+    ----------
+    git_repo : git.Repo
+        The repo.
+    paths : list of str
+        The paths of the files to stage, relative to the root of the repo.
+    """
+    odb = LooseObjectDB(os.path.join(git_repo.git_dir, "objects"))
+    blobs = []
+    for path in paths:
+        pth = os.path.join(git_repo.working_dir, path)
+        st = os.lstat(pth)
+        if stat.S_ISLNK(st.st_mode):
+            data = os.readlink(pth).encode("utf-8")
+            mode = Blob.link_mode
+        else:
+            with open(pth, "rb") as fp:
+                data = fp.read()
+            mode = Blob.executable_mode if st.st_mode & 0o100 else Blob.file_mode
+        istream = odb.store(IStream(Blob.type, len(data), io.BytesIO(data)))
+        blobs.append(Blob(git_repo, istream.binsha, mode, path))
+    git_repo.index.add(blobs)
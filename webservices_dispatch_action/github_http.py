@@ -0,0 +1,559 @@
+import collections
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import requests
+import urllib3.util.retry
+from github import Github
+from github.Requester import Requester, RequestsResponse
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_ETAG_CACHE_SIZE = 512
+DEFAULT_RATE_LIMIT_RESERVE = 0.1
+# one-shot dispatches hold a GitHub Actions job while they wait, so only the
+# worker waits long
+DEFAULT_RATE_LIMIT_MAX_WAIT = 60
+WORKER_RATE_LIMIT_MAX_WAIT = 900
+DEFAULT_RATE_LIMIT_RETRIES = 3
+
+# the wait used for secondary rate limits that do not say how long to wait
+SECONDARY_RATE_LIMIT_WAIT = 60
+
+# counts of what the HTTP layer did, e.g. `requests`, `etag_hits`
+HTTP_STATS = collections.Counter()
+
+_LOCK = threading.Lock()
+_SESSIONS = {}
+_ETAG_CACHE = None
+_BUDGETS = {}
+_EXCHANGE_HOOKS = []
+_DEFAULT_RATE_LIMIT_MAX_WAIT = DEFAULT_RATE_LIMIT_MAX_WAIT
+
+# replaced in the tests
+_sleep = time.sleep
+
+
+def get_pool_size():
+    """Get the maximum number of connections kept open per host."""
+    return int(os.environ.get("CF_WEBSERVICES_HTTP_POOL_SIZE", DEFAULT_POOL_SIZE))
+
+
+def get_rate_limit_reserve():
+    """Get the fraction of the rate limit below which requests are spread out."""
+    return float(
+        os.environ.get("CF_WEBSERVICES_RATE_LIMIT_RESERVE", DEFAULT_RATE_LIMIT_RESERVE)
+    )
+
+
+def get_rate_limit_max_wait():
+    """Get the longest time in seconds to wait for a rate limit to reset."""
+    return float(
+        os.environ.get(
+            "CF_WEBSERVICES_RATE_LIMIT_MAX_WAIT", _DEFAULT_RATE_LIMIT_MAX_WAIT
+        )
+    )
+
+
+def set_default_rate_limit_max_wait(seconds):
+    """Set the longest wait on a rate limit used when the environment does not
+    set one (e.g., `WORKER_RATE_LIMIT_MAX_WAIT` in the worker)."""
+    global _DEFAULT_RATE_LIMIT_MAX_WAIT
+    _DEFAULT_RATE_LIMIT_MAX_WAIT = seconds
+
+
+def get_rate_limit_retries():
+    """Get the number of times a rate limited request is retried."""
+    return int(
+        os.environ.get("CF_WEBSERVICES_RATE_LIMIT_RETRIES", DEFAULT_RATE_LIMIT_RETRIES)
+    )
+
+
+def get_etag_cache_size():
+    """Get the number of responses kept for conditional requests (0 disables)."""
+    return int(
+        os.environ.get("CF_WEBSERVICES_HTTP_ETAG_CACHE_SIZE", DEFAULT_ETAG_CACHE_SIZE)
+    )
+
+
+class ETagCache:
+    """An in-memory LRU cache of GET responses with an `ETag` header.
+
+    Responses are keyed by the URL and by a hash of the headers that change
+    what the API returns (e.g., the token), so one token never sees the
+    responses fetched with another.
+    """
+
+    def __init__(self, max_size=DEFAULT_ETAG_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url, headers):
+        hsh = hashlib.sha256()
+        for name in ("Authorization", "Accept", "X-GitHub-Api-Version"):
+            hsh.update(("%s\0%s\0" % (name, headers.get(name, ""))).encode("utf-8"))
+        return url, hsh.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, etag, headers, body):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (etag, headers, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CachedResponse:
+    """A response served from the `ETagCache` after a `304 Not Modified`."""
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def getheaders(self):
+        return self.headers.items()
+
+    def read(self):
+        return self.body
+
+
+def _without_rate_limit_retries(retry):
+    # rate limits are handled with the budgets, so urllib3 must not retry them
+    # (PyGithub's GithubRetry sleeps on 403s itself)
+    if not isinstance(retry, urllib3.util.retry.Retry):
+        return retry
+    return urllib3.util.retry.Retry(
+        total=retry.total,
+        connect=retry.connect,
+        read=retry.read,
+        status=retry.status,
+        backoff_factor=retry.backoff_factor,
+        allowed_methods=retry.allowed_methods,
+        status_forcelist=[
+            s for s in (retry.status_forcelist or []) if s not in (403, 429)
+        ],
+        respect_retry_after_header=False,
+    )
+
+
+def _retry_key(retry):
+    if retry is None or isinstance(retry, int):
+        return retry
+    return (type(retry), retry.total, retry.backoff_factor)
+
+
+def _hash_auth(headers):
+    auth = headers.get("Authorization", "")
+    if not auth:
+        return "anonymous"
+    return hashlib.sha256(auth.encode("utf-8")).hexdigest()[:12]
+
+
+def _get_resource(url):
+    if url.startswith("/graphql") or url.startswith("/api/graphql"):
+        return "graphql"
+    if "/search/" in url:
+        return "search"
+    return "core"
+
+
+class RateLimitBudget:
+    """The rate limit budget of a token for one GitHub API resource (e.g.,
+    `core` or `graphql`), as last reported by the API.
+
+    Once the remaining requests drop below `reserve` times the limit, requests
+    are spread out evenly until the limit resets. A `Retry-After` or a
+    secondary rate limit blocks all requests with the token for that long.
+    Waits longer than `max_wait` are skipped, so that a request that is still
+    rate limited fails right away instead of holding the job.
+    """
+
+    def __init__(self, token, resource, reserve=None, max_wait=None):
+        self.token = token
+        self.resource = resource
+        self.reserve = get_rate_limit_reserve() if reserve is None else reserve
+        self.max_wait = get_rate_limit_max_wait() if max_wait is None else max_wait
+        self.limit = None
+        self.remaining = None
+        self.used = None
+        self.reset = None
+        self.blocked_until = 0
+        self._lock = threading.Lock()
+
+    def update(self, headers):
+        """Update the budget from the headers of a response."""
+        with self._lock:
+            for attr in ["limit", "remaining", "used", "reset"]:
+                value = headers.get("X-RateLimit-" + attr.capitalize(), None)
+                if value is not None:
+                    try:
+                        setattr(self, attr, int(value))
+                    except ValueError:
+                        pass
+
+    def block(self, seconds):
+        """Stop sending requests with this budget for `seconds`."""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.time() + seconds)
+
+    def get_delay(self, now=None):
+        """Get how long to wait before sending the next request."""
+        now = time.time() if now is None else now
+        with self._lock:
+            if self.blocked_until > now:
+                return self.blocked_until - now
+            if (
+                self.limit is None
+                or self.remaining is None
+                or self.reset is None
+                or self.reset <= now
+                or self.remaining > self.limit * self.reserve
+            ):
+                return 0
+            # spread what is left over the time until the reset
+            return (self.reset - now) / max(self.remaining, 1)
+
+    def wait(self):
+        delay = self.get_delay()
+        if delay > self.max_wait:
+            LOGGER.warning(
+                "not waiting %.1fs for the %s rate limit of token %s (max %.1fs)",
+                delay,
+                self.resource,
+                self.token,
+                self.max_wait,
+            )
+            HTTP_STATS["rate_limit_waits_skipped"] += 1
+        elif delay > 0:
+            LOGGER.info(
+                "waiting %.1fs for the %s rate limit of token %s",
+                delay,
+                self.resource,
+                self.token,
+            )
+            HTTP_STATS["rate_limit_delays"] += 1
+            HTTP_STATS["rate_limit_delay_seconds"] += delay
+            _sleep(delay)
+
+    def as_dict(self):
+        return {
+            "token": self.token,
+            "resource": self.resource,
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "used": self.used,
+            "reset": self.reset,
+        }
+
+
+def get_rate_limit_budget(headers, url):
+    """Get the `RateLimitBudget` for the token in `headers` and the resource
+    used by `url`."""
+    key = (_hash_auth(headers), _get_resource(url))
+    with _LOCK:
+        if key not in _BUDGETS:
+            _BUDGETS[key] = RateLimitBudget(*key)
+        return _BUDGETS[key]
+
+
+def get_rate_limit_budgets():
+    """Get the rate limit budgets of all of the tokens used in this process."""
+    with _LOCK:
+        return [budget.as_dict() for budget in _BUDGETS.values()]
+
+
+def _get_rate_limit_wait(r, stream=False):
+    """Get how long to wait before retrying a rate limited response, or None
+    if the response is not rate limited."""
+    if r.status_code not in (403, 429):
+        return None
+    if "Retry-After" in r.headers:
+        try:
+            return max(float(r.headers["Retry-After"]), 0)
+        except ValueError:
+            return SECONDARY_RATE_LIMIT_WAIT
+    if r.headers.get("X-RateLimit-Remaining", None) == "0":
+        try:
+            return max(int(r.headers["X-RateLimit-Reset"]) - time.time(), 0) + 1
+        except (KeyError, ValueError):
+            return SECONDARY_RATE_LIMIT_WAIT
+    if not stream and "secondary rate limit" in (r.text or "").lower():
+        return SECONDARY_RATE_LIMIT_WAIT
+    if r.status_code == 429:
+        return SECONDARY_RATE_LIMIT_WAIT
+    return None
+
+
+def add_exchange_hook(hook):
+    """Call `hook(verb, url, body, status, headers, text, elapsed)` for every
+    response the HTTP layer hands to PyGithub.
+
+    Responses served from the `ETagCache` are passed as the `200` PyGithub sees.
+    """
+    _EXCHANGE_HOOKS.append(hook)
+
+
+def remove_exchange_hook(hook):
+    _EXCHANGE_HOOKS.remove(hook)
+
+
+def _call_exchange_hooks(verb, url, body, status, headers, text, elapsed):
+    for hook in list(_EXCHANGE_HOOKS):
+        try:
+            hook(verb, url, body, status, headers, text, elapsed)
+        except Exception:
+            LOGGER.exception("error in HTTP exchange hook %r", hook)
+
+
+def get_session(retry=None, pool_size=None):
+    """Get the pooled `requests.Session` for a retry policy.
+
+    The sessions are shared by all of the GitHub calls in this process.
+    """
+    key = _retry_key(retry)
+    with _LOCK:
+        if key not in _SESSIONS:
+            size = pool_size or get_pool_size()
+            adapter = requests.adapters.HTTPAdapter(
+                max_retries=(
+                    requests.adapters.DEFAULT_RETRIES
+                    if retry is None
+                    else _without_rate_limit_retries(retry)
+                ),
+                pool_connections=size,
+                pool_maxsize=size,
+            )
+            sess = requests.Session()
+            # stop requests from falling back to .netrc for auth
+            sess.auth = Requester.noopAuth
+            sess.mount("https://", adapter)
+            sess.mount("http://", adapter)
+            _SESSIONS[key] = sess
+        return _SESSIONS[key]
+
+
+def get_etag_cache():
+    """Get the `ETagCache` shared by all GitHub calls in this process."""
+    global _ETAG_CACHE
+    with _LOCK:
+        if _ETAG_CACHE is None:
+            _ETAG_CACHE = ETagCache(max_size=get_etag_cache_size())
+        return _ETAG_CACHE
+
+
+def reset_http_layer():
+    """Drop the shared connections and cached responses."""
+    global _ETAG_CACHE
+    with _LOCK:
+        for sess in _SESSIONS.values():
+            sess.close()
+        _SESSIONS.clear()
+        _BUDGETS.clear()
+        _ETAG_CACHE = None
+        HTTP_STATS.clear()
+
+
+def _forget_http_layer_in_child():
+    # the pooled sockets belong to the parent, so the child starts over
+    global _LOCK, _ETAG_CACHE
+    _LOCK = threading.Lock()
+    _SESSIONS.clear()
+    _BUDGETS.clear()
+    _ETAG_CACHE = None
+    HTTP_STATS.clear()
+
+
+os.register_at_fork(after_in_child=_forget_http_layer_in_child)
+
+
+class PooledHTTPSConnection:
+    """A connection class for PyGithub that sends its requests through the
+    shared session and connection pool and makes GET requests conditional
+    on the `ETag` of the last response for the same URL. Requests wait on the
+    `RateLimitBudget` of their token and rate limited requests are retried
+    after the time the API asks for.
+
+    It mimics `github.Requester.HTTPSRequestsConnectionClass`.
+    """
+
+    protocol = "https"
+    default_port = 443
+
+    def __init__(
+        self,
+        host,
+        port=None,
+        strict=False,
+        timeout=None,
+        retry=None,
+        pool_size=None,
+        **kwargs,
+    ):
+        self.host = host
+        self.port = port if port else self.default_port
+        self.timeout = timeout
+        self.retry = retry
+        self.pool_size = pool_size
+        self.verify = kwargs.get("verify", True)
+
+    def request(self, verb, url, input, headers, stream=False):
+        self.verb = verb
+        self.url = url
+        self.input = input
+        self.headers = headers
+        self.stream = stream
+
+    def getresponse(self):
+        url = f"{self.protocol}://{self.host}:{self.port}{self.url}"
+        session = get_session(retry=self.retry, pool_size=self.pool_size)
+
+        headers = dict(self.headers)
+        cache = None
+        if self.verb == "GET" and not self.stream:
+            cache = get_etag_cache()
+            key = cache.key(url, headers)
+            entry = cache.get(key)
+            if entry is not None and "If-None-Match" not in headers:
+                headers["If-None-Match"] = entry[0]
+
+        budget = get_rate_limit_budget(headers, self.url)
+        # uploads from files cannot be sent again
+        retries = (
+            get_rate_limit_retries()
+            if self.input is None or isinstance(self.input, (str, bytes))
+            else 0
+        )
+        for attempt in range(retries + 1):
+            budget.wait()
+            r = session.request(
+                self.verb,
+                url,
+                headers=headers,
+                data=self.input,
+                timeout=self.timeout,
+                verify=self.verify,
+                allow_redirects=False,
+                stream=self.stream,
+            )
+            HTTP_STATS["requests"] += 1
+            budget.update(r.headers)
+
+            wait = _get_rate_limit_wait(r, stream=self.stream)
+            if wait is None:
+                break
+            HTTP_STATS["rate_limited"] += 1
+            if attempt == retries or wait > budget.max_wait:
+                LOGGER.warning("%s %s was rate limited!", self.verb, self.url)
+                break
+            LOGGER.warning(
+                "%s %s was rate limited, retrying in %.1fs", self.verb, self.url, wait
+            )
+            r.close()
+            budget.block(wait)
+
+        if cache is not None:
+            if r.status_code == 304 and entry is not None:
+                HTTP_STATS["etag_hits"] += 1
+                LOGGER.debug("using cached response for %s", self.url)
+                # keep the fresh headers (e.g., the rate limits) of the 304
+                resp_headers = requests.structures.CaseInsensitiveDict(entry[1])
+                for name, value in r.headers.items():
+                    if name.lower() != "content-length":
+                        resp_headers[name] = value
+                if _EXCHANGE_HOOKS:
+                    _call_exchange_hooks(
+                        self.verb,
+                        self.url,
+                        self.input,
+                        200,
+                        resp_headers,
+                        entry[2],
+                        r.elapsed.total_seconds(),
+                    )
+                return CachedResponse(200, resp_headers, entry[2])
+            if r.status_code == 200 and "ETag" in r.headers:
+                cache.put(key, r.headers["ETag"], dict(r.headers), r.text or "")
+
+        if _EXCHANGE_HOOKS and not self.stream:
+            _call_exchange_hooks(
+                self.verb,
+                self.url,
+                self.input,
+                r.status_code,
+                r.headers,
+                r.text or "",
+                r.elapsed.total_seconds(),
+            )
+        return RequestsResponse(r)
+
+    def close(self):
+        # the connections are shared, so there is nothing to close
+        pass
+
+
+class PooledHTTPConnection(PooledHTTPSConnection):
+    """The plain HTTP version of `PooledHTTPSConnection`."""
+
+    protocol = "http"
+    default_port = 80
+
+
+class PooledRequester(Requester):
+    """A PyGithub `Requester` whose connections go through the shared HTTP layer.
+
+    The connection classes are set on this subclass instead of being injected
+    into `Requester`, so that other `Github` objects in the process (e.g., the
+    ones cf-scripts makes) keep PyGithub's own connections.
+    """
+
+    _Requester__httpConnectionClass = PooledHTTPConnection
+    _Requester__httpsConnectionClass = PooledHTTPSConnection
+
+    # PyGithub makes plain `Requester`s for these, which would drop the layer
+    def _pooled(self, requester):
+        return self if requester is self else PooledRequester(**requester.kwargs)
+
+    def withAuth(self, auth):
+        return self._pooled(super().withAuth(auth))
+
+    def withLazy(self, lazy):
+        return self._pooled(super().withLazy(lazy))
+
+    def withApiVersion(self, api_version):
+        return self._pooled(super().withApiVersion(api_version))
+
+
+class PooledGithub(Github):
+    """A `Github` object that sends its requests through the shared HTTP layer
+    (see `PooledRequester`)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._Github__requester = PooledRequester(**self.requester.kwargs)
+
+    def withLazy(self, lazy):
+        kwargs = self.requester.kwargs
+        kwargs.update(lazy=lazy)
+        return PooledGithub(**kwargs)
@@ -0,0 +1,246 @@
+import logging
+import os
+import tempfile
+
+from webservices_dispatch_action.api_sessions import get_actor_token
+from webservices_dispatch_action.git_utils import clone_feedstock
+from webservices_dispatch_action.pr_context import LazyPullRequest
+from webservices_dispatch_action.rerendering import (
+    record_successful_rerender,
+    rerender,
+)
+from webservices_dispatch_action.tracing import set_span_attributes, span
+from webservices_dispatch_action.utils import (
+    comment_and_push_if_changed,
+    get_repo_url,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+RERENDER_HELP_MESSAGE = " or you can try [rerendeing locally](%s)" % (
+    "https://conda-forge.org/docs/maintainer/updating_pkgs.html"
+    "#rerendering-with-conda-smithy-locally"
+)
+
+VERSION_UPDATE_PUSH_MODES = ["combined", "separate"]
+
+
+def get_version_update_push_mode():
+    """Get how version updates and their rerenders are pushed (default `combined`)."""
+    mode = os.environ.get("CF_WEBSERVICES_VERSION_UPDATE_PUSH", "") or "combined"
+    if mode not in VERSION_UPDATE_PUSH_MODES:
+        raise ValueError("Unknown version update push mode %r!" % mode)
+    return mode
+
+
+def _set_outcome(changed, error, push_error, error_outcome):
+    # the outcome of the dispatch, reported by the `dispatch` span and metrics
+    if push_error:
+        outcome = "push_error"
+    elif error:
+        outcome = error_outcome
+    elif changed:
+        outcome = "changed"
+    else:
+        outcome = "nothing_to_do"
+    set_span_attributes(outcome=outcome)
+
+
+def handle_rerender(gh, event_data, ctx):
+    pr_num = ctx.number
+    repo_name = ctx.repo_name
+    pr = LazyPullRequest(gh, repo_name, pr_num)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # clone the head repo
+        pr_branch = ctx.head_ref
+        pr_owner = ctx.head_owner
+        pr_repo = ctx.head_repo
+        repo_url = get_repo_url(pr_owner, pr_repo)
+        feedstock_dir = os.path.join(
+            tmpdir,
+            pr_repo,
+        )
+        with span("clone", repo="%s/%s" % (pr_owner, pr_repo), branch=pr_branch):
+            git_repo = clone_feedstock(
+                repo_url,
+                feedstock_dir,
+                pr_branch,
+                repo_key="%s/%s" % (pr_owner, pr_repo),
+            )
+
+        # rerender
+        _, _, can_change_workflows = get_actor_token()
+        changed, rerender_error, info_message = rerender(git_repo, can_change_workflows)
+
+        # comment
+        push_error = comment_and_push_if_changed(
+            action="rerender",
+            changed=changed,
+            error=rerender_error,
+            git_repo=git_repo,
+            pull=pr,
+            pr_branch=pr_branch,
+            pr_owner=pr_owner,
+            pr_repo=pr_repo,
+            repo_name=repo_name,
+            close_pr_if_no_changes_or_errors=False,
+            help_message=RERENDER_HELP_MESSAGE,
+            info_message=info_message,
+        )
+
+        _set_outcome(changed, rerender_error, push_error, "rerender_error")
+
+        if not (rerender_error or push_error):
+            record_successful_rerender(git_repo, can_change_workflows)
+
+        if rerender_error or push_error:
+            raise RuntimeError(
+                "Rerendering failed! error in push|rerender: %s|%s"
+                % (
+                    push_error,
+                    rerender_error,
+                ),
+            )
+
+
+def handle_version_update(gh, event_data, ctx):
+    pr_num = ctx.number
+    repo_name = ctx.repo_name
+    input_version = event_data["client_payload"].get("input_version", None)
+    push_mode = get_version_update_push_mode()
+    pr = LazyPullRequest(gh, repo_name, pr_num)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # clone the head repo
+        pr_branch = ctx.head_ref
+        pr_owner = ctx.head_owner
+        pr_repo = ctx.head_repo
+        repo_url = get_repo_url(pr_owner, pr_repo)
+        feedstock_dir = os.path.join(
+            tmpdir,
+            pr_repo,
+        )
+        with span("clone", repo="%s/%s" % (pr_owner, pr_repo), branch=pr_branch):
+            git_repo = clone_feedstock(
+                repo_url,
+                feedstock_dir,
+                pr_branch,
+                repo_key="%s/%s" % (pr_owner, pr_repo),
+            )
+
+        _, _, can_change_workflows = get_actor_token()
+
+        # update version
+        # imported here since it pulls in conda_forge_tick
+        from webservices_dispatch_action.version_updater import run_update_version
+
+        curr_head = git_repo.active_branch.commit
+        if run_update_version(git_repo, repo_name, input_version=input_version):
+            version_error = True
+            version_changed = False
+        elif git_repo.active_branch.commit == curr_head:
+            version_error = False
+            version_changed = False
+        else:
+            version_error = False
+            version_changed = True
+
+        push_kwargs = dict(
+            git_repo=git_repo,
+            pull=pr,
+            pr_branch=pr_branch,
+            pr_owner=pr_owner,
+            pr_repo=pr_repo,
+            repo_name=repo_name,
+        )
+
+        rerendered = False
+        if version_changed and push_mode == "combined":
+            # rerender on top of the version update and push both at once
+            version_head = git_repo.active_branch.commit
+            rerender_changed, rerender_error, info_message = rerender(
+                git_repo, can_change_workflows
+            )
+            rerendered = True
+            if not rerender_error:
+                push_error = comment_and_push_if_changed(
+                    action="update the version and rerender",
+                    changed=True,
+                    error=False,
+                    close_pr_if_no_changes_or_errors=False,
+                    help_message=RERENDER_HELP_MESSAGE,
+                    info_message=info_message,
+                    **push_kwargs,
+                )
+                _set_outcome(True, False, push_error, "rerender_error")
+
+                if push_error:
+                    raise RuntimeError(
+                        "Updating version failed! error in "
+                        "push|version update|rerender: %s|%s|%s"
+                        % (
+                            push_error,
+                            version_error,
+                            rerender_error,
+                        ),
+                    )
+
+                record_successful_rerender(git_repo, can_change_workflows)
+                return
+
+            # fall back to pushing the version update on its own
+            LOGGER.warning("rerendering failed, pushing the version update only")
+            git_repo.git.reset("--hard", version_head.hexsha)
+
+        version_push_error = comment_and_push_if_changed(
+            action="update the version",
+            changed=version_changed,
+            error=version_error,
+            close_pr_if_no_changes_or_errors=True,
+            help_message="",
+            info_message="",
+            **push_kwargs,
+        )
+        _set_outcome(
+            version_changed, version_error, version_push_error, "version_error"
+        )
+
+        if version_error or version_push_error:
+            raise RuntimeError(
+                "Updating version failed! error in "
+                "push|version update: %s|%s"
+                % (
+                    version_push_error,
+                    version_error,
+                ),
+            )
+
+        if version_changed:
+            # rerender, unless it already failed above
+            if not rerendered:
+                rerender_changed, rerender_error, info_message = rerender(
+                    git_repo, can_change_workflows
+                )
+            rerender_push_error = comment_and_push_if_changed(
+                action="rerender",
+                changed=rerender_changed,
+                error=rerender_error,
+                close_pr_if_no_changes_or_errors=False,
+                help_message=RERENDER_HELP_MESSAGE,
+                info_message=info_message,
+                **push_kwargs,
+            )
+            _set_outcome(True, rerender_error, rerender_push_error, "rerender_error")
+
+            if not (rerender_error or rerender_push_error):
+                record_successful_rerender(git_repo, can_change_workflows)
+
+            if rerender_error or rerender_push_error:
+                raise RuntimeError(
+                    "Rerendering failed! error in push|rerender: %s|%s"
+                    % (
+                        rerender_push_error,
+                        rerender_error,
+                    ),
+                )
@@ -0,0 +1,411 @@
+import glob
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import uuid
+
+from .tracing import add_span_listener
+
+LOGGER = logging.getLogger(__name__)
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, math.inf)
+
+# the directory where each process of a worker leaves its metrics for the
+# parent to collect, if any
+_PROCESS_DIR = None
+_PROCESS_ID = uuid.uuid4().hex
+
+
+def get_metrics_file():
+    """Get the path of the OpenMetrics textfile to write, if any."""
+    return os.environ.get("CF_WEBSERVICES_METRICS_FILE", "") or None
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    labels = list(labels)
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            '%s="%s"'
+            % (
+                name,
+                str(value)
+                .replace("\\", "\\\\")
+                .replace("\n", "\\n")
+                .replace('"', '\\"'),
+            )
+            for name, value in labels
+        )
+        + "}"
+    )
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                "Metric %s needs the labels %r, got %r!"
+                % (self.name, self.labelnames, sorted(labels))
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), None)
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def state(self):
+        """Get the values of the metric in a form that can be stored as JSON."""
+        return [[list(key), value] for key, value in self.values().items()]
+
+
+class Counter(_Metric):
+    """A count that only goes up, with one value per set of labels."""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        # only for counters kept elsewhere (e.g., `HTTP_STATS`)
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels):
+        return super().get(**labels) or 0
+
+    @staticmethod
+    def merge_values(value, other):
+        return value + other
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield "_total", zip(self.labelnames, key), value
+
+
+class Histogram(_Metric):
+    """A distribution of values (e.g., latencies) in cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames=labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts = [
+                c + (1 if value <= bound else 0)
+                for c, bound in zip(counts, self.buckets)
+            ]
+            self._values[key] = (counts, total + value)
+
+    @staticmethod
+    def merge_values(value, other):
+        return ([a + b for a, b in zip(value[0], other[0])], value[1] + other[1])
+
+    def samples(self, values):
+        for key, (counts, total) in sorted(values.items()):
+            labels = list(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, counts):
+                yield "_bucket", labels + [("le", _format_value(bound))], count
+            yield "_count", labels, counts[-1]
+            yield "_sum", labels, total
+
+
+class Gauge(_Metric):
+    """A value that can go up and down. Gauges are only reported by the process
+    that serves or writes the metrics."""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames=labelnames)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, func, **labels):
+        """Report the value of `func()` whenever the metrics are collected."""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = func
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+            self._functions.clear()
+
+    def state(self):
+        return []
+
+    def samples(self, values):
+        with self._lock:
+            functions = dict(self._functions)
+        values = dict(values)
+        for key, func in functions.items():
+            try:
+                values[key] = func()
+            except Exception as e:
+                LOGGER.warning("could not get the value of %s: %r", self.name, e)
+        for key, value in sorted(values.items()):
+            yield "", zip(self.labelnames, key), value
+
+
+DISPATCHES = Counter(
+    "webservices_dispatches",
+    "The number of dispatches handled, by action and outcome.",
+    ["action", "outcome"],
+)
+DISPATCH_DURATION = Histogram(
+    "webservices_dispatch_duration_seconds",
+    "The time taken to handle a dispatch, by action and outcome.",
+    ["action", "outcome"],
+)
+PHASE_DURATION = Histogram(
+    "webservices_dispatch_phase_duration_seconds",
+    "The time taken by each phase of a dispatch (see the tracing spans).",
+    ["phase"],
+)
+CACHE_LOOKUPS = Counter(
+    "webservices_cache_lookups",
+    "The number of lookups in each cache, by result (hit or miss).",
+    ["cache", "result"],
+)
+GITHUB_API_REQUESTS = Counter(
+    "webservices_github_api_requests",
+    "The number of GitHub API requests made through the pooled HTTP layer.",
+)
+GITHUB_API_ETAG_HITS = Counter(
+    "webservices_github_api_etag_hits",
+    "The number of GitHub API requests answered with `304 Not Modified`.",
+)
+GITHUB_API_RATE_LIMITED = Counter(
+    "webservices_github_api_rate_limited",
+    "The number of GitHub API requests that were rate limited and retried.",
+)
+GITHUB_API_RATE_LIMIT_DELAYS = Counter(
+    "webservices_github_api_rate_limit_delays",
+    "The number of GitHub API requests delayed to spread out the rate limit.",
+)
+QUEUE_DEPTH = Gauge(
+    "webservices_worker_queue_depth",
+    "The number of events waiting to be handled by the worker.",
+)
+RUNNING_JOBS = Gauge(
+    "webservices_worker_running_jobs",
+    "The number of events being handled by the worker.",
+)
+
+REGISTRY = [
+    DISPATCHES,
+    DISPATCH_DURATION,
+    PHASE_DURATION,
+    CACHE_LOOKUPS,
+    GITHUB_API_REQUESTS,
+    GITHUB_API_ETAG_HITS,
+    GITHUB_API_RATE_LIMITED,
+    GITHUB_API_RATE_LIMIT_DELAYS,
+    QUEUE_DEPTH,
+    RUNNING_JOBS,
+]
+
+
+def _observe_span(sp):
+    if sp.name == "dispatch":
+        action = sp.attributes.get("action", None) or "unknown"
+        outcome = sp.attributes.get("outcome", None) or (
+            "ok" if sp.status == "ok" else "error"
+        )
+        DISPATCHES.inc(action=action, outcome=outcome)
+        DISPATCH_DURATION.observe(sp.duration, action=action, outcome=outcome)
+    else:
+        PHASE_DURATION.observe(sp.duration, phase=sp.name)
+
+
+add_span_listener(_observe_span)
+
+
+def _sync_http_stats():
+    # only look at the HTTP layer if something imported it
+    github_http = sys.modules.get("webservices_dispatch_action.github_http", None)
+    if github_http is None:
+        return
+    stats = github_http.HTTP_STATS
+    GITHUB_API_REQUESTS.set(stats["requests"])
+    GITHUB_API_ETAG_HITS.set(stats["etag_hits"])
+    GITHUB_API_RATE_LIMITED.set(stats["rate_limited"])
+    GITHUB_API_RATE_LIMIT_DELAYS.set(stats["rate_limit_delays"])
+
+
+def reset_metrics():
+    """Reset every metric of this process."""
+    for metric in REGISTRY:
+        metric.reset()
+
+
+def _forget_metrics_in_child():
+    # the counts so far belong to the parent, so the child starts over
+    global _PROCESS_ID
+    _PROCESS_ID = uuid.uuid4().hex
+    for metric in REGISTRY:
+        if not isinstance(metric, Gauge):
+            metric.reset()
+
+
+os.register_at_fork(after_in_child=_forget_metrics_in_child)
+
+
+def set_process_dir(pth):
+    """Have forked processes leave their metrics in `pth` (see
+    `flush_process_metrics`) so that this process reports them too."""
+    global _PROCESS_DIR
+    if pth is not None:
+        os.makedirs(pth, exist_ok=True)
+    _PROCESS_DIR = pth
+
+
+def flush_process_metrics():
+    """Store the metrics of this process in the process directory, if any, for
+    the process that reports the metrics to collect."""
+    if _PROCESS_DIR is None:
+        return
+    _sync_http_stats()
+    pth = os.path.join(_PROCESS_DIR, _PROCESS_ID + ".json")
+    state = {metric.name: metric.state() for metric in REGISTRY}
+    with open(pth + ".tmp", "w") as fp:
+        json.dump(state, fp)
+    os.replace(pth + ".tmp", pth)
+
+
+def _load_process_states():
+    if _PROCESS_DIR is None:
+        return []
+    states = []
+    own = os.path.join(_PROCESS_DIR, _PROCESS_ID + ".json")
+    for pth in sorted(glob.glob(os.path.join(_PROCESS_DIR, "*.json"))):
+        if pth == own:
+            continue
+        try:
+            with open(pth) as fp:
+                states.append(json.load(fp))
+        except (OSError, ValueError) as e:
+            LOGGER.warning("could not read process metrics %s: %r", pth, e)
+    return states
+
+
+def _to_values(state):
+    values = {}
+    for key, value in state:
+        values[tuple(key)] = tuple(value) if isinstance(value, list) else value
+    return values
+
+
+def format_metrics():
+    """Format the metrics of this process and of the processes that left their
+    metrics in the process directory in the OpenMetrics text format."""
+    _sync_http_stats()
+    process_states = _load_process_states()
+
+    lines = []
+    for metric in REGISTRY:
+        values = metric.values()
+        for state in process_states:
+            for key, value in _to_values(state.get(metric.name, [])).items():
+                if key in values:
+                    values[key] = metric.merge_values(values[key], value)
+                else:
+                    values[key] = value
+
+        lines.append("# TYPE %s %s" % (metric.name, metric.type))
+        lines.append("# HELP %s %s" % (metric.name, metric.documentation))
+        for suffix, labels, value in metric.samples(values):
+            lines.append(
+                "%s%s%s %s"
+                % (metric.name, suffix, _format_labels(labels), _format_value(value))
+            )
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(pth=None):
+    """Write the metrics to an OpenMetrics textfile (e.g., for the textfile
+    collector of the node exporter). Defaults to `CF_WEBSERVICES_METRICS_FILE`."""
+    pth = pth or get_metrics_file()
+    if pth is None:
+        return
+    with open(pth + ".tmp", "w") as fp:
+        fp.write(format_metrics())
+    os.replace(pth + ".tmp", pth)
+
+
+def serve_metrics(port, host=""):
+    """Serve the metrics over HTTP from a background thread.
+
+    Returns
+    -------
+    server : http.server.ThreadingHTTPServer
+        The server. Call `shutdown` on it to stop it.
+    """
+    # imported here since only the worker serves metrics
+    import http.server
+
+    class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ["/", "/metrics"]:
+                self.send_error(404)
+                return
+            body = format_metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    LOGGER.info("serving metrics on port %d", server.server_address[1])
+    return server
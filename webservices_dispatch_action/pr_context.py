@@ -0,0 +1,130 @@
+import logging
+from dataclasses import dataclass
+
+LOGGER = logging.getLogger(__name__)
+
+PR_CONTEXT_QUERY = """\
+query($owner: String!, $name: String!, $number: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      state
+      headRefName
+      headRefOid
+      headRepositoryOwner { login }
+      headRepository { name }
+    }
+  }
+}
+"""
+
+
+@dataclass(frozen=True)
+class PRContext:
+    """The facts about a PR that a dispatch needs before cloning its head.
+
+    Attributes
+    ----------
+    repo_name : str
+        The name of the base repository (e.g., `conda-forge/foo-feedstock`).
+    number : int
+        The PR number.
+    state : str
+        Either `open` or `closed` (merged PRs are closed).
+    head_ref : str
+        The name of the branch of the PR head.
+    head_sha : str
+        The SHA of the head commit.
+    head_owner : str or None
+        The owner of the repository of the PR head, or None if it was deleted.
+    head_repo : str or None
+        The name of the repository of the PR head, or None if it was deleted.
+    """
+
+    repo_name: str
+    number: int
+    state: str
+    head_ref: str
+    head_sha: str
+    head_owner: str
+    head_repo: str
+
+
+def _load_pr_context_graphql(gh, repo_name, pr_num):
+    owner, name = repo_name.split("/")
+    _, data = gh.requester.graphql_query(
+        PR_CONTEXT_QUERY,
+        {"owner": owner, "name": name, "number": pr_num},
+    )
+    pr = data["data"]["repository"]["pullRequest"]
+    return PRContext(
+        repo_name=repo_name,
+        number=pr_num,
+        state="open" if pr["state"] == "OPEN" else "closed",
+        head_ref=pr["headRefName"],
+        head_sha=pr["headRefOid"],
+        head_owner=(pr["headRepositoryOwner"] or {}).get("login", None),
+        head_repo=(pr["headRepository"] or {}).get("name", None),
+    )
+
+
+def _load_pr_context_rest(gh, repo_name, pr_num):
+    pr = gh.get_repo(repo_name).get_pull(pr_num)
+    head_repo = pr.head.repo
+    return PRContext(
+        repo_name=repo_name,
+        number=pr_num,
+        state=pr.state,
+        head_ref=pr.head.ref,
+        head_sha=pr.head.sha,
+        head_owner=head_repo.owner.login if head_repo is not None else None,
+        head_repo=head_repo.name if head_repo is not None else None,
+    )
+
+
+def load_pr_context(gh, repo_name, pr_num):
+    """Load the `PRContext` of a PR with a single GraphQL query.
+
+    If the GraphQL query fails, the REST API is used instead.
+
+    Parameters
+    ----------
+    gh : github.MainClass.Github
+        A `Github` object from the PyGithub package.
+    repo_name : str
+        The name of the base repository (e.g., `conda-forge/foo-feedstock`).
+    pr_num : int
+        The PR number.
+
+    Returns
+    -------
+    ctx : PRContext
+        The PR context.
+    """
+    try:
+        return _load_pr_context_graphql(gh, repo_name, pr_num)
+    except Exception as e:
+        LOGGER.warning(
+            "could not load PR %s#%d with GraphQL, using the REST API: %r",
+            repo_name,
+            pr_num,
+            e,
+        )
+        return _load_pr_context_rest(gh, repo_name, pr_num)
+
+
+class LazyPullRequest:
+    """A stand-in for a PyGithub `PullRequest` that is only fetched the first
+    time it is used (e.g., to comment on the PR)."""
+
+    def __init__(self, gh, repo_name, pr_num):
+        self._gh = gh
+        self._repo_name = repo_name
+        self._pr_num = pr_num
+        self._pull = None
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        if self._pull is None:
+            self._pull = self._gh.get_repo(self._repo_name).get_pull(self._pr_num)
+        return getattr(self._pull, attr)
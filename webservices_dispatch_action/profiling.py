@@ -0,0 +1,255 @@
+import collections
+import contextlib
+import importlib
+import importlib.util
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import click
+
+LOGGER = logging.getLogger(__name__)
+
+# tells the processes a profiled dispatch starts where to put their profiles
+PROFILE_SESSION_ENV_VAR = "CF_WEBSERVICES_PROFILE_SESSION"
+
+DEFAULT_PROFILE_THRESHOLD = 300
+
+DEFAULT_PROFILE_INTERVAL = 0.01
+
+# the pid of the process whose profile is running, if any
+_ACTIVE_PID = None
+
+
+def get_profile_dir():
+    """Get the directory profiles of slow dispatches are written to, if any."""
+    return os.environ.get("CF_WEBSERVICES_PROFILE_DIR", "") or None
+
+
+def get_profile_threshold():
+    """Get how many seconds a dispatch has to take for its profile to be kept."""
+    return float(
+        os.environ.get("CF_WEBSERVICES_PROFILE_THRESHOLD", "")
+        or DEFAULT_PROFILE_THRESHOLD
+    )
+
+
+def get_profile_interval():
+    """Get the number of seconds between stack samples."""
+    return float(
+        os.environ.get("CF_WEBSERVICES_PROFILE_INTERVAL", "")
+        or DEFAULT_PROFILE_INTERVAL
+    )
+
+
+def is_enabled():
+    """Return True if this process is being profiled."""
+    return _ACTIVE_PID == os.getpid()
+
+
+def _frame_name(code):
+    filename = code.co_filename
+    # keep the paths short and the same across environments
+    for marker in ["site-packages" + os.sep, "lib" + os.sep]:
+        if marker in filename:
+            filename = filename.rsplit(marker, 1)[1]
+            break
+    # `;` separates the frames of a collapsed stack
+    return ("%s (%s:%d)" % (code.co_name, filename, code.co_firstlineno)).replace(
+        ";", ":"
+    )
+
+
+class StackSampler:
+    """Samples the Python stacks of every thread of this process from a
+    background thread.
+
+    The samples are kept as collapsed stacks (`root;caller;callee count`), the
+    input format of `flamegraph.pl`, speedscope and most flamegraph viewers.
+
+    Parameters
+    ----------
+    interval : float
+        The number of seconds between samples.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.counts = collections.Counter()
+        self.num_samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append("thread %s" % names.get(ident, ident))
+                self.counts[";".join(reversed(stack))] += 1
+            self.num_samples += 1
+
+    def write_collapsed(self, pth, root):
+        """Write the samples to `pth` as collapsed stacks under a `root` frame."""
+        with open(pth, "w") as fp:
+            for stack, count in sorted(self.counts.items()):
+                fp.write("%s;%s %d\n" % (root, stack, count))
+
+
+def _keep_session(session_dir, profile_dir, name, duration):
+    dest = os.path.join(
+        profile_dir,
+        "%s-%s-%d" % (name, time.strftime("%Y%m%dT%H%M%S"), os.getpid()),
+    )
+    os.rename(session_dir, dest)
+
+    # one file for the whole dispatch, child processes included
+    with open(os.path.join(dest, "all.collapsed"), "w") as out:
+        for fname in sorted(os.listdir(dest)):
+            if fname.endswith(".collapsed") and fname != "all.collapsed":
+                with open(os.path.join(dest, fname)) as fp:
+                    shutil.copyfileobj(fp, out)
+    LOGGER.info(
+        "%s took %.1fs, which is over the profiling threshold: wrote profile to %s",
+        name,
+        duration,
+        dest,
+    )
+    return dest
+
+
+@contextlib.contextmanager
+def profile(name):
+    """Profile the code in the block by sampling its stacks.
+
+    Nothing is done unless `CF_WEBSERVICES_PROFILE_DIR` is set or this process
+    was started by a profiled one. A profile is only kept if the outermost
+    profiled block took at least `CF_WEBSERVICES_PROFILE_THRESHOLD` seconds.
+    It is then written to a new directory in the profile dir holding a
+    `<name>-<pid>.collapsed` file for this process and for each profiled child
+    process, and `all.collapsed` combining them.
+
+    Parameters
+    ----------
+    name : str
+        The name of what is profiled (e.g., `dispatch`), used as the root
+        frame of its stacks.
+    """
+    global _ACTIVE_PID
+
+    session_dir = os.environ.get(PROFILE_SESSION_ENV_VAR, "") or None
+    profile_dir = get_profile_dir()
+    if is_enabled() or (session_dir is None and profile_dir is None):
+        yield
+        return
+
+    is_root = session_dir is None
+    if is_root:
+        os.makedirs(profile_dir, exist_ok=True)
+        session_dir = tempfile.mkdtemp(prefix=".pending-", dir=profile_dir)
+        os.environ[PROFILE_SESSION_ENV_VAR] = session_dir
+
+    sampler = StackSampler(get_profile_interval()).start()
+    _ACTIVE_PID = os.getpid()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - t0
+        sampler.stop()
+        _ACTIVE_PID = None
+        try:
+            sampler.write_collapsed(
+                os.path.join(session_dir, "%s-%d.collapsed" % (name, os.getpid())),
+                "%s (pid %d)" % (name, os.getpid()),
+            )
+        except Exception as e:
+            LOGGER.warning("could not write the profile of %s: %r", name, e)
+
+        if is_root:
+            os.environ.pop(PROFILE_SESSION_ENV_VAR, None)
+            try:
+                if duration >= get_profile_threshold():
+                    _keep_session(session_dir, profile_dir, name, duration)
+            except Exception as e:
+                LOGGER.warning("could not save the profile of %s: %r", name, e)
+            finally:
+                shutil.rmtree(session_dir, ignore_errors=True)
+
+
+def profiled_command(name, entry_point, args):
+    """Get a command that runs a Python entry point under the profiler.
+
+    Parameters
+    ----------
+    name : str
+        The name of the profile of the child process.
+    entry_point : str
+        The entry point to run, as `module:function`. The function is called
+        with no arguments and `sys.argv` set to `[name] + args`.
+    args : list of str
+        The arguments of the entry point.
+
+    Returns
+    -------
+    cmd : list of str or None
+        The command, or None if this process is not profiled or the module of
+        the entry point cannot be imported by this Python.
+    """
+    if not is_enabled():
+        return None
+    module = entry_point.split(":", 1)[0]
+    if importlib.util.find_spec(module.split(".", 1)[0]) is None:
+        return None
+    return [
+        sys.executable,
+        "-m",
+        "webservices_dispatch_action.profiling",
+        name,
+        entry_point,
+        "--",
+    ] + list(args)
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.argument("name")
+@click.argument("entry_point")
+@click.argument("args", nargs=-1, type=click.UNPROCESSED)
+def main(name, entry_point, args):
+    """Run the Python ENTRY_POINT (`module:function`) of a profiled dispatch
+    under the profiler."""
+    module, func = entry_point.split(":", 1)
+    sys.argv = [name] + list(args)
+    with profile(name):
+        try:
+            getattr(importlib.import_module(module), func)()
+        except SystemExit as e:
+            code = e.code
+        else:
+            code = 0
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.parse
+
+LOGGER = logging.getLogger(__name__)
+
+RECORDING_FORMAT_VERSION = 1
+
+# response headers that are not needed to replay a response
+_DROPPED_HEADERS = [
+    "connection",
+    "content-encoding",
+    "content-length",
+    "keep-alive",
+    "set-cookie",
+    "transfer-encoding",
+]
+
+_RECORDER = None
+
+
+def get_record_path():
+    """Get the path of the archive a dispatch is recorded to, if any."""
+    return os.environ.get("CF_WEBSERVICES_RECORD", "") or None
+
+
+def get_recorder():
+    """Get the recorder of the current dispatch, if it is being recorded."""
+    return _RECORDER
+
+
+def _decode_body(body):
+    if body is None:
+        return None
+    if isinstance(body, bytes):
+        return body.decode("utf-8", errors="replace")
+    if isinstance(body, str):
+        return body
+    # file uploads are not recorded
+    return None
+
+
+def _repo_key_from_url(repo_url):
+    path = urllib.parse.urlsplit(repo_url).path
+    if path.endswith(".git"):
+        path = path[: -len(".git")]
+    return "/".join(path.strip("/").split("/")[-2:])
+
+
+class Recorder:
+    """Records what a dispatch read from GitHub so that it can be replayed
+    offline with `run-webservices-dispatch-action-replay`.
+
+    The archive is a `.tar.gz` holding
+
+     - `manifest.json`: the event, its name and the recorded repos,
+     - `exchanges.jsonl`: every GitHub API response, in order, without the
+       request headers (and so without any tokens), and
+     - `git/<owner>/<repo>.bundle`: a git bundle of each cloned branch as it
+       was when it was cloned.
+
+    Nothing else is recorded. The calls a version update makes to upstream
+    version sources and source downloads are not, so only rerenders replay
+    with no network (see `replay.replay`). The bundles also only hold the
+    history the clone fetched. If the recorded dispatch had to deepen a
+    shallow clone (see `git_utils.ensure_history`), the replay cannot, since
+    the restored repos are just as shallow. Record with
+    `CF_WEBSERVICES_CLONE_DEPTH=0` to keep the full history.
+
+    Parameters
+    ----------
+    path : str
+        The path of the archive to write.
+    event_name : str
+        The name of the GitHub event.
+    event_data : dict
+        The event payload.
+    """
+
+    def __init__(self, path, event_name, event_data):
+        self.path = path
+        self.event_name = event_name
+        self.event_data = event_data
+        self.exchanges = []
+        self.repos = {}
+        self.recorded_at = time.time()
+        # URLs are recorded relative to the API (e.g., without `/api/v3`)
+        self._url_prefix = urllib.parse.urlsplit(
+            os.environ.get("GITHUB_API_URL", "")
+        ).path.rstrip("/")
+        self._lock = threading.Lock()
+        self._tmpdir = tempfile.mkdtemp()
+
+    def record_exchange(self, verb, url, body, status, headers, text, elapsed):
+        if self._url_prefix and url.startswith(self._url_prefix + "/"):
+            url = url[len(self._url_prefix) :]
+        exchange = {
+            "method": verb,
+            "url": url,
+            "body": _decode_body(body),
+            "status": status,
+            "headers": {
+                k: v for k, v in headers.items() if k.lower() not in _DROPPED_HEADERS
+            },
+            "text": text,
+            "elapsed": elapsed,
+        }
+        with self._lock:
+            self.exchanges.append(exchange)
+
+    def record_repo(self, repo_key, git_repo, branch):
+        """Bundle the branch of a freshly cloned repo."""
+        bundle = os.path.join("git", repo_key + ".bundle")
+        pth = os.path.join(self._tmpdir, bundle)
+        os.makedirs(os.path.dirname(pth), exist_ok=True)
+        git_repo.git.bundle("create", pth, branch)
+
+        shallow = []
+        shallow_pth = os.path.join(git_repo.git_dir, "shallow")
+        if os.path.exists(shallow_pth):
+            with open(shallow_pth) as fp:
+                shallow = fp.read().split()
+
+        with self._lock:
+            self.repos[repo_key] = {
+                "branch": branch,
+                "bundle": bundle,
+                "head": git_repo.head.commit.hexsha,
+                "shallow": shallow,
+            }
+
+    def save(self):
+        manifest = {
+            "version": RECORDING_FORMAT_VERSION,
+            "event_name": self.event_name,
+            "event_data": self.event_data,
+            "recorded_at": self.recorded_at,
+            "repos": self.repos,
+        }
+        with tarfile.open(self.path, "w:gz") as tf:
+            for name, data in [
+                ("manifest.json", json.dumps(manifest, indent=2)),
+                (
+                    "exchanges.jsonl",
+                    "".join(json.dumps(ex) + "\n" for ex in self.exchanges),
+                ),
+            ]:
+                data = data.encode("utf-8")
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+            for repo in self.repos.values():
+                tf.add(os.path.join(self._tmpdir, repo["bundle"]), repo["bundle"])
+        LOGGER.info(
+            "recorded %d GitHub API calls and %d repos to %s",
+            len(self.exchanges),
+            len(self.repos),
+            self.path,
+        )
+
+    def close(self):
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+
+def record_cloned_repo(repo_url, git_repo, branch, repo_key=None):
+    """Add a freshly cloned repo to the recording, if there is one."""
+    if _RECORDER is None:
+        return
+    try:
+        _RECORDER.record_repo(
+            repo_key or _repo_key_from_url(repo_url), git_repo, branch
+        )
+    except Exception as e:
+        LOGGER.warning("could not record the repo %s: %r", repo_url, e)
+
+
+@contextlib.contextmanager
+def record(path, event_name, event_data):
+    """Record a dispatch to the archive at `path` (see `Recorder`).
+
+    The archive is written even if the dispatch fails.
+    """
+    global _RECORDER
+
+    # imported here since the HTTP layer pulls in requests and PyGithub
+    from .github_http import add_exchange_hook, remove_exchange_hook
+
+    recorder = Recorder(path, event_name, event_data)
+    _RECORDER = recorder
+    add_exchange_hook(recorder.record_exchange)
+    try:
+        yield recorder
+    finally:
+        remove_exchange_hook(recorder.record_exchange)
+        _RECORDER = None
+        try:
+            recorder.save()
+        except Exception as e:
+            LOGGER.warning("could not save the recording to %s: %r", path, e)
+        finally:
+            recorder.close()
+
+
+def load_recording(path, dest):
+    """Unpack the archive at `path` into `dest`.
+
+    Returns
+    -------
+    manifest : dict
+        The contents of `manifest.json`.
+    exchanges : list of dict
+        The recorded GitHub API responses.
+    """
+    with tarfile.open(path, "r:gz") as tf:
+        tf.extractall(dest, filter="data")
+
+    with open(os.path.join(dest, "manifest.json")) as fp:
+        manifest = json.load(fp)
+    if manifest.get("version", None) != RECORDING_FORMAT_VERSION:
+        raise ValueError(
+            "Recording %s has an unknown format version %r!"
+            % (path, manifest.get("version", None))
+        )
+
+    with open(os.path.join(dest, "exchanges.jsonl")) as fp:
+        exchanges = [json.loads(line) for line in fp if line.strip()]
+    return manifest, exchanges
+
+
+def restore_repos(manifest, recording_dir, root):
+    """Make a bare repo under `root`, as `<owner>/<repo>.git`, for each
+    recorded repo, with the recorded branch as it was when cloned."""
+    for repo_key, repo in manifest["repos"].items():
+        pth = os.path.join(root, repo_key + ".git")
+        os.makedirs(os.path.dirname(pth), exist_ok=True)
+        subprocess.run(
+            ["git", "init", "-q", "--bare", pth], check=True, capture_output=True
+        )
+        if repo["shallow"]:
+            # the bundle of a shallow clone stops at these commits
+            with open(os.path.join(pth, "shallow"), "w") as fp:
+                fp.write("".join(sha + "\n" for sha in repo["shallow"]))
+        subprocess.run(
+            [
+                "git",
+                "fetch",
+                "-q",
+                os.path.join(recording_dir, repo["bundle"]),
+                "%s:%s" % (repo["branch"], repo["branch"]),
+            ],
+            cwd=pth,
+            check=True,
+            capture_output=True,
+        )
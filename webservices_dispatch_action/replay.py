@@ -0,0 +1,311 @@
+import collections
+import http.server
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import click
+
+from .recording import load_recording, restore_repos
+
+LOGGER = logging.getLogger(__name__)
+
+# the actions whose dispatches only talk to GitHub, and so can be replayed with
+# no network
+OFFLINE_ACTIONS = ["rerender"]
+
+
+def _shift_reset_times(data, offset):
+    if isinstance(data, dict):
+        return {
+            k: (
+                int(v + offset)
+                if k == "reset" and isinstance(v, (int, float))
+                else _shift_reset_times(v, offset)
+            )
+            for k, v in data.items()
+        }
+    elif isinstance(data, list):
+        return [_shift_reset_times(v, offset) for v in data]
+    else:
+        return data
+
+
+def shift_exchange_times(exchange, offset):
+    """Move the rate limit reset times of a recorded exchange forward by
+    `offset` seconds, so that the tokens look as fresh as they were when the
+    dispatch was recorded."""
+    exchange = dict(exchange)
+    exchange["headers"] = {
+        k: (str(int(float(v) + offset)) if k.lower() == "x-ratelimit-reset" else v)
+        for k, v in exchange["headers"].items()
+    }
+    if exchange["url"].split("?")[0] == "/rate_limit" and exchange["text"]:
+        try:
+            data = json.loads(exchange["text"])
+        except ValueError:
+            pass
+        else:
+            exchange["text"] = json.dumps(_shift_reset_times(data, offset))
+    return exchange
+
+
+class _ReplayHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length", "0") or "0")
+        if length:
+            self.rfile.read(length)
+
+        exchange = self.server.replay.next_exchange(self.command, self.path)
+        if exchange is None:
+            body = json.dumps({"message": "Not Found"}).encode("utf-8")
+            self.send_response(404)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if self.server.replay.simulate_latency:
+            time.sleep(exchange["elapsed"])
+
+        etag = exchange["headers"].get("ETag", exchange["headers"].get("etag", None))
+        if (
+            etag is not None
+            and exchange["status"] == 200
+            and self.headers.get("If-None-Match") == etag
+        ):
+            self.send_response(304)
+            for name, value in exchange["headers"].items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = exchange["text"].encode("utf-8")
+        self.send_response(exchange["status"])
+        for name, value in exchange["headers"].items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _handle
+    do_POST = _handle
+    do_PATCH = _handle
+    do_PUT = _handle
+    do_DELETE = _handle
+
+
+class ReplayServer:
+    """Serves recorded GitHub API responses on localhost.
+
+    Responses for the same method and URL are served in the order they were
+    recorded. Once they run out, the last one is served again.
+
+    Parameters
+    ----------
+    exchanges : list of dict
+        The recorded exchanges (see `recording.Recorder`).
+    time_offset : float, optional
+        The number of seconds to move the rate limit reset times forward by.
+    simulate_latency : bool, optional
+        If True, each response is delayed by the time it took when recorded.
+
+    Attributes
+    ----------
+    api_url : str
+        The URL to use as `GITHUB_API_URL`.
+    num_served : int
+        The number of recorded responses served.
+    misses : list of tuple
+        The `(method, url)` of the requests that were not recorded.
+    """
+
+    def __init__(self, exchanges, time_offset=0, simulate_latency=False):
+        self.simulate_latency = simulate_latency
+        self.num_served = 0
+        self.misses = []
+        self._lock = threading.Lock()
+        self._queues = collections.defaultdict(collections.deque)
+        self._last = {}
+        for exchange in exchanges:
+            exchange = shift_exchange_times(exchange, time_offset)
+            self._queues[(exchange["method"], exchange["url"])].append(exchange)
+
+    def next_exchange(self, method, url):
+        key = (method, url)
+        with self._lock:
+            if self._queues[key]:
+                self._last[key] = self._queues[key].popleft()
+            exchange = self._last.get(key, None)
+            if exchange is None:
+                LOGGER.warning("no recorded response for %s %s", method, url)
+                self.misses.append(key)
+            else:
+                self.num_served += 1
+            return exchange
+
+    def start(self):
+        self._httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _ReplayHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.replay = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        self.api_url = "http://127.0.0.1:%d" % self._httpd.server_address[1]
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def replay(path, simulate_latency=False, handler=None, allow_network=False):
+    """Run a recorded dispatch again with no network access to GitHub.
+
+    The recorded API responses are served from a `ReplayServer` and the
+    recorded repos are restored to local bare repos, which the dispatch then
+    clones from and pushes to.
+
+    Only the GitHub API and the cloned repos are recorded. Dispatches other
+    than rerenders (e.g., `version_update`, which asks PyPI, GitHub releases,
+    etc. for the latest version and downloads the new sources) would still use
+    the network and are refused unless `allow_network` is True.
+
+    Parameters
+    ----------
+    path : str
+        The path of the recording.
+    simulate_latency : bool, optional
+        If True, API responses take as long as they did when recorded.
+    handler : callable, optional
+        Called with no arguments to run the dispatch. Defaults to the `main` of
+        `run-webservices-dispatch-action`.
+    allow_network : bool, optional
+        If True, replay dispatches that need more than GitHub, whose calls to
+        other sites are then made live.
+
+    Returns
+    -------
+    results : dict
+        The `duration` of the dispatch in seconds, the `error` it raised (or
+        None), the number of API responses `served` and the API requests that
+        were not recorded (`misses`).
+    """
+    if handler is None:
+        from .__main__ import main as handler
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        recording_dir = os.path.join(tmpdir, "recording")
+        manifest, exchanges = load_recording(path, recording_dir)
+
+        action = manifest["event_data"].get("action", None)
+        if action not in OFFLINE_ACTIONS:
+            msg = (
+                "Only the GitHub calls of %s dispatches are recorded, so the "
+                "replay of %s would use the network and its results may differ "
+                "from run to run!" % (action, path)
+            )
+            if not allow_network:
+                raise ValueError(msg + " Use `--allow-network` to replay it anyway.")
+            LOGGER.warning(msg)
+
+        git_root = os.path.join(tmpdir, "github")
+        restore_repos(manifest, recording_dir, git_root)
+
+        event_path = os.path.join(tmpdir, "event.json")
+        with open(event_path, "w") as fp:
+            json.dump(manifest["event_data"], fp)
+
+        with ReplayServer(
+            exchanges,
+            time_offset=time.time() - manifest["recorded_at"],
+            simulate_latency=simulate_latency,
+        ) as server:
+            env = {
+                "GITHUB_API_URL": server.api_url,
+                "GITHUB_SERVER_URL": "file://" + git_root,
+                "GITHUB_EVENT_PATH": event_path,
+                "GITHUB_EVENT_NAME": manifest["event_name"],
+            }
+            old_env = {k: os.environ.get(k, None) for k in env}
+            os.environ.update(env)
+            # the tokens are never recorded, so any will do
+            from . import global_sensitive_env
+
+            for k in ["INPUT_GITHUB_TOKEN", "INPUT_RERENDERING_GITHUB_TOKEN"]:
+                if global_sensitive_env.classified_info.get(k, None) is None:
+                    global_sensitive_env.classified_info[k] = "replay-token"
+
+            error = None
+            t0 = time.perf_counter()
+            try:
+                handler()
+            except Exception as e:
+                LOGGER.exception("the replayed dispatch failed")
+                error = e
+            finally:
+                duration = time.perf_counter() - t0
+                for k, v in old_env.items():
+                    if v is None:
+                        os.environ.pop(k, None)
+                    else:
+                        os.environ[k] = v
+
+        return {
+            "duration": duration,
+            "error": error,
+            "served": server.num_served,
+            "misses": server.misses,
+        }
+
+
+@click.command()
+@click.argument("recording", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--simulate-latency",
+    is_flag=True,
+    help="Delay each API response by the time it took when recorded",
+)
+@click.option(
+    "--allow-network",
+    is_flag=True,
+    help="Replay dispatches that call more than GitHub (e.g., version updates), "
+    "making those calls live",
+)
+def main(recording, simulate_latency, allow_network):
+    """Replay a dispatch recorded with `CF_WEBSERVICES_RECORD`."""
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        results = replay(
+            recording, simulate_latency=simulate_latency, allow_network=allow_network
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    click.echo(
+        "replayed %s in %.3fs: %d API responses served, %d requests not recorded"
+        % (recording, results["duration"], results["served"], len(results["misses"])),
+        err=True,
+    )
+    for method, url in results["misses"]:
+        click.echo("    not recorded: %s %s" % (method, url), err=True)
+
+    sys.exit(1 if results["error"] is not None else 0)
@@ -1,25 +1,255 @@
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
 import subprocess
+import sys
 
 import yaml
 
+from .conda_meta import (
+    get_installed_version,
+    get_latest_channel_version,
+    load_pkg_versions,
+)
+from .git_utils import ensure_history, stage_files
+from .metrics import CACHE_LOOKUPS, flush_process_metrics
+from .profiling import profile, profiled_command
+from .tracing import set_span_attributes, span, traced
+
 LOGGER = logging.getLogger(__name__)
 
 
+def _update_hash_with_tree(hsh, root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for fname in sorted(filenames):
+            pth = os.path.join(dirpath, fname)
+            hsh.update(os.path.relpath(pth, root).encode("utf-8") + b"\0")
+            with open(pth, "rb") as fp:
+                hsh.update(hashlib.sha256(fp.read()).digest())
+
+
+def get_rerender_inputs_hash(git_repo, can_change_workflows, pinning_version):
+    """Compute a hash of everything a rerender of the feedstock depends on.
+
+    This covers the recipe directory, `conda-forge.yml`, the migrations in
+    `.ci_support/migrations`, the version of conda-forge-pinning rendered
+    against, the version of conda-smithy, and whether the workflows can be
+    changed. The tree of the HEAD commit is included too, so that any other
+    committed change (e.g., a hand edit to a rendered file) invalidates the
+    hash.
+    """
+    hsh = hashlib.sha256()
+
+    hsh.update(b"recipe\0")
+    _update_hash_with_tree(hsh, os.path.join(git_repo.working_dir, "recipe"))
+
+    hsh.update(b".ci_support/migrations\0")
+    _update_hash_with_tree(
+        hsh, os.path.join(git_repo.working_dir, ".ci_support", "migrations")
+    )
+
+    hsh.update(b"conda-forge.yml\0")
+    cfg_pth = os.path.join(git_repo.working_dir, "conda-forge.yml")
+    if os.path.exists(cfg_pth):
+        with open(cfg_pth, "rb") as fp:
+            hsh.update(hashlib.sha256(fp.read()).digest())
+
+    hsh.update(b"HEAD\0" + git_repo.head.commit.tree.binsha)
+
+    versions = {
+        "can-change-workflows": bool(can_change_workflows),
+        "conda-forge-pinning": pinning_version,
+        "conda-smithy": get_installed_version("conda-smithy"),
+        "conda-smithy-pinned": load_pkg_versions().get("conda-smithy", None),
+    }
+    hsh.update(json.dumps(versions, sort_keys=True).encode("utf-8"))
+
+    return hsh.hexdigest()
+
+
+class RerenderCache:
+    """A cache of the rerender inputs hash of the last successful rerender of
+    each feedstock branch.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The directory holding the cache entries.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _path(self, git_repo):
+        key = "%s@%s" % (git_repo.remotes.origin.url, git_repo.active_branch.name)
+        return os.path.join(
+            self.cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json"
+        )
+
+    def get(self, git_repo):
+        try:
+            with open(self._path(git_repo), "r") as fp:
+                return json.load(fp)["inputs_hash"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, git_repo, inputs_hash):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        pth = self._path(git_repo)
+        with open(pth + ".tmp", "w") as fp:
+            json.dump({"inputs_hash": inputs_hash}, fp)
+        os.replace(pth + ".tmp", pth)
+
+
+def get_rerender_cache():
+    """Get the rerender cache configured in the environment, if any."""
+    cache_dir = os.environ.get("CF_WEBSERVICES_RERENDER_CACHE_DIR", "")
+    if not cache_dir:
+        return None
+    return RerenderCache(cache_dir)
+
+
+# feedstock dir -> the version of conda-forge-pinning its last rerender used
+_RERENDER_PINNING_VERSIONS = {}
+
+
+def get_rerender_pinning_version():
+    """Get the version of conda-forge-pinning a rerender renders against.
+
+    `conda smithy rerender` downloads the latest conda-forge-pinning on the
+    channel instead of using the installed one, so that is the version looked
+    up. Returns None if it cannot be found.
+    """
+    return get_latest_channel_version("conda-forge-pinning")
+
+
+def record_successful_rerender(git_repo, can_change_workflows):
+    """Record the rerender inputs of a feedstock whose rerender was pushed.
+
+    This must only be called once the rerendered branch is on the remote so that
+    later rerenders of the same inputs can be skipped. Nothing is recorded
+    unless `rerender` found the version of conda-forge-pinning it used.
+    """
+    pinning_version = _RERENDER_PINNING_VERSIONS.pop(git_repo.working_dir, None)
+    cache = get_rerender_cache()
+    if cache is not None and pinning_version is not None:
+        cache.put(
+            git_repo,
+            get_rerender_inputs_hash(git_repo, can_change_workflows, pinning_version),
+        )
+
+
+SMITHY_RERENDER_ARGS = ["rerender", "-c", "auto", "--no-check-uptodate"]
+
+RERENDER_ENGINES = ["subprocess", "fork"]
+
+
+def get_rerender_engine():
+    """Get the rerender engine from the environment (default `subprocess`)."""
+    engine = os.environ.get("CF_WEBSERVICES_RERENDER_ENGINE", "") or "subprocess"
+    if engine not in RERENDER_ENGINES:
+        raise ValueError("Unknown rerender engine %r!" % engine)
+    return engine
+
+
+def _run_conda_smithy_rerender_subprocess(feedstock_dir):
+    # profile smithy too if the dispatch is being profiled
+    cmd = profiled_command(
+        "conda_smithy_rerender", "conda_smithy.cli:main", SMITHY_RERENDER_ARGS
+    )
+    return subprocess.call(
+        cmd or ["conda", "smithy"] + SMITHY_RERENDER_ARGS,
+        cwd=feedstock_dir,
+        env=os.environ,
+    )
+
+
+def preload():
+    """Import conda-smithy ahead of time so that forked rerenders (see
+    `run_conda_smithy_rerender`) do not pay for the import."""
+    import conda_smithy.cli  # noqa: F401
+
+
+def _rerender_in_child(feedstock_dir):
+    # the child owns its working dir, argv and any state smithy changes, and
+    # its output (and that of smithy's subprocesses) goes where ours does;
+    # multiprocessing turns a SystemExit or an error into the exit code
+    import conda_smithy.cli
+
+    os.chdir(feedstock_dir)
+    sys.argv = ["conda-smithy"] + SMITHY_RERENDER_ARGS
+    try:
+        with profile("conda_smithy_rerender"):
+            conda_smithy.cli.main()
+    finally:
+        flush_process_metrics()
+
+
+def _run_conda_smithy_rerender_fork(feedstock_dir):
+    proc = multiprocessing.get_context("fork").Process(
+        target=_rerender_in_child, args=(feedstock_dir,)
+    )
+    proc.start()
+    proc.join()
+    return proc.exitcode
+
+
+def run_conda_smithy_rerender(feedstock_dir):
+    """Run `conda smithy rerender` and return its exit code.
+
+    By default smithy is run in a subprocess. If `CF_WEBSERVICES_RERENDER_ENGINE`
+    is `fork`, smithy's CLI is called in a forked child process instead, so
+    that a long-running worker that imported smithy up front (see `preload`)
+    does not pay for importing conda, conda-build and smithy on every
+    rerender, while each rerender still gets a fresh process.
+    """
+    engine = get_rerender_engine()
+    with span("conda_smithy_rerender", engine=engine) as sp:
+        if engine == "fork":
+            ret = _run_conda_smithy_rerender_fork(feedstock_dir)
+        else:
+            ret = _run_conda_smithy_rerender_subprocess(feedstock_dir)
+        sp.set_attributes(returncode=ret)
+    return ret
+
+
+@traced("rerender")
 def rerender(git_repo, can_change_workflows):
     LOGGER.info("rerendering")
 
     info_message = None
 
-    ensure_output_validation_is_on(git_repo)
+    with span("ensure_output_validation_is_on"):
+        output_validation_changed = ensure_output_validation_is_on(git_repo)
+
+    cache = get_rerender_cache()
+    _RERENDER_PINNING_VERSIONS.pop(git_repo.working_dir, None)
+    if cache is not None:
+        with span("rerender_cache_check"):
+            # smithy looks up the latest pinning again when it runs, so a
+            # newer one may be used but never an older one
+            pinning_version = get_rerender_pinning_version()
+            cache_hit = (
+                pinning_version is not None
+                and not output_validation_changed
+                and cache.get(git_repo)
+                == get_rerender_inputs_hash(
+                    git_repo, can_change_workflows, pinning_version
+                )
+            )
+        if pinning_version is not None:
+            _RERENDER_PINNING_VERSIONS[git_repo.working_dir] = pinning_version
+        set_span_attributes(cache_hit=cache_hit)
+        CACHE_LOOKUPS.inc(cache="rerender", result="hit" if cache_hit else "miss")
+        if cache_hit:
+            LOGGER.info("rerender inputs are unchanged since the last rerender")
+            return False, False, info_message
 
     curr_head = git_repo.active_branch.commit
-    ret = subprocess.call(
-        ["conda", "smithy", "rerender", "-c", "auto", "--no-check-uptodate"],
-        cwd=git_repo.working_dir,
-        env=os.environ,
-    )
+    ret = run_conda_smithy_rerender(git_repo.working_dir)
 
     if ret:
         changed, rerender_error = False, True
@@ -27,22 +257,14 @@ def rerender(git_repo, can_change_workflows):
         changed, rerender_error = False, False
     else:
         if not can_change_workflows:
+            # the clone may be shallow so make sure the previous commit is there
+            ensure_history(git_repo, "HEAD~1")
+
             # warn the user if the workflows changed but we can't push them
-            out = subprocess.run(
-                "git diff --name-only HEAD~1 HEAD",
-                shell=True,
-                capture_output=True,
-            )
-            changed_workflows = any(
-                [
-                    ".github/workflows" in line
-                    for line in out.stdout.decode().splitlines()
-                ]
-                + [
-                    ".github/workflows" in line
-                    for line in out.stderr.decode().splitlines()
-                ]
-            )
+            head = git_repo.head.commit
+            old_workflows = _get_workflow_blobs(head.parents[0])
+            new_workflows = _get_workflow_blobs(head)
+            changed_workflows = _blob_ids(old_workflows) != _blob_ids(new_workflows)
 
             if changed_workflows:
                 info_message = (
@@ -55,20 +277,82 @@ def rerender(git_repo, can_change_workflows):
                     "https://conda-forge.org/docs/maintainer/updating_pkgs.html"
                     "#rerendering-with-conda-smithy-locally"
                 )
-
-            subprocess.call(
-                ["git", "checkout", "HEAD~1", "--", ".github/workflows/*"],
-                cwd=git_repo.working_dir,
-            )
-            subprocess.call(
-                ["git", "commit", "--amend", "--allow-empty", "--no-edit"],
-                cwd=git_repo.working_dir,
-            )
+                _undo_workflow_changes(git_repo, old_workflows, new_workflows)
         changed, rerender_error = True, False
 
+    set_span_attributes(changed=changed, rerender_error=rerender_error)
     return changed, rerender_error, info_message
 
 
+WORKFLOWS_DIR = ".github/workflows"
+
+
+def _get_workflow_blobs(commit):
+    """Get a dict mapping the path of each file in the workflows directory of
+    a commit to its blob.
+
+    The objects are read through GitPython's object database, which reuses one
+    `git cat-file` process per repo instead of starting a git process per call.
+    """
+    try:
+        tree = commit.tree / WORKFLOWS_DIR
+    except KeyError:
+        return {}
+    return {item.path: item for item in tree.traverse() if item.type == "blob"}
+
+
+def _blob_ids(blobs):
+    return {path: (blob.binsha, blob.mode) for path, blob in blobs.items()}
+
+
+def _write_blob(git_repo, blob):
+    pth = os.path.join(git_repo.working_dir, blob.path)
+    if os.path.lexists(pth):
+        os.remove(pth)
+    os.makedirs(os.path.dirname(pth), exist_ok=True)
+    data = blob.data_stream.read()
+    if blob.mode == blob.link_mode:
+        os.symlink(data.decode("utf-8"), pth)
+    else:
+        with open(pth, "wb") as fp:
+            fp.write(data)
+        if blob.mode == blob.executable_mode:
+            os.chmod(pth, 0o755)
+
+
+def _undo_workflow_changes(git_repo, old_workflows, new_workflows):
+    """Put the workflows of the previous commit back in the index and the
+    working tree and amend HEAD with them.
+
+    Only the amend starts a git process. GitPython's `IndexFile.commit` would
+    start one too (to hash the commit), and is slower than git itself.
+    """
+    old_ids = _blob_ids(old_workflows)
+    new_ids = _blob_ids(new_workflows)
+
+    index = git_repo.index
+    for path in new_workflows:
+        if path not in old_workflows:
+            del index.entries[(path, 0)]
+            pth = os.path.join(git_repo.working_dir, path)
+            if os.path.lexists(pth):
+                os.remove(pth)
+
+    restored = [
+        blob
+        for path, blob in old_workflows.items()
+        if new_ids.get(path, None) != old_ids[path]
+    ]
+    if restored:
+        index.add(restored, write=False)
+        for blob in restored:
+            _write_blob(git_repo, blob)
+    # the cached trees in the index extensions are stale now
+    index.write(ignore_extension_data=True)
+
+    git_repo.git.commit("--amend", "--allow-empty", "--no-edit", "--quiet")
+
+
 def ensure_output_validation_is_on(git_repo):
     pth = os.path.join(git_repo.working_dir, "conda-forge.yml")
     if os.path.exists(pth):
@@ -83,12 +367,7 @@ def ensure_output_validation_is_on(git_repo):
         with open(pth, "w") as fp:
             fp.write(yaml.dump(cfg, default_flow_style=False))
 
-        subprocess.run(
-            "git add conda-forge.yml",
-            shell=True,
-            cwd=git_repo.working_dir,
-            env=os.environ,
-        )
+        stage_files(git_repo, ["conda-forge.yml"])
         return True
     else:
         return False
@@ -0,0 +1,292 @@
+import collections
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .metrics import flush_process_metrics
+from .pr_context import load_pr_context
+
+LOGGER = logging.getLogger(__name__)
+
+# the GitHub client for the handlers in each pool process
+_PROCESS_GH = None
+
+# the fields of the client payload, other than the PR, that a job depends on
+EVENT_INPUTS = ("input_version",)
+
+
+def _init_process(make_gh):
+    global _PROCESS_GH
+    _PROCESS_GH = make_gh() if make_gh is not None else None
+
+
+def _run_in_process(handler, event_name, event_data):
+    try:
+        handler(_PROCESS_GH, event_name, event_data)
+    finally:
+        flush_process_metrics()
+
+
+def get_event_key(event_data):
+    """Get the key used to serialize jobs for an event.
+
+    Jobs for the same PR of the same repo share a key. Events without a PR get
+    `None` and are never serialized against other jobs.
+    """
+    try:
+        return (
+            event_data["repository"]["full_name"],
+            int(event_data["client_payload"]["pr"]),
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def get_event_inputs(event_data):
+    """Get the inputs of an event (e.g., the version asked for by a
+    `version_update`) that change the result of its job.
+    """
+    try:
+        payload = event_data["client_payload"]
+        return tuple(payload.get(name, None) for name in EVENT_INPUTS)
+    except (KeyError, TypeError, AttributeError):
+        return ()
+
+
+def get_pr_head_sha(gh, event_data):
+    """Get the SHA of the head commit of the PR for an event."""
+    repo_name, pr_num = get_event_key(event_data)
+    return load_pr_context(gh, repo_name, pr_num).head_sha
+
+
+class DispatchScheduler:
+    """Run dispatch events in a pool of processes, one job per PR at a time.
+
+    Jobs for the same PR (see `get_event_key`) never run concurrently. If a job
+    is submitted for a PR that already has a job with the same action waiting to
+    run, the waiting job is superseded by the newer one and keeps its place in
+    the queue. If `resolve_head_sha` is given, an event whose PR head commit,
+    action and inputs (see `get_event_inputs`) match a job that is already
+    queued or running is dropped since it would produce the same result.
+
+    If a pool process dies, the jobs running in the pool and the jobs waiting
+    to run are reported as failed, and later jobs run in a new pool.
+
+    Parameters
+    ----------
+    max_workers : int
+        The maximum number of jobs to run at once.
+    handler : callable
+        A picklable function called as `handler(gh, event_name, event_data)` in
+        the pool processes.
+    make_gh : callable, optional
+        A picklable function called once in each pool process to make the GitHub
+        client passed to `handler`.
+    on_done : callable, optional
+        Called as `on_done(tag, ok)` in the parent process when a job finishes,
+        is superseded or is dropped as a duplicate, where `tag` is the value given
+        to `submit`.
+    mp_context : multiprocessing context, optional
+        The context used to start the pool processes.
+    resolve_head_sha : callable, optional
+        Called as `resolve_head_sha(event_data)` in the parent process to get the
+        SHA of the PR head commit for an event, or None if it is not known.
+    """
+
+    def __init__(
+        self,
+        max_workers,
+        handler,
+        make_gh=None,
+        on_done=None,
+        mp_context=None,
+        resolve_head_sha=None,
+    ):
+        self.max_workers = max_workers
+        self.handler = handler
+        self.on_done = on_done
+        self.resolve_head_sha = resolve_head_sha
+        self.num_ok = 0
+        self.num_failed = 0
+        self.num_superseded = 0
+        self.num_duplicates = 0
+
+        self._make_gh = make_gh
+        self._mp_context = mp_context
+        self._executor = self._make_executor()
+        self._lock = threading.Condition()
+        # key -> (future, action, sha, inputs)
+        self._running = {}
+        # key -> {action: (event_name, event_data, tag, sha, inputs)}
+        self._pending = {}
+        self._order = collections.deque()
+        self._num_keyless = 0
+
+    def _make_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=self._mp_context,
+            initializer=_init_process,
+            initargs=(self._make_gh,),
+        )
+
+    @property
+    def queue_depth(self):
+        """The number of jobs waiting to run."""
+        with self._lock:
+            return sum(len(jobs) for jobs in self._pending.values())
+
+    @property
+    def num_running(self):
+        with self._lock:
+            return len(self._running)
+
+    def _get_head_sha(self, event_data):
+        if self.resolve_head_sha is None:
+            return None
+        try:
+            return self.resolve_head_sha(event_data)
+        except Exception as e:
+            LOGGER.warning("could not get the PR head commit: %r", e)
+            return None
+
+    def submit(self, event_name, event_data, tag=None):
+        """Queue an event to be handled.
+
+        Returns
+        -------
+        status : str
+            One of "queued", "superseded" if the event replaced a job that was
+            waiting to run, or "duplicate" if the event was dropped because an
+            identical job is already queued or running.
+        """
+        key = get_event_key(event_data)
+        action = event_data.get("action", None)
+        sha = self._get_head_sha(event_data) if key is not None else None
+        inputs = get_event_inputs(event_data)
+
+        dropped = None
+        with self._lock:
+            if key is None:
+                self._num_keyless += 1
+                key = ("", -self._num_keyless)
+
+            jobs = self._pending.setdefault(key, collections.OrderedDict())
+            running = self._running.get(key, None)
+            if sha is not None and (
+                (running is not None and running[1:] == (action, sha, inputs))
+                or (action in jobs and jobs[action][3:] == (sha, inputs))
+            ):
+                status = "duplicate"
+                dropped = tag
+                self.num_duplicates += 1
+                LOGGER.info("dropping duplicate %s event for %s@%s", action, key, sha)
+            elif action in jobs:
+                status = "superseded"
+                dropped = jobs[action][2]
+                self.num_superseded += 1
+                LOGGER.info("%s event for %s supersedes a queued event", action, key)
+                jobs[action] = (event_name, event_data, tag, sha, inputs)
+            else:
+                status = "queued"
+                jobs[action] = (event_name, event_data, tag, sha, inputs)
+                if key not in self._order:
+                    self._order.append(key)
+
+            if not jobs:
+                del self._pending[key]
+
+            failed = self._start_jobs()
+
+        if status != "queued" and self.on_done is not None:
+            self.on_done(dropped, True)
+        self._report_failed(failed)
+
+        return status
+
+    def _start_jobs(self):
+        # must be called with the lock held, returns the tags of the jobs that
+        # failed to start
+        for key in list(self._order):
+            if len(self._running) >= self.max_workers:
+                break
+            if key in self._running:
+                continue
+
+            jobs = self._pending[key]
+            action, (event_name, event_data, tag, sha, inputs) = jobs.popitem(
+                last=False
+            )
+            if not jobs:
+                del self._pending[key]
+                self._order.remove(key)
+
+            LOGGER.info("starting %s job for %s", action, key)
+            try:
+                fut = self._executor.submit(
+                    _run_in_process, self.handler, event_name, event_data
+                )
+            except BrokenProcessPool:
+                return [tag] + self._reset_broken_pool()
+            self._running[key] = (fut, action, sha, inputs)
+            fut.add_done_callback(
+                lambda fut, key=key, tag=tag: self._job_done(key, tag, fut)
+            )
+        return []
+
+    def _reset_broken_pool(self):
+        # must be called with the lock held
+        #
+        # a pool process died (e.g., it was killed for using too much memory),
+        # which fails the jobs that were running in the pool. The queued jobs
+        # are failed too, and the next jobs get a new pool.
+        LOGGER.error("a pool process died, failing the queued jobs")
+        failed = [job[2] for key in self._order for job in self._pending[key].values()]
+        self._pending.clear()
+        self._order.clear()
+        self._executor = self._make_executor()
+        # the job that found the pool broken counts too
+        self.num_failed += len(failed) + 1
+        self._lock.notify_all()
+        return failed
+
+    def _report_failed(self, tags):
+        if self.on_done is not None:
+            for tag in tags:
+                self.on_done(tag, False)
+
+    def _job_done(self, key, tag, fut):
+        exc = fut.exception()
+        if exc is not None:
+            LOGGER.error("job for %s failed: %r", key, exc)
+
+        with self._lock:
+            del self._running[key]
+            if exc is None:
+                self.num_ok += 1
+            else:
+                self.num_failed += 1
+            failed = self._start_jobs()
+            self._lock.notify_all()
+
+        if self.on_done is not None:
+            self.on_done(tag, exc is None)
+        self._report_failed(failed)
+
+    def wait(self, timeout=None):
+        """Wait until every queued and running job is done."""
+        with self._lock:
+            return self._lock.wait_for(
+                lambda: not self._running and not self._pending, timeout=timeout
+            )
+
+    def shutdown(self):
+        self.wait()
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
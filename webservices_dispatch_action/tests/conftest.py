@@ -0,0 +1,78 @@
+import os
+import random
+import subprocess
+
+import pytest
+
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "conda-forge-webservices[bot]",
+    "GIT_AUTHOR_EMAIL": "bot@example.com",
+    "GIT_COMMITTER_NAME": "conda-forge-webservices[bot]",
+    "GIT_COMMITTER_EMAIL": "bot@example.com",
+}
+
+
+def make_bare_repo_with_history(
+    path, num_commits, blob_size=1024, branch="main", files=None
+):
+    """Make a bare git repo at `path` with `num_commits` commits on `branch`.
+
+    Each commit rewrites `data.bin` with `blob_size` pseudo-random bytes so that
+    the history is expensive to fetch. The final commit also adds `files`, a dict
+    mapping paths to contents.
+    """
+    subprocess.run(
+        ["git", "init", "--bare", "-q", "-b", branch, path],
+        check=True,
+    )
+    # allow partial clones like the GitHub servers do
+    subprocess.run(
+        ["git", "config", "uploadpack.allowFilter", "true"],
+        cwd=path,
+        check=True,
+    )
+
+    stream = []
+    for i in range(num_commits):
+        data = random.Random(i).randbytes(blob_size)
+        msg = b"commit %d" % i
+        stream.append(b"commit refs/heads/%s\n" % branch.encode())
+        stream.append(b"mark :%d\n" % (i + 1))
+        stream.append(
+            b"committer bot <bot@example.com> %d +0000\n" % (1_600_000_000 + i)
+        )
+        stream.append(b"data %d\n%s\n" % (len(msg), msg))
+        if i > 0:
+            stream.append(b"from :%d\n" % i)
+        stream.append(b"M 644 inline data.bin\ndata %d\n%s\n" % (len(data), data))
+        if i == num_commits - 1:
+            for fname, content in (files or {}).items():
+                content = content.encode()
+                stream.append(
+                    b"M 644 inline %s\ndata %d\n%s\n"
+                    % (fname.encode(), len(content), content)
+                )
+
+    subprocess.run(
+        ["git", "fast-import", "--quiet"],
+        input=b"".join(stream),
+        cwd=path,
+        check=True,
+    )
+    return path
+
+
+@pytest.fixture
+def git_env(monkeypatch):
+    for k, v in GIT_ENV.items():
+        monkeypatch.setenv(k, v)
+
+
+@pytest.fixture
+def bare_repo(tmp_path):
+    """A bare repo with a moderately long history, returned as a file:// URL."""
+    pth = make_bare_repo_with_history(
+        os.path.join(str(tmp_path), "remote.git"),
+        50,
+    )
+    return "file://" + pth
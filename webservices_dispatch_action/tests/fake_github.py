@@ -0,0 +1,353 @@
+"""
+An offline stand-in for GitHub for end-to-end tests and benchmarks.
+
+`FakeGithubServer` serves the parts of the REST and GraphQL APIs that a
+dispatch uses and keeps the feedstocks as bare git repos on disk, so that
+`GITHUB_API_URL` and `GITHUB_SERVER_URL` can point at it. Use it like
+
+    with FakeGithubServer(tmpdir) as server:
+        server.add_pull(
+            "conda-forge/foo-feedstock", 1, "regro/foo-feedstock", "my-branch"
+        )
+        os.environ.update(server.env())
+        ...
+"""
+
+import hashlib
+import http.server
+import json
+import os
+import subprocess
+import threading
+import time
+import urllib.parse
+
+from .conftest import make_bare_repo_with_history
+
+FIXTURE_META_YAML = """\
+{%% set name = "%(name)s" %%}
+{%% set version = "%(version)s" %%}
+
+package:
+  name: {{ name|lower }}
+  version: {{ version }}
+
+source:
+  url: https://example.com/{{ name }}/{{ name }}-{{ version }}.tar.gz
+  sha256: 0000000000000000000000000000000000000000000000000000000000000000
+
+build:
+  number: 0
+  noarch: python
+  script: {{ PYTHON }} -m pip install . -vv
+
+requirements:
+  host:
+    - python >=3.8
+    - pip
+  run:
+    - python >=3.8
+
+about:
+  home: https://github.com/conda-forge/webservices-dispatch-action
+  license: BSD-3-Clause
+  summary: a fixture package
+
+extra:
+  recipe-maintainers:
+    - conda-forge/core
+"""
+
+# a stand-in for `conda smithy rerender` that commits a change like smithy does
+FAKE_CONDA_SCRIPT = """\
+#!/bin/sh
+set -e
+mkdir -p .ci_support
+echo "$$-$(date +%s%N)" > .ci_support/rerender.txt
+git add .ci_support
+git commit -q -m "MNT: Re-rendered with fake conda-smithy"
+"""
+
+
+def make_fake_conda(bin_dir):
+    """Write a fake `conda` to `bin_dir` that "rerenders" by committing a file."""
+    os.makedirs(bin_dir, exist_ok=True)
+    pth = os.path.join(bin_dir, "conda")
+    with open(pth, "w") as fp:
+        fp.write(FAKE_CONDA_SCRIPT)
+    os.chmod(pth, 0o755)
+    return pth
+
+
+def fixture_feedstock_files(name, version="1.0.0", num_outputs=0):
+    """Get the files of a small feedstock. Extra outputs make the recipe bigger."""
+    meta_yaml = FIXTURE_META_YAML % {"name": name, "version": version}
+    if num_outputs:
+        meta_yaml += "\noutputs:\n" + "".join(
+            "  - name: %s-output-%d\n" % (name, i) for i in range(num_outputs)
+        )
+    return {
+        "recipe/meta.yaml": meta_yaml,
+        "conda-forge.yml": "conda_forge_output_validation: true\n",
+    }
+
+
+class _FakeGithubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, data, etag=True):
+        body = json.dumps(data).encode("utf-8")
+        tag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if etag and self.headers.get("If-None-Match") == tag:
+            self.send_response(304)
+            self.send_header("ETag", tag)
+            self._send_rate_limit_headers()
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        if etag:
+            self.send_header("ETag", tag)
+        self._send_rate_limit_headers()
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_rate_limit_headers(self):
+        limit, remaining, reset = self.server.fake.rate_limit()
+        self.send_header("X-RateLimit-Limit", str(limit))
+        self.send_header("X-RateLimit-Remaining", str(remaining))
+        self.send_header("X-RateLimit-Reset", str(reset))
+        self.send_header("X-RateLimit-Resource", "core")
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", "0") or "0")
+        body = self.rfile.read(length) if length else b""
+        return json.loads(body) if body else {}
+
+    def _handle(self, method):
+        fake = self.server.fake
+        path = urllib.parse.urlsplit(self.path).path
+        data = self._read_json() if method in ["POST", "PATCH"] else None
+        fake.record(method, path, data)
+        try:
+            status, out = fake.route(method, path.strip("/").split("/"), data)
+        except KeyError:
+            status, out = 404, {"message": "Not Found"}
+        self._send_json(status, out, etag=method == "GET" and status == 200)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+
+class FakeGithubServer:
+    """A fake GitHub API and git server on localhost.
+
+    Parameters
+    ----------
+    root : str
+        The directory holding the bare git repos, as `<owner>/<repo>.git`.
+
+    Attributes
+    ----------
+    api_url : str
+        The URL of the API, for `GITHUB_API_URL`.
+    server_url : str
+        The URL of the git server, for `GITHUB_SERVER_URL`.
+    requests : list of tuple
+        The `(method, path, data)` of every API request.
+    comments : dict
+        Maps `(repo name, PR number)` to the list of comment bodies.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.server_url = "file://" + self.root
+        self.requests = []
+        self.comments = {}
+        self._pulls = {}
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    def start(self):
+        self._httpd = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), _FakeGithubHandler
+        )
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        self.api_url = "http://127.0.0.1:%d" % self._httpd.server_address[1]
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def env(self):
+        """Get the environment variables that point a dispatch at this server."""
+        return {"GITHUB_API_URL": self.api_url, "GITHUB_SERVER_URL": self.server_url}
+
+    def repo_path(self, full_name):
+        return os.path.join(self.root, full_name + ".git")
+
+    def add_repo(self, full_name, files=None, num_commits=1, branch="main"):
+        """Make a bare git repo for `full_name` with `files` in its last commit."""
+        pth = self.repo_path(full_name)
+        os.makedirs(os.path.dirname(pth), exist_ok=True)
+        make_bare_repo_with_history(
+            pth,
+            num_commits,
+            blob_size=64,
+            branch=branch,
+            files=files,
+        )
+        return pth
+
+    def add_branch(self, full_name, branch, from_branch="main"):
+        subprocess.run(
+            ["git", "branch", branch, from_branch],
+            cwd=self.repo_path(full_name),
+            check=True,
+        )
+
+    def add_pull(self, repo_name, number, head_repo_name, head_ref, state="open"):
+        """Add an open PR of `head_repo_name:head_ref` against `repo_name`."""
+        with self._lock:
+            self._pulls[(repo_name, number)] = {
+                "state": state,
+                "head_repo": head_repo_name,
+                "head_ref": head_ref,
+            }
+            self.comments.setdefault((repo_name, number), [])
+
+    def get_pull_state(self, repo_name, number):
+        with self._lock:
+            return self._pulls[(repo_name, number)]["state"]
+
+    def head_sha(self, full_name, ref):
+        return subprocess.run(
+            ["git", "rev-parse", ref],
+            cwd=self.repo_path(full_name),
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+
+    def rate_limit(self):
+        return 5000, 4999, int(time.time()) + 3600
+
+    def record(self, method, path, data):
+        with self._lock:
+            self.requests.append((method, path, data))
+
+    def _repo_json(self, full_name):
+        owner, name = full_name.split("/")
+        return {
+            "id": abs(hash(full_name)) % 10**8,
+            "name": name,
+            "full_name": full_name,
+            "owner": {"login": owner, "type": "Organization"},
+            "url": "%s/repos/%s" % (self.api_url, full_name),
+            "clone_url": "%s/%s.git" % (self.server_url, full_name),
+            "default_branch": "main",
+        }
+
+    def _pull_json(self, repo_name, number):
+        with self._lock:
+            pull = dict(self._pulls[(repo_name, number)])
+        base = "%s/repos/%s" % (self.api_url, repo_name)
+        return {
+            "number": number,
+            "state": pull["state"],
+            "url": "%s/pulls/%d" % (base, number),
+            "issue_url": "%s/issues/%d" % (base, number),
+            "head": {
+                "ref": pull["head_ref"],
+                "sha": self.head_sha(pull["head_repo"], pull["head_ref"]),
+                "repo": self._repo_json(pull["head_repo"]),
+            },
+            "base": {"ref": "main", "repo": self._repo_json(repo_name)},
+        }
+
+    def _graphql(self, data):
+        variables = data["variables"]
+        repo_name = "%s/%s" % (variables["owner"], variables["name"])
+        pull = self._pull_json(repo_name, variables["number"])
+        owner, name = pull["head"]["repo"]["full_name"].split("/")
+        return {
+            "data": {
+                "repository": {
+                    "pullRequest": {
+                        "state": pull["state"].upper(),
+                        "headRefName": pull["head"]["ref"],
+                        "headRefOid": pull["head"]["sha"],
+                        "headRepositoryOwner": {"login": owner},
+                        "headRepository": {"name": name},
+                    }
+                }
+            }
+        }
+
+    def route(self, method, parts, data):
+        """Handle a request to the API. Raises `KeyError` for unknown routes."""
+        if method == "GET" and parts == ["rate_limit"]:
+            limit, remaining, reset = self.rate_limit()
+            core = {"limit": limit, "remaining": remaining, "reset": reset, "used": 1}
+            return 200, {"resources": {"core": core}, "rate": core}
+
+        if method == "POST" and parts == ["graphql"]:
+            return 200, self._graphql(data)
+
+        if parts[0] != "repos" or len(parts) < 3:
+            raise KeyError(parts)
+        repo_name = "/".join(parts[1:3])
+        rest = parts[3:]
+
+        if method == "GET" and not rest:
+            if not os.path.exists(self.repo_path(repo_name)):
+                raise KeyError(repo_name)
+            return 200, self._repo_json(repo_name)
+
+        if rest[:1] == ["pulls"] and len(rest) == 2:
+            number = int(rest[1])
+            if method == "PATCH":
+                with self._lock:
+                    if "state" in data:
+                        self._pulls[(repo_name, number)]["state"] = data["state"]
+            return 200, self._pull_json(repo_name, number)
+
+        if method == "POST" and rest[:1] == ["issues"] and rest[2:] == ["comments"]:
+            number = int(rest[1])
+            with self._lock:
+                comments = self.comments[(repo_name, number)]
+                comments.append(data["body"])
+                comment_id = len(comments)
+            return 201, {
+                "id": comment_id,
+                "body": data["body"],
+                "url": "%s/repos/%s/issues/comments/%d"
+                % (self.api_url, repo_name, comment_id),
+            }
+
+        raise KeyError(parts)
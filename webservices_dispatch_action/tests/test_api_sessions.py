@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from webservices_dispatch_action import api_sessions, global_sensitive_env
+from webservices_dispatch_action.api_sessions import (
+    clear_actor_token_cache,
+    get_actor_token,
+)
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    """Count the API requests made to probe the rerendering token."""
+    calls = []
+    reset_time = [time.time() + 3600]
+
+    class _Github:
+        def __init__(self, token, **kwargs):
+            calls.append(token)
+            if token == "bad":
+                raise RuntimeError("bad credentials!")
+            self.rate_limiting_resettime = reset_time[0]
+
+    monkeypatch.setattr(api_sessions, "PooledGithub", _Github)
+    monkeypatch.setattr(
+        global_sensitive_env,
+        "classified_info",
+        {"INPUT_GITHUB_TOKEN": "gha", "INPUT_RERENDERING_GITHUB_TOKEN": "app"},
+    )
+    clear_actor_token_cache()
+    yield calls, reset_time
+    clear_actor_token_cache()
+
+
+def test_get_actor_token_cached(probes):
+    calls, reset_time = probes
+
+    for _ in range(4):
+        assert get_actor_token() == ("x-access-token", "app", True)
+    assert calls == ["app"]
+
+    assert get_actor_token(force_refresh=True) == ("x-access-token", "app", True)
+    assert len(calls) == 2
+
+    clear_actor_token_cache()
+    assert get_actor_token() == ("x-access-token", "app", True)
+    assert len(calls) == 3
+
+
+def test_get_actor_token_expiring(probes):
+    calls, reset_time = probes
+
+    # the token is close to expiring so it is probed every time
+    reset_time[0] = time.time() + 10
+    assert get_actor_token() == ("x-access-token", "app", True)
+    assert get_actor_token() == ("x-access-token", "app", True)
+    assert len(calls) == 2
+
+    reset_time[0] = time.time() - 10
+    assert get_actor_token() == ("x-access-token", "gha", False)
+
+
+def test_get_actor_token_bad_token(probes):
+    calls, _ = probes
+    global_sensitive_env.classified_info["INPUT_RERENDERING_GITHUB_TOKEN"] = "bad"
+    assert get_actor_token() == ("x-access-token", "gha", False)
+
+    global_sensitive_env.classified_info["INPUT_RERENDERING_GITHUB_TOKEN"] = ""
+    assert get_actor_token() == ("x-access-token", "gha", False)
+    assert calls == ["bad"]
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from webservices_dispatch_action.conda_meta import (
+    get_installed_version,
+    get_latest_channel_version,
+    load_pkg_versions,
+)
+
+
+def _make_prefix(tmp_path, pkgs):
+    (tmp_path / "conda-meta").mkdir()
+    for name, version in pkgs.items():
+        (tmp_path / "conda-meta" / ("%s-%s-h123_0.json" % (name, version))).write_text(
+            json.dumps({"name": name, "version": version})
+        )
+    return str(tmp_path)
+
+
+def test_get_installed_version(tmp_path):
+    prefix = _make_prefix(
+        tmp_path,
+        {"conda": "24.7.1", "conda-build": "24.7.0", "conda-forge-pinning": "2024.08"},
+    )
+    assert get_installed_version("conda", prefix=prefix) == "24.7.1"
+    assert get_installed_version("conda-build", prefix=prefix) == "24.7.0"
+    assert get_installed_version("conda-forge-pinning", prefix=prefix) == "2024.08"
+    assert get_installed_version("conda-forge", prefix=prefix) is None
+    assert get_installed_version("mamba", prefix=prefix) is None
+
+
+def test_load_pkg_versions(tmp_path):
+    assert "conda-smithy" in load_pkg_versions()
+    with pytest.raises(FileNotFoundError):
+        load_pkg_versions(str(tmp_path / "missing.json"))
+
+
+class _FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+def test_get_latest_channel_version(monkeypatch):
+    import requests
+
+    files = [
+        {"version": "2024.09.01.00.00.00", "labels": ["main"]},
+        {"version": "2024.10.01.00.00.00", "labels": ["main", "broken"]},
+        {"version": "2024.08.01.00.00.00", "labels": ["main"]},
+    ]
+    urls = []
+
+    def _get(url, **kwargs):
+        urls.append(url)
+        return _FakeResponse({"files": files})
+
+    monkeypatch.setattr(requests, "get", _get)
+    assert get_latest_channel_version("conda-forge-pinning") == "2024.09.01.00.00.00"
+    assert urls == ["https://api.anaconda.org/package/conda-forge/conda-forge-pinning"]
+
+    def _fail(url, **kwargs):
+        raise requests.ConnectionError("no network")
+
+    monkeypatch.setattr(requests, "get", _fail)
+    assert get_latest_channel_version("conda-forge-pinning") is None
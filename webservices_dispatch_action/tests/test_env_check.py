@@ -0,0 +1,62 @@
+import json
+
+from click.testing import CliRunner
+
+from webservices_dispatch_action.env_check import check_env, main
+
+from .test_conda_meta import _make_prefix
+
+PKG_VERSIONS = {
+    "conda": "24.7.1",
+    "conda-smithy": "3.37.2",
+    "conda-forge-webservices-update-timestamp": "2024-08-01T06:03:20.914422+00:00",
+}
+
+
+def test_check_env(tmp_path):
+    prefix = _make_prefix(tmp_path, {"conda": "24.7.1", "conda-smithy": "3.37.2"})
+    assert check_env(pkg_versions=PKG_VERSIONS, prefix=prefix) == {}
+
+    pkg_versions = dict(PKG_VERSIONS, **{"conda-smithy": "3.38.0", "mamba": "1.5.8"})
+    assert check_env(pkg_versions=pkg_versions, prefix=prefix) == {
+        "conda-smithy": ("3.38.0", "3.37.2"),
+        "mamba": ("1.5.8", None),
+    }
+
+
+def test_check_env_cli(tmp_path):
+    prefix = _make_prefix(tmp_path, {"conda": "24.7.1", "conda-smithy": "3.37.2"})
+    pth = tmp_path / "pkg_versions.json"
+    pth.write_text(json.dumps(PKG_VERSIONS))
+
+    runner = CliRunner()
+    ret = runner.invoke(main, ["--prefix", prefix, "--pkg-versions", str(pth)])
+    assert ret.exit_code == 0
+
+    pth.write_text(json.dumps(dict(PKG_VERSIONS, conda="24.9.0")))
+    ret = runner.invoke(main, ["--prefix", prefix, "--pkg-versions", str(pth)])
+    assert ret.exit_code == 1
+
+    ret = runner.invoke(
+        main, ["--prefix", prefix, "--pkg-versions", str(pth), "--specs"]
+    )
+    assert ret.exit_code == 1
+    assert ret.stdout == "conda==24.9.0\n"
+
+    ret = runner.invoke(
+        main, ["--prefix", prefix, "--pkg-versions", str(pth), "--pinned"]
+    )
+    assert ret.exit_code == 0
+    assert ret.stdout == "conda==24.9.0\nconda-smithy==3.37.2\n"
+
+
+def test_check_env_cli_missing_pkg_versions(tmp_path):
+    prefix = _make_prefix(tmp_path, {"conda": "24.7.1"})
+
+    runner = CliRunner()
+    ret = runner.invoke(
+        main,
+        ["--prefix", prefix, "--pkg-versions", str(tmp_path / "missing.json")],
+    )
+    assert ret.exit_code == 2
+    assert "could not load the pinned package versions" in ret.stderr
@@ -0,0 +1,77 @@
+import json
+import os
+
+import pytest
+
+from webservices_dispatch_action import __main__ as dispatch_main
+from webservices_dispatch_action import global_sensitive_env
+from webservices_dispatch_action.api_sessions import clear_actor_token_cache
+from webservices_dispatch_action.github_http import reset_http_layer
+
+from .fake_github import FakeGithubServer, fixture_feedstock_files, make_fake_conda
+
+
+@pytest.fixture
+def fake_github(tmp_path, monkeypatch, git_env):
+    with FakeGithubServer(str(tmp_path / "github")) as server:
+        server.add_repo(
+            "conda-forge/foo-feedstock", files=fixture_feedstock_files("foo")
+        )
+        server.add_repo("regro/foo-feedstock", files=fixture_feedstock_files("foo"))
+        server.add_branch("regro/foo-feedstock", "pr-branch")
+        server.add_pull(
+            "conda-forge/foo-feedstock", 1, "regro/foo-feedstock", "pr-branch"
+        )
+
+        for k, v in server.env().items():
+            monkeypatch.setenv(k, v)
+        bin_dir = str(tmp_path / "bin")
+        make_fake_conda(bin_dir)
+        monkeypatch.setenv("PATH", bin_dir + os.pathsep + os.environ["PATH"])
+        monkeypatch.setattr(
+            global_sensitive_env,
+            "classified_info",
+            {"INPUT_GITHUB_TOKEN": "gha", "INPUT_RERENDERING_GITHUB_TOKEN": "app"},
+        )
+        clear_actor_token_cache()
+        reset_http_layer()
+        yield server
+        reset_http_layer()
+        clear_actor_token_cache()
+
+
+def _run_main(tmp_path, monkeypatch, action, pr):
+    event_path = tmp_path / "event.json"
+    event_path.write_text(
+        json.dumps(
+            {
+                "action": action,
+                "client_payload": {"pr": pr},
+                "repository": {"full_name": "conda-forge/foo-feedstock"},
+            }
+        )
+    )
+    monkeypatch.setenv("GITHUB_EVENT_PATH", str(event_path))
+    monkeypatch.setenv("GITHUB_EVENT_NAME", "repository_dispatch")
+    dispatch_main.main()
+
+
+def test_fake_github_rerender(tmp_path, monkeypatch, fake_github):
+    old_sha = fake_github.head_sha("regro/foo-feedstock", "pr-branch")
+
+    _run_main(tmp_path, monkeypatch, "rerender", 1)
+
+    # the rerender was pushed to the PR head without a comment
+    assert fake_github.head_sha("regro/foo-feedstock", "pr-branch") != old_sha
+    assert fake_github.comments[("conda-forge/foo-feedstock", 1)] == []
+    paths = [path for _, path, _ in fake_github.requests]
+    assert "/graphql" in paths
+    assert "/repos/conda-forge/foo-feedstock/pulls/1" not in paths
+
+
+def test_fake_github_closed_pr(tmp_path, monkeypatch, fake_github):
+    fake_github.add_pull(
+        "conda-forge/foo-feedstock", 2, "regro/foo-feedstock", "pr-branch", "closed"
+    )
+    with pytest.raises(ValueError, match="Closed PRs"):
+        _run_main(tmp_path, monkeypatch, "rerender", 2)
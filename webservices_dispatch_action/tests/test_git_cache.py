@@ -0,0 +1,124 @@
+import os
+import subprocess
+
+import pytest
+
+from webservices_dispatch_action.git_cache import GitMirrorCache
+from webservices_dispatch_action.git_utils import clone_feedstock
+
+from .conftest import make_bare_repo_with_history
+
+
+def _push_commit(remote, tmp_path, msg):
+    work = str(tmp_path / "pusher")
+    if not os.path.exists(work):
+        subprocess.run(["git", "clone", "-q", remote, work], check=True)
+    subprocess.run(["git", "pull", "-q"], cwd=work, check=True)
+    subprocess.run(
+        ["git", "commit", "-q", "--allow-empty", "-m", msg], cwd=work, check=True
+    )
+    subprocess.run(["git", "push", "-q"], cwd=work, check=True)
+
+
+def test_clone_feedstock_uses_cache(tmp_path, bare_repo, monkeypatch, git_env):
+    cache_dir = str(tmp_path / "cache")
+    monkeypatch.setenv("CF_WEBSERVICES_GIT_CACHE_DIR", cache_dir)
+
+    git_repo = clone_feedstock(
+        bare_repo, str(tmp_path / "fs1"), "main", repo_key="regro/foo-feedstock"
+    )
+    mirror = os.path.join(cache_dir, "regro", "foo-feedstock.git")
+    assert os.path.exists(os.path.join(mirror, "HEAD"))
+    assert git_repo.remotes.origin.url == bare_repo
+    assert int(git_repo.git.rev_list("--count", "HEAD")) == 1
+
+    # a new commit upstream is picked up by an incremental fetch
+    _push_commit(bare_repo, tmp_path, "new commit")
+    git_repo = clone_feedstock(
+        bare_repo, str(tmp_path / "fs2"), "main", repo_key="regro/foo-feedstock"
+    )
+    assert git_repo.head.commit.message.strip() == "new commit"
+
+
+def test_clone_feedstock_cache_falls_back(tmp_path, bare_repo, monkeypatch):
+    # the cache dir is a file so the cache cannot be used
+    cache_file = tmp_path / "cache"
+    cache_file.write_text("")
+    monkeypatch.setenv("CF_WEBSERVICES_GIT_CACHE_DIR", str(tmp_path / "cache" / "x"))
+
+    git_repo = clone_feedstock(
+        bare_repo, str(tmp_path / "fs"), "main", repo_key="regro/foo-feedstock"
+    )
+    assert git_repo.active_branch.name == "main"
+    assert git_repo.remotes.origin.url == bare_repo
+
+
+def test_git_cache_evicts_lru(tmp_path):
+    remotes = {}
+    for name in ["a", "b", "c"]:
+        remotes[name] = "file://" + make_bare_repo_with_history(
+            str(tmp_path / (name + ".git")), 5, blob_size=64 * 1024
+        )
+
+    cache = GitMirrorCache(str(tmp_path / "cache"), max_size=10**12)
+    for name in ["a", "b", "c"]:
+        with cache.lock("o/" + name):
+            cache.update("o/" + name, remotes[name])
+        os.utime(
+            os.path.join(cache.mirror_path("o/" + name), "last-used"),
+            (ord(name), ord(name)),
+        )
+
+    # use `a` again so that `b` is the least recently used
+    with cache.lock("o/a"):
+        cache.update("o/a", remotes["a"])
+
+    # shrink the cache so that only two mirrors fit
+    sizes = {
+        name: sum(
+            os.path.getsize(os.path.join(r, f))
+            for r, _, fs in os.walk(cache.mirror_path("o/" + name))
+            for f in fs
+        )
+        for name in ["a", "b", "c"]
+    }
+    cache.max_size = sizes["a"] + sizes["c"] + 1
+    cache.evict()
+
+    assert os.path.exists(cache.mirror_path("o/a"))
+    assert not os.path.exists(cache.mirror_path("o/b"))
+    assert os.path.exists(cache.mirror_path("o/c"))
+
+
+def test_git_cache_evict_skips_locked_and_kept(tmp_path):
+    remote = "file://" + make_bare_repo_with_history(
+        str(tmp_path / "a.git"), 5, blob_size=64 * 1024
+    )
+    cache = GitMirrorCache(str(tmp_path / "cache"), max_size=0)
+    for key in ["o/a", "o/b"]:
+        with cache.lock(key):
+            cache.update(key, remote)
+
+    with cache.lock("o/a"):
+        cache.evict(keep=("o/b",))
+    assert os.path.exists(cache.mirror_path("o/a"))
+    assert os.path.exists(cache.mirror_path("o/b"))
+
+    cache.evict()
+    assert not os.path.exists(cache.mirror_path("o/a"))
+    assert not os.path.exists(cache.mirror_path("o/b"))
+
+
+def test_git_cache_lock_nonblocking(tmp_path):
+    cache = GitMirrorCache(str(tmp_path / "cache"))
+    with cache.lock("o/a") as locked:
+        assert locked
+        # flock locks are per open file so a second open sees the lock
+        with cache.lock("o/a", blocking=False) as locked_again:
+            assert not locked_again
+
+
+def test_git_cache_bad_key(tmp_path):
+    cache = GitMirrorCache(str(tmp_path / "cache"))
+    with pytest.raises(ValueError):
+        cache.mirror_path("../../etc")
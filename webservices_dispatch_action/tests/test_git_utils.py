@@ -0,0 +1,106 @@
+import os
+import subprocess
+
+from webservices_dispatch_action.git_utils import (
+    clone_feedstock,
+    ensure_history,
+    is_shallow,
+    stage_files,
+)
+
+from .conftest import make_bare_repo_with_history
+
+
+def _num_commits(git_repo):
+    return int(git_repo.git.rev_list("--count", "HEAD"))
+
+
+def _objects_size(git_repo):
+    tot = 0
+    for root, _, files in os.walk(os.path.join(git_repo.git_dir, "objects")):
+        for fname in files:
+            tot += os.path.getsize(os.path.join(root, fname))
+    return tot
+
+
+def test_clone_feedstock_shallow(tmp_path, bare_repo):
+    git_repo = clone_feedstock(bare_repo, str(tmp_path / "fs"), "main")
+    assert is_shallow(git_repo)
+    assert _num_commits(git_repo) == 1
+    assert git_repo.active_branch.name == "main"
+
+
+def test_clone_feedstock_full(tmp_path, bare_repo, monkeypatch):
+    monkeypatch.setenv("CF_WEBSERVICES_CLONE_DEPTH", "0")
+    git_repo = clone_feedstock(bare_repo, str(tmp_path / "fs"), "main")
+    assert not is_shallow(git_repo)
+    assert _num_commits(git_repo) == 50
+
+
+def test_clone_feedstock_filter(tmp_path, bare_repo):
+    git_repo = clone_feedstock(
+        bare_repo, str(tmp_path / "fs"), "main", depth=0, filter_spec="blob:none"
+    )
+    assert _num_commits(git_repo) == 50
+    assert git_repo.config_reader().get_value('remote "origin"', "promisor")
+
+
+def test_ensure_history_after_new_commit(tmp_path, bare_repo, git_env):
+    git_repo = clone_feedstock(bare_repo, str(tmp_path / "fs"), "main")
+    subprocess.run(
+        ["git", "commit", "--allow-empty", "-m", "MNT: rerender"],
+        cwd=git_repo.working_dir,
+        check=True,
+    )
+    assert ensure_history(git_repo, "HEAD~1")
+    # nothing had to be fetched
+    assert _num_commits(git_repo) == 2
+
+
+def test_ensure_history_deepens(tmp_path, bare_repo):
+    git_repo = clone_feedstock(bare_repo, str(tmp_path / "fs"), "main")
+    assert ensure_history(git_repo, "HEAD~5")
+    assert _num_commits(git_repo) >= 6
+    assert not ensure_history(git_repo, "HEAD~100")
+    assert not is_shallow(git_repo)
+
+
+def test_clone_feedstock_size(tmp_path):
+    remote = "file://" + make_bare_repo_with_history(
+        str(tmp_path / "long.git"), 400, blob_size=16 * 1024
+    )
+
+    full = clone_feedstock(remote, str(tmp_path / "full"), "main", depth=0)
+    shallow = clone_feedstock(remote, str(tmp_path / "shallow"), "main")
+
+    assert _objects_size(shallow) * 10 < _objects_size(full)
+
+
+def test_stage_files(tmp_path, bare_repo, git_env):
+    git_repo = clone_feedstock(bare_repo, str(tmp_path / "clone"), "main")
+    wd = git_repo.working_dir
+    with open(os.path.join(wd, "new.txt"), "w") as fp:
+        fp.write("new\n")
+    with open(os.path.join(wd, "run.sh"), "w") as fp:
+        fp.write("#!/bin/sh\n")
+    os.chmod(os.path.join(wd, "run.sh"), 0o755)
+
+    stage_files(git_repo, ["new.txt", "run.sh"])
+
+    out = subprocess.run(
+        ["git", "status", "--porcelain"],
+        cwd=wd,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    assert out == "A  new.txt\nA  run.sh\n"
+    out = subprocess.run(
+        ["git", "ls-files", "-s", "new.txt", "run.sh"],
+        cwd=wd,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    assert out.splitlines()[1].startswith("100755 ")
+    subprocess.run(["git", "fsck", "--no-dangling"], cwd=wd, check=True)
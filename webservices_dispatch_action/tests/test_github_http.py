@@ -0,0 +1,282 @@
+import hashlib
+import http.server
+import json
+import threading
+import time
+
+import pytest
+from github import Auth, Github
+
+from webservices_dispatch_action import github_http
+from webservices_dispatch_action.github_http import (
+    HTTP_STATS,
+    ETagCache,
+    PooledGithub,
+    PooledRequester,
+    RateLimitBudget,
+    get_rate_limit_budgets,
+    reset_http_layer,
+)
+
+
+class FakeGithubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.stats["connections"] += 1
+
+    def log_message(self, *args):
+        pass
+
+    def send_rate_limit_headers(self, count=True):
+        budget = self.server.budget
+        if count:
+            budget["remaining"] = max(budget["remaining"] - 1, 0)
+        self.send_header("X-RateLimit-Limit", str(budget["limit"]))
+        self.send_header("X-RateLimit-Remaining", str(budget["remaining"]))
+        self.send_header("X-RateLimit-Reset", str(int(budget["reset"])))
+
+    def do_GET(self):
+        self.server.stats["requests"] += 1
+        if self.server.errors:
+            status, headers, body = self.server.errors.pop(0)
+            body = body.encode("utf-8")
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        base = "http://%s:%d" % self.server.server_address
+        parts = self.path.strip("/").split("/")
+        if parts[0] == "repos" and len(parts) == 3:
+            data = {"full_name": "%s/%s" % tuple(parts[1:]), "url": base + self.path}
+        elif parts[0] == "repos" and len(parts) == 5 and parts[3] == "pulls":
+            data = {"number": int(parts[4]), "state": "open", "url": base + self.path}
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = json.dumps(data).encode("utf-8")
+        etag = (
+            '"%s"'
+            % hashlib.sha1(
+                body + self.headers.get("Authorization", "").encode("utf-8")
+            ).hexdigest()
+        )
+        if self.headers.get("If-None-Match") == etag:
+            self.server.stats["not_modified"] += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_rate_limit_headers(count=False)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_rate_limit_headers()
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def fake_github_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeGithubHandler)
+    server.daemon_threads = True
+    server.stats = {"connections": 0, "requests": 0, "not_modified": 0}
+    server.budget = {"limit": 5000, "remaining": 5000, "reset": time.time() + 3600}
+    server.errors = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class FakeClock:
+    """A clock that moves forward when slept on instead of sleeping."""
+
+    def __init__(self):
+        self.offset = 0
+        self.sleeps = []
+
+    def time(self):
+        return time.time() + self.offset
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.offset += seconds
+
+
+@pytest.fixture
+def http_layer(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(github_http, "time", clock)
+    monkeypatch.setattr(github_http, "_sleep", clock.sleep)
+    sleeps = clock.sleeps
+    reset_http_layer()
+    yield sleeps
+    reset_http_layer()
+
+
+def _lookup_prs(server, num_clients, token="abc", github_class=PooledGithub):
+    base_url = "http://%s:%d" % server.server_address
+    for _ in range(num_clients):
+        gh = github_class(
+            auth=Auth.Token(token), base_url=base_url, seconds_between_requests=0
+        )
+        for _ in range(2):
+            pr = gh.get_repo("conda-forge/foo-feedstock").get_pull(1)
+            assert pr.state == "open"
+        gh.close()
+
+
+def test_github_http_default(fake_github_server):
+    _lookup_prs(fake_github_server, 3, github_class=Github)
+    stats = fake_github_server.stats
+    print("\ndefault PyGithub connections:", stats)
+    assert stats["requests"] == 12
+    assert stats["connections"] == 3
+    assert stats["not_modified"] == 0
+
+
+def test_github_http_pooled(fake_github_server, http_layer):
+    _lookup_prs(fake_github_server, 3)
+    stats = fake_github_server.stats
+    print("\npooled connections:", stats)
+    assert stats["requests"] == 12
+    assert stats["connections"] == 1
+    # only the first lookups of the repo and PR are not conditional
+    assert stats["not_modified"] == 10
+    assert HTTP_STATS["requests"] == 12
+    assert HTTP_STATS["etag_hits"] == 10
+
+
+def test_github_http_etag_per_token(fake_github_server, http_layer):
+    _lookup_prs(fake_github_server, 1, token="abc")
+    _lookup_prs(fake_github_server, 1, token="def")
+    # the responses for one token are not reused for another
+    assert fake_github_server.stats["not_modified"] == 4
+
+
+def test_github_http_scoped(fake_github_server, http_layer):
+    _lookup_prs(fake_github_server, 1)
+    # other `Github` objects in the process keep PyGithub's connections
+    _lookup_prs(fake_github_server, 1, github_class=Github)
+    assert fake_github_server.stats["connections"] == 2
+    assert fake_github_server.stats["not_modified"] == 2
+    assert HTTP_STATS["requests"] == 4
+
+    gh = PooledGithub(auth=Auth.Token("abc"))
+    assert isinstance(gh.requester, PooledRequester)
+    assert isinstance(gh.withLazy(True).requester, PooledRequester)
+    assert isinstance(gh.requester.withAuth(Auth.Token("def")), PooledRequester)
+    assert not isinstance(Github(auth=Auth.Token("abc")).requester, PooledRequester)
+
+
+def test_etag_cache_lru():
+    cache = ETagCache(max_size=2)
+    keys = [
+        cache.key("/repos/a/%d" % i, {"Authorization": "token x"}) for i in range(3)
+    ]
+    assert keys[0] != cache.key("/repos/a/0", {"Authorization": "token y"})
+
+    cache.put(keys[0], '"0"', {}, "0")
+    cache.put(keys[1], '"1"', {}, "1")
+    assert cache.get(keys[0]) == ('"0"', {}, "0")
+    cache.put(keys[2], '"2"', {}, "2")
+    assert cache.get(keys[1]) is None
+    assert len(cache) == 2
+
+
+def test_github_http_rate_limit_budget(fake_github_server, http_layer):
+    fake_github_server.budget.update(
+        {"limit": 100, "remaining": 12, "reset": time.time() + 100}
+    )
+    _lookup_prs(fake_github_server, 1, token="abc")
+    _lookup_prs(fake_github_server, 1, token="def")
+
+    # the budget is spread out once it is at 10% of the limit (the 304s do
+    # not use it up)
+    sleeps = http_layer
+    assert len(sleeps) == 5
+    assert all(0 < s <= 100 / 8 for s in sleeps)
+    assert HTTP_STATS["rate_limit_delays"] == 5
+
+    budgets = get_rate_limit_budgets()
+    assert len(budgets) == 2
+    assert {b["resource"] for b in budgets} == {"core"}
+    assert sorted(b["remaining"] for b in budgets) == [8, 10]
+
+
+@pytest.mark.parametrize(
+    "status,headers,body",
+    [
+        (429, {"Retry-After": "7"}, "slow down"),
+        (403, {}, '{"message": "You have exceeded a secondary rate limit."}'),
+    ],
+)
+def test_github_http_retry_after(fake_github_server, http_layer, status, headers, body):
+    fake_github_server.errors.append((status, headers, body))
+    _lookup_prs(fake_github_server, 1)
+
+    assert http_layer == [pytest.approx(7 if status == 429 else 60, abs=0.1)]
+    assert fake_github_server.stats["requests"] == 5
+    assert HTTP_STATS["rate_limited"] == 1
+
+
+def test_github_http_retry_after_too_long(fake_github_server, http_layer):
+    fake_github_server.errors.append((429, {"Retry-After": "3600"}, "slow down"))
+    with pytest.raises(Exception):
+        _lookup_prs(fake_github_server, 1)
+    assert http_layer == []
+
+
+def test_rate_limit_budget_delay():
+    budget = RateLimitBudget("abc", "core", reserve=0.1, max_wait=30)
+    assert budget.get_delay(now=0) == 0
+
+    budget.update(
+        {
+            "X-RateLimit-Limit": "100",
+            "X-RateLimit-Remaining": "50",
+            "X-RateLimit-Reset": "100",
+        }
+    )
+    assert budget.get_delay(now=0) == 0
+
+    budget.update({"X-RateLimit-Remaining": "5"})
+    assert budget.get_delay(now=50) == 10
+    assert budget.get_delay(now=100) == 0
+
+    budget.update({"X-RateLimit-Remaining": "0"})
+    assert budget.get_delay(now=0) == 100
+
+
+def test_rate_limit_budget_max_wait(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(github_http, "_sleep", sleeps.append)
+    monkeypatch.delenv("CF_WEBSERVICES_RATE_LIMIT_MAX_WAIT", raising=False)
+    monkeypatch.setattr(github_http, "_DEFAULT_RATE_LIMIT_MAX_WAIT", 60)
+
+    # one-shot dispatches do not wait long, the worker does
+    budget = RateLimitBudget("abc", "core")
+    assert budget.max_wait == github_http.DEFAULT_RATE_LIMIT_MAX_WAIT
+    github_http.set_default_rate_limit_max_wait(github_http.WORKER_RATE_LIMIT_MAX_WAIT)
+    assert RateLimitBudget("abc", "core").max_wait == 900
+
+    # waits over the cap are skipped so the request fails fast
+    budget.block(600)
+    budget.wait()
+    assert sleeps == []
+    budget.blocked_until = time.time() + 10
+    budget.wait()
+    assert sleeps == [pytest.approx(10, abs=0.5)]
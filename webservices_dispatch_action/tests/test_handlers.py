@@ -0,0 +1,189 @@
+import subprocess
+import sys
+import types
+
+import pytest
+
+from webservices_dispatch_action import __main__ as dispatch_main
+from webservices_dispatch_action import handlers
+from webservices_dispatch_action.git_utils import clone_feedstock
+from webservices_dispatch_action.pr_context import PRContext
+
+from .conftest import make_bare_repo_with_history
+from .test_scheduler import FakeGithub
+
+
+def _commit(git_repo, msg):
+    subprocess.run(
+        ["git", "commit", "-q", "--allow-empty", "-m", msg],
+        cwd=git_repo.working_dir,
+        check=True,
+    )
+
+
+@pytest.fixture
+def version_update(tmp_path, git_env, monkeypatch):
+    """Run `handle_version_update` against a local feedstock, recording the
+    commits at the head of the branch each time it pushes or comments."""
+    make_bare_repo_with_history(str(tmp_path / "foo-feedstock.git"), 2)
+    remote = "file://" + str(tmp_path / "foo-feedstock.git")
+    pushes = []
+    state = {"rerender_error": False}
+
+    def _clone(repo_url, feedstock_dir, branch, **kwargs):
+        return clone_feedstock(remote, feedstock_dir, branch)
+
+    def _run_update_version(git_repo, repo_name, input_version=None):
+        _commit(git_repo, "ENH updated version to %s" % input_version)
+        return False
+
+    def _rerender(git_repo, can_change_workflows):
+        if state["rerender_error"]:
+            return False, True, None
+        _commit(git_repo, "MNT: Re-rendered")
+        return True, False, None
+
+    def _comment_and_push_if_changed(*, action, changed, error, git_repo, **kwargs):
+        pushes.append(
+            (
+                action,
+                changed,
+                error,
+                git_repo.active_branch.commit.message.strip(),
+                git_repo.active_branch.commit.parents[0].message.strip(),
+            )
+        )
+        return False
+
+    updater = types.ModuleType("webservices_dispatch_action.version_updater")
+    updater.run_update_version = _run_update_version
+    monkeypatch.setitem(
+        sys.modules, "webservices_dispatch_action.version_updater", updater
+    )
+    monkeypatch.setattr(handlers, "clone_feedstock", _clone)
+    monkeypatch.setattr(handlers, "rerender", _rerender)
+    monkeypatch.setattr(
+        handlers, "comment_and_push_if_changed", _comment_and_push_if_changed
+    )
+    monkeypatch.setattr(handlers, "get_actor_token", lambda: ("x", "y", True))
+
+    def _run():
+        handlers.handle_version_update(
+            FakeGithub(str(tmp_path)),
+            {
+                "action": "version_update",
+                "repository": {"full_name": "conda-forge/foo-feedstock"},
+                "client_payload": {"pr": 1, "input_version": "2.0"},
+            },
+            PRContext(
+                repo_name="conda-forge/foo-feedstock",
+                number=1,
+                state="open",
+                head_ref="main",
+                head_sha="sha-1",
+                head_owner="regro",
+                head_repo="foo-feedstock",
+            ),
+        )
+
+    return _run, pushes, state
+
+
+def test_handle_version_update_combined(version_update, monkeypatch):
+    run, pushes, _ = version_update
+    monkeypatch.delenv("CF_WEBSERVICES_VERSION_UPDATE_PUSH", raising=False)
+
+    run()
+    assert pushes == [
+        (
+            "update the version and rerender",
+            True,
+            False,
+            "MNT: Re-rendered",
+            "ENH updated version to 2.0",
+        )
+    ]
+
+
+def test_handle_version_update_separate(version_update, monkeypatch):
+    run, pushes, _ = version_update
+    monkeypatch.setenv("CF_WEBSERVICES_VERSION_UPDATE_PUSH", "separate")
+
+    run()
+    assert [p[:4] for p in pushes] == [
+        ("update the version", True, False, "ENH updated version to 2.0"),
+        ("rerender", True, False, "MNT: Re-rendered"),
+    ]
+
+
+def test_handle_version_update_combined_rerender_error(version_update):
+    run, pushes, state = version_update
+    state["rerender_error"] = True
+
+    with pytest.raises(RuntimeError, match="Rerendering failed"):
+        run()
+    assert [p[:4] for p in pushes] == [
+        ("update the version", True, False, "ENH updated version to 2.0"),
+        ("rerender", False, True, "ENH updated version to 2.0"),
+    ]
+
+
+def test_get_version_update_push_mode(monkeypatch):
+    monkeypatch.setenv("CF_WEBSERVICES_VERSION_UPDATE_PUSH", "blah")
+    with pytest.raises(ValueError):
+        handlers.get_version_update_push_mode()
+
+
+def test_handle_event_closed_pr(tmp_path, monkeypatch):
+    gh = FakeGithub(str(tmp_path))
+    monkeypatch.setattr(
+        dispatch_main,
+        "load_pr_context",
+        lambda gh, repo_name, pr_num: PRContext(
+            repo_name, pr_num, "closed", "main", "sha", "regro", "foo-feedstock"
+        ),
+    )
+    with pytest.raises(ValueError, match="Closed PRs cannot be rerendered!"):
+        dispatch_main.handle_event(
+            gh,
+            "repository_dispatch",
+            {
+                "action": "rerender",
+                "repository": {"full_name": "conda-forge/foo-feedstock"},
+                "client_payload": {"pr": 1},
+            },
+        )
+
+
+def test_handle_event_deleted_head_repo(tmp_path, monkeypatch):
+    gh = FakeGithub(str(tmp_path))
+    monkeypatch.setattr(
+        dispatch_main,
+        "load_pr_context",
+        lambda gh, repo_name, pr_num: PRContext(
+            repo_name, pr_num, "open", "main", "sha", None, None
+        ),
+    )
+    monkeypatch.setattr(
+        handlers,
+        "handle_rerender",
+        lambda *args: pytest.fail("the PR head should not be cloned"),
+    )
+    with pytest.raises(ValueError, match="no longer exists"):
+        dispatch_main.handle_event(
+            gh,
+            "repository_dispatch",
+            {
+                "action": "rerender",
+                "repository": {"full_name": "conda-forge/foo-feedstock"},
+                "client_payload": {"pr": 1},
+            },
+        )
+
+
+def test_validate_event():
+    with pytest.raises(ValueError, match="malformed"):
+        dispatch_main.validate_event(
+            "repository_dispatch",
+            {"action": "rerender", "client_payload": {"pr": "one"}},
+        )
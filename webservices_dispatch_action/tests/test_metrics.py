@@ -0,0 +1,130 @@
+import json
+import os
+import urllib.request
+
+import pytest
+
+from webservices_dispatch_action import metrics
+from webservices_dispatch_action.__main__ import handle_event
+from webservices_dispatch_action.tracing import span
+from webservices_dispatch_action.worker import DirectoryEventQueue, run_worker
+
+
+@pytest.fixture
+def clean_metrics():
+    metrics.reset_metrics()
+    yield
+    metrics.set_process_dir(None)
+    metrics.reset_metrics()
+
+
+def _event(pr, action="rerender"):
+    return {
+        "action": action,
+        "client_payload": {"pr": pr},
+        "repository": {"full_name": "conda-forge/foo-feedstock"},
+    }
+
+
+def _handle(gh, event_name, event_data):
+    pr = event_data["client_payload"]["pr"]
+    with span("dispatch", action=event_data["action"]) as sp:
+        with span("rerender"):
+            pass
+        if pr < 0:
+            raise RuntimeError("bad PR!")
+        sp.set_attributes(outcome="changed" if pr % 2 else "nothing_to_do")
+
+
+def test_metrics_format(clean_metrics):
+    metrics.DISPATCHES.inc(action="rerender", outcome="changed")
+    metrics.DISPATCHES.inc(action="rerender", outcome="changed")
+    metrics.DISPATCH_DURATION.observe(0.3, action="rerender", outcome="changed")
+    metrics.QUEUE_DEPTH.set_function(lambda: 4)
+
+    text = metrics.format_metrics()
+    lines = text.splitlines()
+    assert lines[-1] == "# EOF"
+    assert "# TYPE webservices_dispatches counter" in lines
+    assert (
+        'webservices_dispatches_total{action="rerender",outcome="changed"} 2' in lines
+    )
+    assert (
+        "webservices_dispatch_duration_seconds_bucket"
+        '{action="rerender",outcome="changed",le="0.1"} 0'
+    ) in lines
+    assert (
+        "webservices_dispatch_duration_seconds_bucket"
+        '{action="rerender",outcome="changed",le="0.5"} 1'
+    ) in lines
+    assert (
+        "webservices_dispatch_duration_seconds_bucket"
+        '{action="rerender",outcome="changed",le="+Inf"} 1'
+    ) in lines
+    assert "webservices_worker_queue_depth 4" in lines
+
+    with pytest.raises(ValueError):
+        metrics.DISPATCHES.inc(action="rerender")
+
+
+def test_metrics_dispatch_outcomes(clean_metrics):
+    with pytest.raises(ValueError):
+        handle_event(None, "repository_dispatch", _event(1, action="blah"))
+    _handle(None, "repository_dispatch", _event(1))
+    with pytest.raises(RuntimeError):
+        _handle(None, "repository_dispatch", _event(-1))
+
+    assert metrics.DISPATCHES.get(action="unknown", outcome="invalid") == 1
+    assert metrics.DISPATCHES.get(action="rerender", outcome="changed") == 1
+    assert metrics.DISPATCHES.get(action="rerender", outcome="error") == 1
+    assert metrics.PHASE_DURATION.get(phase="rerender")[0][-1] == 2
+
+
+def test_metrics_worker_processes(tmp_path, clean_metrics):
+    event_dir = tmp_path / "events"
+    event_dir.mkdir()
+    for i, pr in enumerate([1, 2, -3, 5]):
+        pth = event_dir / ("event-%d.json" % i)
+        pth.write_text(json.dumps(_event(pr)))
+        os.utime(pth, (i, i))
+
+    metrics.set_process_dir(str(tmp_path / "metrics"))
+    num_ok, num_failed = run_worker(
+        DirectoryEventQueue(str(event_dir)),
+        None,
+        exit_when_empty=True,
+        handler=_handle,
+        jobs=2,
+        make_gh=dict,
+    )
+    assert (num_ok, num_failed) == (3, 1)
+
+    # the dispatches were handled in the pool processes
+    assert metrics.DISPATCHES.values() == {}
+    metrics.write_metrics_file(str(tmp_path / "metrics.prom"))
+    with open(tmp_path / "metrics.prom") as fp:
+        lines = fp.read().splitlines()
+    for outcome, count in [("changed", 2), ("nothing_to_do", 1), ("error", 1)]:
+        assert (
+            'webservices_dispatches_total{action="rerender",outcome="%s"} %d'
+            % (outcome, count)
+        ) in lines
+    assert (
+        'webservices_dispatch_phase_duration_seconds_count{phase="rerender"} 4' in lines
+    )
+    assert "webservices_worker_queue_depth 0" in lines
+
+
+def test_metrics_http_endpoint(clean_metrics):
+    metrics.CACHE_LOOKUPS.inc(cache="version", result="hit")
+    server = metrics.serve_metrics(0, host="127.0.0.1")
+    try:
+        url = "http://127.0.0.1:%d/metrics" % server.server_address[1]
+        with urllib.request.urlopen(url) as resp:
+            assert resp.headers["Content-Type"] == metrics.OPENMETRICS_CONTENT_TYPE
+            body = resp.read().decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert 'webservices_cache_lookups_total{cache="version",result="hit"} 1' in body
@@ -0,0 +1,106 @@
+import dataclasses
+
+import pytest
+
+from webservices_dispatch_action.pr_context import (
+    LazyPullRequest,
+    PRContext,
+    load_pr_context,
+)
+
+from .test_scheduler import FakeGithub, FakeObject
+
+
+class FakeRequester:
+    def __init__(self, pr=None, error=None):
+        self.pr = pr
+        self.error = error
+        self.queries = []
+
+    def graphql_query(self, query, variables):
+        self.queries.append(variables)
+        if self.error is not None:
+            raise self.error
+        return {}, {"data": {"repository": {"pullRequest": self.pr}}}
+
+
+class CountingGithub(FakeGithub):
+    def __init__(self, remote_dir, requester):
+        super().__init__(remote_dir)
+        self.requester = requester
+        self.rest_calls = 0
+
+    def get_repo(self, repo_name):
+        self.rest_calls += 1
+        return super().get_repo(repo_name)
+
+
+GRAPHQL_PR = {
+    "state": "MERGED",
+    "headRefName": "patch-1",
+    "headRefOid": "abc123",
+    "headRepositoryOwner": {"login": "someone"},
+    "headRepository": {"name": "foo-feedstock"},
+}
+
+
+def test_load_pr_context_graphql(tmp_path):
+    gh = CountingGithub(str(tmp_path), FakeRequester(pr=GRAPHQL_PR))
+    ctx = load_pr_context(gh, "conda-forge/foo-feedstock", 5)
+
+    assert ctx == PRContext(
+        repo_name="conda-forge/foo-feedstock",
+        number=5,
+        state="closed",
+        head_ref="patch-1",
+        head_sha="abc123",
+        head_owner="someone",
+        head_repo="foo-feedstock",
+    )
+    assert gh.requester.queries == [
+        {"owner": "conda-forge", "name": "foo-feedstock", "number": 5}
+    ]
+    assert gh.rest_calls == 0
+
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        ctx.state = "open"
+
+
+def test_load_pr_context_rest_fallback(tmp_path):
+    gh = CountingGithub(str(tmp_path), FakeRequester(error=RuntimeError("no!")))
+    ctx = load_pr_context(gh, "conda-forge/foo-feedstock", 5)
+
+    assert ctx.state == "open"
+    assert ctx.head_ref == "main"
+    assert ctx.head_sha == "sha-5"
+    assert ctx.head_owner == "regro"
+    assert ctx.head_repo == "foo-feedstock"
+    assert gh.rest_calls == 1
+
+
+def test_load_pr_context_deleted_head_repo(tmp_path):
+    pr = dict(GRAPHQL_PR, headRepositoryOwner=None, headRepository=None)
+    gh = CountingGithub(str(tmp_path), FakeRequester(pr=pr))
+    ctx = load_pr_context(gh, "conda-forge/foo-feedstock", 5)
+    assert ctx.head_owner is None
+    assert ctx.head_repo is None
+
+
+def test_lazy_pull_request(tmp_path):
+    comments = []
+    fetches = []
+
+    def _get_repo(name):
+        fetches.append(name)
+        return FakeObject(
+            get_pull=lambda num: FakeObject(create_issue_comment=comments.append)
+        )
+
+    gh = FakeObject(get_repo=_get_repo)
+    pull = LazyPullRequest(gh, "conda-forge/foo-feedstock", 5)
+    assert fetches == []
+
+    pull.create_issue_comment("hi")
+    pull.create_issue_comment("there")
+    assert comments == ["hi", "there"]
+    assert fetches == ["conda-forge/foo-feedstock"]
@@ -0,0 +1,88 @@
+import multiprocessing
+import os
+import subprocess
+import time
+
+from webservices_dispatch_action import profiling
+from webservices_dispatch_action.profiling import profile, profiled_command
+
+
+def _busy_wait(seconds=0.1):
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        pass
+
+
+def _busy_main():
+    _busy_wait()
+
+
+def _forked_child():
+    with profile("child"):
+        _busy_wait()
+
+
+def test_profile_disabled(tmp_path, monkeypatch):
+    monkeypatch.delenv("CF_WEBSERVICES_PROFILE_DIR", raising=False)
+    with profile("dispatch"):
+        assert not profiling.is_enabled()
+        assert profiled_command("child", "os:getcwd", []) is None
+
+
+def test_profile_kept_with_children(tmp_path, monkeypatch):
+    profile_dir = str(tmp_path / "profiles")
+    monkeypatch.setenv("CF_WEBSERVICES_PROFILE_DIR", profile_dir)
+    monkeypatch.setenv("CF_WEBSERVICES_PROFILE_THRESHOLD", "0")
+    monkeypatch.setenv("CF_WEBSERVICES_PROFILE_INTERVAL", "0.001")
+
+    with profile("dispatch"):
+        assert profiling.is_enabled()
+        # nested blocks are part of the outer profile
+        with profile("nested"):
+            _busy_wait()
+
+        cmd = profiled_command(
+            "smithy",
+            "webservices_dispatch_action.tests.test_profiling:_busy_main",
+            ["--foo"],
+        )
+        subprocess.run(cmd, check=True)
+
+        proc = multiprocessing.get_context("fork").Process(target=_forked_child)
+        proc.start()
+        proc.join()
+        assert proc.exitcode == 0
+
+    assert not profiling.is_enabled()
+    assert profiling.PROFILE_SESSION_ENV_VAR not in os.environ
+
+    (dest,) = os.listdir(profile_dir)
+    assert dest.startswith("dispatch-")
+    fnames = sorted(os.listdir(os.path.join(profile_dir, dest)))
+    assert len(fnames) == 4
+    assert fnames[:3] == [
+        "all.collapsed",
+        "child-%d.collapsed" % proc.pid,
+        "dispatch-%d.collapsed" % os.getpid(),
+    ]
+    assert fnames[3].startswith("smithy-")
+
+    with open(os.path.join(profile_dir, dest, "all.collapsed")) as fp:
+        lines = fp.read().splitlines()
+    roots = {line.split(";", 1)[0].split(" (pid")[0] for line in lines}
+    assert roots == {"dispatch", "child", "smithy"}
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+    assert any("_busy_wait" in line and "smithy" in line for line in lines)
+
+
+def test_profile_dropped_under_threshold(tmp_path, monkeypatch):
+    profile_dir = str(tmp_path / "profiles")
+    monkeypatch.setenv("CF_WEBSERVICES_PROFILE_DIR", profile_dir)
+    monkeypatch.setenv("CF_WEBSERVICES_PROFILE_THRESHOLD", "3600")
+
+    with profile("dispatch"):
+        _busy_wait(0.01)
+
+    assert os.listdir(profile_dir) == []
@@ -0,0 +1,89 @@
+import json
+import os
+import subprocess
+import tarfile
+
+import pytest
+
+from webservices_dispatch_action import __main__ as dispatch_main
+from webservices_dispatch_action.api_sessions import clear_actor_token_cache
+from webservices_dispatch_action.github_http import reset_http_layer
+from webservices_dispatch_action.recording import Recorder
+from webservices_dispatch_action.replay import replay
+
+# the fake GitHub and its fixture
+from .test_fake_github import _run_main, fake_github  # noqa: F401
+
+
+def _head_sha(repo_pth, ref):
+    return subprocess.run(
+        ["git", "rev-parse", ref],
+        cwd=repo_pth,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+
+
+def test_record_and_replay(tmp_path, monkeypatch, fake_github):  # noqa: F811
+    record_path = str(tmp_path / "dispatch.tar.gz")
+    monkeypatch.setenv("CF_WEBSERVICES_RECORD", record_path)
+    old_sha = fake_github.head_sha("regro/foo-feedstock", "pr-branch")
+
+    _run_main(tmp_path, monkeypatch, "rerender", 1)
+
+    # the request headers, and so the tokens, are not recorded
+    with tarfile.open(record_path) as tf:
+        names = tf.getnames()
+        exchanges = tf.extractfile("exchanges.jsonl").read().decode("utf-8")
+    assert "git/regro/foo-feedstock.bundle" in names
+    assert exchanges
+    assert "token gha" not in exchanges
+    assert "token app" not in exchanges
+    assert "Authorization" not in exchanges
+
+    monkeypatch.delenv("CF_WEBSERVICES_RECORD")
+    clear_actor_token_cache()
+    reset_http_layer()
+    num_requests = len(fake_github.requests)
+
+    pushed = {}
+
+    def _handler():
+        dispatch_main.main()
+        repo_pth = os.path.join(
+            os.environ["GITHUB_SERVER_URL"][len("file://") :],
+            "regro/foo-feedstock.git",
+        )
+        pushed["sha"] = _head_sha(repo_pth, "pr-branch")
+
+    results = replay(record_path, handler=_handler)
+
+    assert results["error"] is None
+    assert results["misses"] == []
+    assert results["served"] > 0
+    # the replay started from the recorded head and pushed a new rerender
+    assert pushed["sha"] != old_sha
+    # and never talked to the fake GitHub
+    assert len(fake_github.requests) == num_requests
+    with tarfile.open(record_path) as tf:
+        manifest = json.load(tf.extractfile("manifest.json"))
+    assert manifest["repos"]["regro/foo-feedstock"]["head"] == old_sha
+
+
+def test_replay_refuses_network(tmp_path):
+    record_path = str(tmp_path / "dispatch.tar.gz")
+    recorder = Recorder(
+        record_path, "repository_dispatch", {"action": "version_update"}
+    )
+    recorder.save()
+    recorder.close()
+
+    calls = []
+    with pytest.raises(ValueError, match="would use the network"):
+        replay(record_path, handler=lambda: calls.append(1))
+    assert calls == []
+
+    results = replay(record_path, handler=lambda: calls.append(1), allow_network=True)
+    assert results["error"] is None
+    assert calls == [1]
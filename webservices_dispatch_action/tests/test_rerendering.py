@@ -0,0 +1,311 @@
+import json
+import os
+import subprocess
+import sys
+import types
+
+import pytest
+
+from webservices_dispatch_action import rerendering
+from webservices_dispatch_action.git_utils import clone_feedstock
+from webservices_dispatch_action.rerendering import (
+    ensure_output_validation_is_on,
+    get_rerender_engine,
+    get_rerender_inputs_hash,
+    record_successful_rerender,
+    rerender,
+    run_conda_smithy_rerender,
+)
+
+from .conftest import make_bare_repo_with_history
+
+FEEDSTOCK_FILES = {
+    "recipe/meta.yaml": "package:\n  name: foo\n  version: 1.0\n",
+    "conda-forge.yml": "conda_forge_output_validation: true\n",
+    ".github/workflows/build.yml": "name: build\n",
+    ".github/workflows/lint.yml": "name: lint\n",
+}
+
+
+@pytest.fixture
+def feedstock(tmp_path, git_env):
+    remote = "file://" + make_bare_repo_with_history(
+        str(tmp_path / "foo-feedstock.git"), 2, files=FEEDSTOCK_FILES
+    )
+    return clone_feedstock(remote, str(tmp_path / "foo-feedstock"), "main")
+
+
+@pytest.fixture
+def fake_smithy(monkeypatch):
+    """Replace conda-smithy with a function that commits a rendered file."""
+    calls = []
+
+    def _run(feedstock_dir):
+        calls.append(feedstock_dir)
+        os.makedirs(os.path.join(feedstock_dir, ".ci_support"), exist_ok=True)
+        with open(os.path.join(feedstock_dir, ".ci_support", "linux.yaml"), "a") as fp:
+            fp.write("rendered: %d\n" % len(calls))
+        subprocess.run(["git", "add", "."], cwd=feedstock_dir, check=True)
+        subprocess.run(
+            ["git", "commit", "-q", "-m", "MNT: Re-rendered"],
+            cwd=feedstock_dir,
+            check=True,
+        )
+        return 0
+
+    monkeypatch.setattr(rerendering, "run_conda_smithy_rerender", _run)
+    return calls
+
+
+@pytest.fixture(autouse=True)
+def pinning(monkeypatch):
+    """Set the latest version of conda-forge-pinning on the channel."""
+    versions = {"conda-forge-pinning": "2024.01.01.00.00.00"}
+    monkeypatch.setattr(rerendering, "get_latest_channel_version", versions.get)
+    return versions
+
+
+def _write(git_repo, pth, content):
+    with open(os.path.join(git_repo.working_dir, pth), "w") as fp:
+        fp.write(content)
+
+
+PINNING = "2024.01.01.00.00.00"
+
+
+def test_rerender_inputs_hash(feedstock):
+    orig = get_rerender_inputs_hash(feedstock, True, PINNING)
+    assert orig == get_rerender_inputs_hash(feedstock, True, PINNING)
+
+    # uncommitted changes to files that are not inputs do not matter
+    _write(feedstock, "README.md", "blah")
+    assert orig == get_rerender_inputs_hash(feedstock, True, PINNING)
+
+    _write(feedstock, "recipe/build.sh", "make")
+    new = get_rerender_inputs_hash(feedstock, True, PINNING)
+    assert new != orig
+
+    _write(feedstock, "conda-forge.yml", "{}")
+    newer = get_rerender_inputs_hash(feedstock, True, PINNING)
+    assert newer != new
+
+    os.makedirs(os.path.join(feedstock.working_dir, ".ci_support", "migrations"))
+    _write(feedstock, ".ci_support/migrations/foo.yaml", "migrator_ts: 1")
+    newest = get_rerender_inputs_hash(feedstock, True, PINNING)
+    assert newest != newer
+
+    # the workflows can only be rerendered with the right permissions
+    assert get_rerender_inputs_hash(feedstock, False, PINNING) != newest
+
+    assert get_rerender_inputs_hash(feedstock, True, "2099.01.01") != newest
+
+
+def test_rerender_inputs_hash_hand_edits(feedstock):
+    orig = get_rerender_inputs_hash(feedstock, True, PINNING)
+
+    _write(feedstock, ".github/workflows/build.yml", "name: hand edited\n")
+    _git(feedstock, "commit", "-q", "-am", "hand edit")
+    assert get_rerender_inputs_hash(feedstock, True, PINNING) != orig
+
+
+def test_rerender_cache(feedstock, fake_smithy, monkeypatch, tmp_path):
+    monkeypatch.setenv("CF_WEBSERVICES_RERENDER_CACHE_DIR", str(tmp_path / "cache"))
+
+    assert rerender(feedstock, True) == (True, False, None)
+    assert len(fake_smithy) == 1
+
+    # nothing is recorded until the rerender is pushed
+    assert rerender(feedstock, True) == (True, False, None)
+    assert len(fake_smithy) == 2
+
+    record_successful_rerender(feedstock, True)
+    assert rerender(feedstock, True) == (False, False, None)
+    assert len(fake_smithy) == 2
+
+    # a rerender without the permission to change the workflows is not one
+    # with it
+    assert rerender(feedstock, False) == (True, False, None)
+    assert len(fake_smithy) == 3
+    record_successful_rerender(feedstock, False)
+    assert rerender(feedstock, True) == (True, False, None)
+    assert len(fake_smithy) == 4
+    record_successful_rerender(feedstock, True)
+
+    # changing the recipe invalidates the cache
+    _write(feedstock, "recipe/meta.yaml", "package:\n  name: foo\n  version: 2.0\n")
+    assert rerender(feedstock, True) == (True, False, None)
+    assert len(fake_smithy) == 5
+
+
+def test_rerender_cache_new_pinning(
+    feedstock, fake_smithy, monkeypatch, tmp_path, pinning
+):
+    monkeypatch.setenv("CF_WEBSERVICES_RERENDER_CACHE_DIR", str(tmp_path / "cache"))
+
+    assert rerender(feedstock, True) == (True, False, None)
+    record_successful_rerender(feedstock, True)
+    assert rerender(feedstock, True) == (False, False, None)
+    assert len(fake_smithy) == 1
+
+    # smithy renders against the latest pinning, not the installed one
+    pinning["conda-forge-pinning"] = "2024.01.02.00.00.00"
+    assert rerender(feedstock, True) == (True, False, None)
+    assert len(fake_smithy) == 2
+
+
+def test_rerender_cache_unknown_pinning(
+    feedstock, fake_smithy, monkeypatch, tmp_path, pinning
+):
+    monkeypatch.setenv("CF_WEBSERVICES_RERENDER_CACHE_DIR", str(tmp_path / "cache"))
+
+    assert rerender(feedstock, True) == (True, False, None)
+    record_successful_rerender(feedstock, True)
+
+    # the rerender is never skipped if the pinning cannot be looked up
+    del pinning["conda-forge-pinning"]
+    assert rerender(feedstock, True) == (True, False, None)
+    assert len(fake_smithy) == 2
+
+
+def test_rerender_cache_output_validation(
+    feedstock, fake_smithy, monkeypatch, tmp_path
+):
+    monkeypatch.setenv("CF_WEBSERVICES_RERENDER_CACHE_DIR", str(tmp_path / "cache"))
+    _write(feedstock, "conda-forge.yml", "{}")
+    rerendering.get_rerender_cache().put(
+        feedstock, get_rerender_inputs_hash(feedstock, True, PINNING)
+    )
+
+    # turning on output validation changes the inputs so we always rerender
+    assert rerender(feedstock, True) == (True, False, None)
+    assert len(fake_smithy) == 1
+
+
+def test_rerender_no_cache(feedstock, fake_smithy):
+    record_successful_rerender(feedstock, True)
+    assert rerender(feedstock, True) == (True, False, None)
+    assert rerender(feedstock, True) == (True, False, None)
+    assert len(fake_smithy) == 2
+
+
+def _git(git_repo, *args):
+    return subprocess.run(
+        ["git"] + list(args),
+        cwd=git_repo.working_dir,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+
+def test_ensure_output_validation_is_on(feedstock):
+    _write(feedstock, "conda-forge.yml", "bot:\n  automerge: true\n")
+    assert ensure_output_validation_is_on(feedstock)
+    assert _git(feedstock, "diff", "--cached", "--name-only") == "conda-forge.yml\n"
+    assert _git(feedstock, "status", "--porcelain") == "M  conda-forge.yml\n"
+
+    _git(feedstock, "commit", "-q", "-m", "on")
+    assert not ensure_output_validation_is_on(feedstock)
+
+
+@pytest.mark.parametrize("can_change_workflows", [True, False])
+def test_rerender_workflow_changes(feedstock, monkeypatch, can_change_workflows):
+    def _run(feedstock_dir):
+        os.makedirs(os.path.join(feedstock_dir, ".ci_support"))
+        _write(feedstock, ".ci_support/linux.yaml", "rendered\n")
+        _write(feedstock, ".github/workflows/build.yml", "name: new build\n")
+        _write(feedstock, ".github/workflows/new.yml", "name: new\n")
+        os.remove(os.path.join(feedstock_dir, ".github/workflows/lint.yml"))
+        _git(feedstock, "add", "-A")
+        _git(feedstock, "commit", "-q", "-m", "MNT: Re-rendered")
+        return 0
+
+    monkeypatch.setattr(rerendering, "run_conda_smithy_rerender", _run)
+    cloned = feedstock.head.commit
+
+    changed, rerender_error, info_message = rerender(feedstock, can_change_workflows)
+
+    assert changed and not rerender_error
+    head = feedstock.head.commit
+    assert head.parents == (cloned,)
+    assert head.message == "MNT: Re-rendered\n"
+    assert (head.tree / ".ci_support/linux.yaml").data_stream.read() == b"rendered\n"
+    workflows = _git(feedstock, "ls-tree", "-r", "HEAD", ".github/workflows")
+    if can_change_workflows:
+        assert info_message is None
+        assert "new.yml" in workflows
+    else:
+        assert "workflow" in info_message
+        assert workflows == _git(
+            feedstock, "ls-tree", "-r", "HEAD~1", ".github/workflows"
+        )
+        # the working tree and index match the amended commit
+        assert _git(feedstock, "status", "--porcelain") == ""
+
+
+def test_rerender_no_workflow_changes(feedstock, fake_smithy):
+    assert rerender(feedstock, False) == (True, False, None)
+    # there was nothing to undo so the rerender commit is left as is
+    assert feedstock.head.commit.message == "MNT: Re-rendered\n"
+    assert _git(feedstock, "status", "--porcelain") == ""
+
+
+@pytest.fixture
+def fake_smithy_cli(monkeypatch):
+    """Install a stand-in for `conda_smithy.cli` that writes how it was called
+    to `smithy-call.json` in its working directory."""
+    cli = types.ModuleType("conda_smithy.cli")
+
+    def _main():
+        with open("smithy-call.json", "w") as fp:
+            json.dump({"argv": sys.argv, "cwd": os.getcwd()}, fp)
+        print("rendering!", flush=True)
+        # output of smithy's own subprocesses is not lost either
+        subprocess.run(["echo", "from a subprocess"], check=True)
+        behavior = os.environ.get("FAKE_SMITHY_BEHAVIOR", "ok")
+        if behavior == "exit":
+            sys.exit(2)
+        elif behavior == "raise":
+            raise RuntimeError("smithy failed!")
+
+    cli.main = _main
+    pkg = types.ModuleType("conda_smithy")
+    pkg.cli = cli
+    monkeypatch.setitem(sys.modules, "conda_smithy", pkg)
+    monkeypatch.setitem(sys.modules, "conda_smithy.cli", cli)
+    monkeypatch.setenv("CF_WEBSERVICES_RERENDER_ENGINE", "fork")
+
+
+@pytest.mark.parametrize(
+    "behavior,ret", [("ok", 0), ("exit", 2), ("raise", 1)], ids=str
+)
+def test_run_conda_smithy_rerender_fork(
+    tmp_path, fake_smithy_cli, monkeypatch, capfd, behavior, ret
+):
+    monkeypatch.setenv("FAKE_SMITHY_BEHAVIOR", behavior)
+    cwd = os.getcwd()
+    argv = list(sys.argv)
+
+    assert run_conda_smithy_rerender(str(tmp_path)) == ret
+
+    with open(tmp_path / "smithy-call.json") as fp:
+        assert json.load(fp) == {
+            "argv": ["conda-smithy", "rerender", "-c", "auto", "--no-check-uptodate"],
+            "cwd": str(tmp_path),
+        }
+    out = capfd.readouterr().out
+    assert "rendering!" in out
+    assert "from a subprocess" in out
+    # the child changed its own working dir and argv, not ours
+    assert os.getcwd() == cwd
+    assert sys.argv == argv
+
+
+def test_get_rerender_engine(monkeypatch):
+    monkeypatch.delenv("CF_WEBSERVICES_RERENDER_ENGINE", raising=False)
+    assert get_rerender_engine() == "subprocess"
+    monkeypatch.setenv("CF_WEBSERVICES_RERENDER_ENGINE", "fork")
+    assert get_rerender_engine() == "fork"
+    monkeypatch.setenv("CF_WEBSERVICES_RERENDER_ENGINE", "blah")
+    with pytest.raises(ValueError):
+        get_rerender_engine()
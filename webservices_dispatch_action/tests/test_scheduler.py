@@ -0,0 +1,293 @@
+import functools
+import json
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+
+from webservices_dispatch_action.git_utils import clone_feedstock
+from webservices_dispatch_action.scheduler import (
+    DispatchScheduler,
+    get_event_key,
+    get_pr_head_sha,
+)
+
+from .conftest import make_bare_repo_with_history
+
+
+class FakeObject:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeGithub:
+    """A stand-in for `github.Github` serving PRs whose heads are local repos."""
+
+    def __init__(self, remote_dir):
+        self.remote_dir = remote_dir
+
+    def get_repo(self, repo_name):
+        return FakeObject(
+            get_pull=lambda num: FakeObject(
+                state="open",
+                head=FakeObject(
+                    ref="main",
+                    sha="sha-%d" % num,
+                    repo=FakeObject(
+                        owner=FakeObject(login="regro"),
+                        name=repo_name.split("/")[1],
+                    ),
+                ),
+            )
+        )
+
+
+def _clone_and_log(gh, event_name, event_data):
+    pr = gh.get_repo(event_data["repository"]["full_name"]).get_pull(
+        event_data["client_payload"]["pr"]
+    )
+    repo_url = "file://" + os.path.join(gh.remote_dir, pr.head.repo.name + ".git")
+
+    def _log(what):
+        with open(event_data["client_payload"]["log"], "a") as fp:
+            fp.write(
+                json.dumps(
+                    {
+                        "what": what,
+                        "id": event_data["client_payload"]["id"],
+                        "key": list(get_event_key(event_data)),
+                        "time": time.time(),
+                    }
+                )
+                + "\n"
+            )
+
+    _log("start")
+    if event_data["client_payload"].get("kill", False):
+        # like a pool process killed for using too much memory
+        os.kill(os.getpid(), signal.SIGKILL)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        git_repo = clone_feedstock(
+            repo_url, os.path.join(tmpdir, pr.head.repo.name), pr.head.ref
+        )
+        assert git_repo.active_branch.name == "main"
+        time.sleep(event_data["client_payload"]["sleep"])
+    _log("end")
+
+    if event_data["client_payload"].get("fail", False):
+        raise RuntimeError("failed!")
+
+
+def _event(
+    repo,
+    pr,
+    idnum,
+    log,
+    sleep=0.5,
+    fail=False,
+    action="rerender",
+    sha=None,
+    input_version=None,
+):
+    return {
+        "action": action,
+        "repository": {"full_name": "conda-forge/%s" % repo},
+        "client_payload": {
+            "pr": pr,
+            "id": idnum,
+            "log": log,
+            "sleep": sleep,
+            "fail": fail,
+            "sha": sha,
+            "input_version": input_version,
+        },
+    }
+
+
+def _read_log(log):
+    with open(log) as fp:
+        return [json.loads(line) for line in fp]
+
+
+def _make_scheduler(tmp_path, max_workers, done, resolve_head_sha=None):
+    remote_dir = str(tmp_path / "remotes")
+    os.makedirs(remote_dir)
+    for repo in ["foo-feedstock", "bar-feedstock"]:
+        make_bare_repo_with_history(os.path.join(remote_dir, repo + ".git"), 3)
+
+    return DispatchScheduler(
+        max_workers,
+        _clone_and_log,
+        make_gh=functools.partial(FakeGithub, remote_dir),
+        on_done=lambda tag, ok: done.append((tag, ok)),
+        mp_context=multiprocessing.get_context("fork"),
+        resolve_head_sha=resolve_head_sha,
+    )
+
+
+def test_get_event_key():
+    assert get_event_key(_event("foo-feedstock", "12", 1, "")) == (
+        "conda-forge/foo-feedstock",
+        12,
+    )
+    assert get_event_key({"action": "blah"}) is None
+
+
+def test_get_pr_head_sha():
+    assert (
+        get_pr_head_sha(FakeGithub(""), _event("foo-feedstock", "12", 1, ""))
+        == "sha-12"
+    )
+
+
+def test_scheduler_serializes_per_pr(tmp_path):
+    log = str(tmp_path / "log.jsonl")
+    done = []
+    with _make_scheduler(tmp_path, 4, done) as scheduler:
+        scheduler.submit("repository_dispatch", _event("foo-feedstock", 1, 1, log))
+        scheduler.submit("repository_dispatch", _event("bar-feedstock", 1, 2, log))
+        scheduler.submit(
+            "repository_dispatch", _event("bar-feedstock", 2, 3, log, fail=True)
+        )
+        # waits for job 1 since it is for the same PR
+        scheduler.submit("repository_dispatch", _event("foo-feedstock", 1, 4, log))
+        assert scheduler.queue_depth == 1
+
+    assert sorted(done) == [(None, False)] + [(None, True)] * 3
+    assert (scheduler.num_ok, scheduler.num_failed) == (3, 1)
+
+    records = _read_log(log)
+    spans = {}
+    for rec in records:
+        spans.setdefault(rec["id"], {})[rec["what"]] = rec["time"]
+
+    # jobs for the same PR never overlap
+    assert spans[4]["start"] >= spans[1]["end"]
+    # jobs for different PRs do
+    assert spans[2]["start"] < spans[1]["end"]
+    assert spans[3]["start"] < spans[1]["end"]
+
+
+def test_scheduler_coalesces_queued_jobs(tmp_path):
+    log = str(tmp_path / "log.jsonl")
+    done = []
+    with _make_scheduler(tmp_path, 2, done) as scheduler:
+        for idnum, action, status in [
+            (1, "rerender", "queued"),
+            (2, "rerender", "queued"),
+            (3, "version_update", "queued"),
+            (4, "rerender", "superseded"),
+        ]:
+            assert (
+                scheduler.submit(
+                    "repository_dispatch",
+                    _event("foo-feedstock", 1, idnum, log, action=action),
+                    tag=idnum,
+                )
+                == status
+            )
+        assert scheduler.queue_depth == 2
+
+    assert scheduler.num_superseded == 1
+    assert sorted(done) == [(1, True), (2, True), (3, True), (4, True)]
+    ran = [rec["id"] for rec in _read_log(log) if rec["what"] == "start"]
+    assert ran == [1, 4, 3]
+
+
+def test_scheduler_drops_duplicates(tmp_path):
+    log = str(tmp_path / "log.jsonl")
+    done = []
+    with _make_scheduler(
+        tmp_path,
+        2,
+        done,
+        resolve_head_sha=lambda event_data: event_data["client_payload"]["sha"],
+    ) as scheduler:
+        for idnum, sha, status in [
+            (1, "a", "queued"),
+            # same commit as the running job
+            (2, "a", "duplicate"),
+            (3, "b", "queued"),
+            # same commit as the queued job
+            (4, "b", "duplicate"),
+            # unknown commit so it cannot be a duplicate
+            (5, None, "superseded"),
+        ]:
+            assert (
+                scheduler.submit(
+                    "repository_dispatch",
+                    _event("foo-feedstock", 1, idnum, log, sha=sha),
+                    tag=idnum,
+                )
+                == status
+            )
+
+    assert scheduler.num_duplicates == 2
+    assert sorted(done) == [(i, True) for i in range(1, 6)]
+    ran = [rec["id"] for rec in _read_log(log) if rec["what"] == "start"]
+    assert ran == [1, 5]
+
+
+def test_scheduler_keeps_events_with_other_inputs(tmp_path):
+    log = str(tmp_path / "log.jsonl")
+    done = []
+    with _make_scheduler(
+        tmp_path,
+        2,
+        done,
+        resolve_head_sha=lambda event_data: event_data["client_payload"]["sha"],
+    ) as scheduler:
+        for idnum, input_version, status in [
+            (1, "1.0", "queued"),
+            # same commit as the running job but another version
+            (2, "2.0", "queued"),
+            (3, "2.0", "duplicate"),
+            # the newer version supersedes the queued one
+            (4, "3.0", "superseded"),
+        ]:
+            assert (
+                scheduler.submit(
+                    "repository_dispatch",
+                    _event(
+                        "foo-feedstock",
+                        1,
+                        idnum,
+                        log,
+                        action="version_update",
+                        sha="a",
+                        input_version=input_version,
+                    ),
+                    tag=idnum,
+                )
+                == status
+            )
+
+    assert scheduler.num_duplicates == 1
+    assert scheduler.num_superseded == 1
+    ran = [rec["id"] for rec in _read_log(log) if rec["what"] == "start"]
+    assert ran == [1, 4]
+
+
+def test_scheduler_survives_dead_pool_process(tmp_path):
+    log = str(tmp_path / "log.jsonl")
+    done = []
+    with _make_scheduler(tmp_path, 1, done) as scheduler:
+        killed = _event("foo-feedstock", 1, 1, log)
+        killed["client_payload"]["kill"] = True
+        scheduler.submit("repository_dispatch", killed, tag=1)
+        # waits for the first job since there is only one worker
+        scheduler.submit(
+            "repository_dispatch", _event("bar-feedstock", 1, 2, log), tag=2
+        )
+        assert scheduler.wait(timeout=30)
+        assert sorted(done) == [(1, False), (2, False)]
+
+        # later jobs run in a new pool
+        scheduler.submit(
+            "repository_dispatch", _event("bar-feedstock", 1, 3, log), tag=3
+        )
+        assert scheduler.wait(timeout=30)
+
+    assert sorted(done) == [(1, False), (2, False), (3, True)]
+    assert (scheduler.num_ok, scheduler.num_failed) == (1, 2)
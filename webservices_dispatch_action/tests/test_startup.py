@@ -0,0 +1,71 @@
+import json
+import subprocess
+import sys
+
+# modules that must not be imported before an event is known to be valid
+HEAVY_MODULES = [
+    "git",
+    "github",
+    "requests",
+    "yaml",
+    "conda",
+    "conda_forge_tick",
+    "conda_smithy",
+]
+
+# generous, an import of the CLI takes ~20 ms
+MAX_IMPORT_TIME_US = 250_000
+
+
+def _run_with_importtime(code, **kwargs):
+    ret = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        **kwargs,
+    )
+    times = {}
+    for line in ret.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return ret, times
+
+
+def _heavy_imports(times):
+    return sorted(
+        name
+        for name in times
+        if any(name == mod or name.startswith(mod + ".") for mod in HEAVY_MODULES)
+    )
+
+
+def test_import_time():
+    ret, times = _run_with_importtime("import webservices_dispatch_action.__main__")
+    assert ret.returncode == 0, ret.stderr
+    assert _heavy_imports(times) == []
+    assert times["webservices_dispatch_action.__main__"] < MAX_IMPORT_TIME_US
+
+
+def test_rejected_event_is_fast(tmp_path, monkeypatch):
+    event_path = tmp_path / "event.json"
+    event_path.write_text(
+        json.dumps(
+            {
+                "action": "blah",
+                "repository": {"full_name": "conda-forge/foo-feedstock"},
+                "client_payload": {"pr": 1},
+            }
+        )
+    )
+    monkeypatch.setenv("GITHUB_EVENT_PATH", str(event_path))
+    monkeypatch.setenv("GITHUB_EVENT_NAME", "repository_dispatch")
+
+    ret, times = _run_with_importtime(
+        "from webservices_dispatch_action.__main__ import main; main()"
+    )
+    assert ret.returncode != 0
+    assert "Dispatch action blah cannot be processed!" in ret.stderr
+    assert _heavy_imports(times) == []
@@ -0,0 +1,173 @@
+import multiprocessing
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from webservices_dispatch_action.upstream import prefetch_version_sources
+from webservices_dispatch_action.version_cache import VersionCache
+
+
+class StubSource:
+    """A version source that takes `delay` seconds to answer."""
+
+    def __init__(self, name, version, delay=0.0, error=None):
+        self.name = name
+        self.version = version
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.finished = threading.Event()
+
+    def get_url(self, meta_yaml):
+        self.calls += 1
+        return "https://example.com/%s/%s" % (self.name, meta_yaml["name"])
+
+    def get_version(self, url):
+        time.sleep(self.delay)
+        self.finished.set()
+        if self.error is not None:
+            raise self.error
+        return self.version
+
+
+def _get_latest_version(attrs, sources):
+    # the sequential search done by conda_forge_tick's get_latest_version
+    for source in sources:
+        url = source.get_url(attrs)
+        if url is None:
+            continue
+        ver = source.get_version(url)
+        if ver:
+            return ver
+    return False
+
+
+def test_prefetch_version_sources_priority():
+    attrs = {"name": "foo"}
+    sources = [
+        StubSource("Missing", None, delay=0.1),
+        StubSource("Medium", "2.0", delay=0.1),
+        StubSource("Fast", "3.0"),
+    ]
+
+    wrapped = prefetch_version_sources(attrs, sources, timeout=10)
+    # the lower priority sources are only probed if the higher ones have no
+    # version, and one at a time
+    assert [s.calls for s in sources] == [1, 1, 0]
+    assert sources[0].finished.is_set()
+    assert _get_latest_version(attrs, wrapped) == "2.0"
+    assert [s.calls for s in sources] == [1, 1, 0]
+
+
+def test_prefetch_version_sources_sequential():
+    attrs = {"name": "foo"}
+    running = []
+    overlaps = []
+
+    class TrackingSource(StubSource):
+        def get_version(self, url):
+            running.append(self.name)
+            overlaps.append(len(running))
+            try:
+                return super().get_version(url)
+            finally:
+                running.remove(self.name)
+
+    sources = [TrackingSource("S%d" % i, None, delay=0.05) for i in range(4)]
+    prefetch_version_sources(attrs, sources, timeout=10)
+    assert [s.calls for s in sources] == [1, 1, 1, 1]
+    assert overlaps == [1, 1, 1, 1]
+
+
+def test_prefetch_version_sources_timeout():
+    attrs = {"name": "foo"}
+    slow = StubSource("Slow", "9.0", delay=1)
+    sources = [slow, StubSource("Fast", "3.0")]
+
+    t0 = time.monotonic()
+    wrapped = prefetch_version_sources(attrs, sources, timeout=0.1)
+    assert time.monotonic() - t0 < 0.5
+    assert _get_latest_version(attrs, wrapped) == "3.0"
+    # the late answer of the timed out source is ignored
+    assert slow.finished.wait(2)
+    assert wrapped[0].url is None
+    assert wrapped[0].version is None
+    assert _get_latest_version(attrs, wrapped) == "3.0"
+
+
+def _prefetch_with_slow_source():
+    sources = [StubSource("Slow", "2.0", delay=5), StubSource("Fast", "1.0")]
+    wrapped = prefetch_version_sources({"name": "foo"}, sources, timeout=0.1)
+    assert wrapped[1].version == "1.0"
+    assert [s.calls for s in sources] == [1, 1]
+
+
+def test_prefetch_version_sources_exit():
+    # the processes exit without waiting on the probe that timed out
+    t0 = time.monotonic()
+    proc = multiprocessing.get_context("fork").Process(
+        target=_prefetch_with_slow_source
+    )
+    proc.start()
+    proc.join()
+    assert proc.exitcode == 0
+    assert time.monotonic() - t0 < 2
+
+    t0 = time.monotonic()
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from webservices_dispatch_action.tests.test_upstream import "
+            "_prefetch_with_slow_source; _prefetch_with_slow_source()",
+        ],
+        check=True,
+    )
+    assert time.monotonic() - t0 < 3
+
+
+def test_prefetch_version_sources_error():
+    attrs = {"name": "foo"}
+    sources = [
+        StubSource("Broken", None, error=RuntimeError("no network!")),
+        StubSource("Fast", "3.0"),
+    ]
+
+    wrapped = prefetch_version_sources(attrs, sources, timeout=10)
+    with pytest.raises(RuntimeError, match="no network!"):
+        _get_latest_version(attrs, wrapped)
+
+
+def test_prefetch_version_sources_configured():
+    attrs = {
+        "name": "foo",
+        "conda-forge.yml": {"bot": {"version_updates": {"sources": ["fast"]}}},
+    }
+    sources = [StubSource("Slow", "1.0", delay=0.2), StubSource("Fast", "3.0")]
+
+    wrapped = prefetch_version_sources(attrs, sources, timeout=10)
+    assert [w.name for w in wrapped] == ["Slow", "Fast"]
+    assert [s.calls for s in sources] == [0, 1]
+    assert _get_latest_version(attrs, wrapped[1:]) == "3.0"
+    assert sources[1].calls == 1
+
+
+def test_prefetch_version_sources_cache(tmp_path):
+    attrs = {"name": "foo"}
+    cache = VersionCache(str(tmp_path / "versions.db"))
+    sources = [StubSource("Missing", None), StubSource("Slow", "2.0", delay=0.5)]
+
+    wrapped = prefetch_version_sources(
+        attrs, sources, timeout=10, feedstock_name="foo", cache=cache
+    )
+    assert _get_latest_version(attrs, wrapped) == "2.0"
+
+    t0 = time.monotonic()
+    wrapped = prefetch_version_sources(
+        attrs, sources, timeout=10, feedstock_name="foo", cache=cache
+    )
+    assert _get_latest_version(attrs, wrapped) == "2.0"
+    assert time.monotonic() - t0 < 0.4
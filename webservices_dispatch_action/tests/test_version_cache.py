@@ -0,0 +1,60 @@
+import pytest
+
+from webservices_dispatch_action import version_cache
+from webservices_dispatch_action.version_cache import VersionCache, get_version_cache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(version_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_version_cache(tmp_path, clock):
+    cache = VersionCache(str(tmp_path / "cache" / "versions.db"), ttl=10)
+    assert cache.get("foo", "PyPI", "https://pypi.org/foo") is None
+
+    cache.put("foo", "PyPI", "https://pypi.org/foo", "1.2.3")
+    assert cache.get("foo", "PyPI", "https://pypi.org/foo") == "1.2.3"
+    assert cache.get("foo", "Github", "https://pypi.org/foo") is None
+    assert cache.get("bar", "PyPI", "https://pypi.org/foo") is None
+
+    # entries are shared with other instances
+    other = VersionCache(str(tmp_path / "cache" / "versions.db"))
+    assert other.get("foo", "PyPI", "https://pypi.org/foo") == "1.2.3"
+
+    clock[0] += 11
+    assert cache.get("foo", "PyPI", "https://pypi.org/foo") is None
+
+
+def test_version_cache_negative(tmp_path, clock):
+    cache = VersionCache(str(tmp_path / "versions.db"), ttl=10, negative_ttl=100)
+    calls = []
+
+    def _get_version(url):
+        calls.append(url)
+        return False
+
+    assert cache.get_version("foo", "NPM", "npm/foo", _get_version) is False
+    assert cache.get_version("foo", "NPM", "npm/foo", _get_version) is False
+    assert calls == ["npm/foo"]
+
+    clock[0] += 50
+    assert cache.get_version("foo", "NPM", "npm/foo", _get_version) is False
+    assert len(calls) == 1
+
+    clock[0] += 51
+    assert cache.get_version("foo", "NPM", "npm/foo", _get_version) is False
+    assert len(calls) == 2
+
+
+def test_get_version_cache(tmp_path, monkeypatch):
+    monkeypatch.delenv("CF_WEBSERVICES_VERSION_CACHE", raising=False)
+    assert get_version_cache() is None
+
+    monkeypatch.setenv("CF_WEBSERVICES_VERSION_CACHE", str(tmp_path / "v.db"))
+    monkeypatch.setenv("CF_WEBSERVICES_VERSION_CACHE_TTL", "60")
+    cache = get_version_cache()
+    assert cache.path == str(tmp_path / "v.db")
+    assert cache.ttl == 60
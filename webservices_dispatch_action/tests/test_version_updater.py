@@ -0,0 +1,147 @@
+import os
+import subprocess
+
+import pytest
+
+from webservices_dispatch_action import version_updater
+from webservices_dispatch_action.git_utils import clone_feedstock
+
+from .conftest import make_bare_repo_with_history
+
+
+@pytest.fixture
+def feedstock(tmp_path, git_env):
+    remote = "file://" + make_bare_repo_with_history(
+        str(tmp_path / "foo-feedstock.git"),
+        2,
+        files={"recipe/meta.yaml": "package:\n  name: foo\n  version: 1.0\n"},
+    )
+    return clone_feedstock(remote, str(tmp_path / "foo-feedstock"), "main")
+
+
+@pytest.fixture
+def fake_update_version(monkeypatch):
+    def _update_version(git_repo, repo_name, input_version=None):
+        if input_version == "bad":
+            raise RuntimeError("bad version!")
+        subprocess.run(
+            ["git", "commit", "-q", "--allow-empty", "-m", "ENH %s" % input_version],
+            cwd=git_repo.working_dir,
+            check=True,
+        )
+        return True, False
+
+    monkeypatch.setattr(version_updater, "update_version", _update_version)
+
+
+@pytest.mark.parametrize("isolation", ["fork", "inprocess"])
+def test_run_update_version(feedstock, fake_update_version, isolation):
+    curr_head = feedstock.active_branch.commit
+    assert not version_updater.run_update_version(
+        feedstock,
+        "conda-forge/foo-feedstock",
+        input_version="2.0 && rm -rf /",
+        isolation=isolation,
+    )
+    assert feedstock.active_branch.commit != curr_head
+    assert feedstock.active_branch.commit.message.strip() == "ENH 2.0 && rm -rf /"
+
+    assert version_updater.run_update_version(
+        feedstock,
+        "conda-forge/foo-feedstock",
+        input_version="bad",
+        isolation=isolation,
+    )
+
+
+def test_run_update_version_subprocess(feedstock, monkeypatch):
+    cmds = []
+
+    def _run(cmd, **kwargs):
+        cmds.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0)
+
+    monkeypatch.setattr(version_updater.subprocess, "run", _run)
+    assert not version_updater.run_update_version(
+        feedstock,
+        "conda-forge/foo-feedstock",
+        input_version="2.0 beta",
+        isolation="subprocess",
+    )
+    assert cmds == [
+        [
+            "run-webservices-dispatch-action-version-updater",
+            "--feedstock-dir",
+            feedstock.working_dir,
+            "--repo-name",
+            "conda-forge/foo-feedstock",
+            "--input-version",
+            "2.0 beta",
+        ]
+    ]
+
+
+def test_get_version_updater_isolation(monkeypatch):
+    monkeypatch.delenv("CF_WEBSERVICES_VERSION_UPDATER_ISOLATION", raising=False)
+    assert version_updater.get_version_updater_isolation() == "fork"
+    monkeypatch.setenv("CF_WEBSERVICES_VERSION_UPDATER_ISOLATION", "blah")
+    with pytest.raises(ValueError):
+        version_updater.get_version_updater_isolation()
+
+
+def test_load_feedstock_attrs(feedstock, monkeypatch):
+    calls = []
+
+    def _load_feedstock(name, sub_graph, meta_yaml=None, conda_forge_yaml=None):
+        calls.append((name, meta_yaml, conda_forge_yaml))
+        return {"raw_meta_yaml": meta_yaml, "conda-forge.yml": {}}
+
+    monkeypatch.setattr(version_updater, "load_feedstock", _load_feedstock)
+
+    attrs = version_updater.load_feedstock_attrs(feedstock, "foo")
+    assert attrs["raw_meta_yaml"] == "package:\n  name: foo\n  version: 1.0\n"
+    # the feedstock has no conda-forge.yml, which must not be fetched
+    assert calls == [("foo", attrs["raw_meta_yaml"], "{}")]
+
+    with open(os.path.join(feedstock.working_dir, "conda-forge.yml"), "w") as fp:
+        fp.write("bot: {}\n")
+    version_updater.load_feedstock_attrs(feedstock, "foo")
+    assert calls[1][2] == "bot: {}\n"
+
+
+def test_update_version_commits(feedstock, monkeypatch):
+    pytest.importorskip("conda")
+    pytest.importorskip("conda_forge_tick")
+    import conda_forge_tick.update_recipe
+
+    monkeypatch.setattr(
+        version_updater,
+        "load_feedstock_attrs",
+        lambda git_repo, name: {
+            "raw_meta_yaml": "package:\n  name: foo\n  version: 1.0\n",
+            "version": "1.0",
+        },
+    )
+    monkeypatch.setattr(
+        conda_forge_tick.update_recipe,
+        "update_version",
+        lambda raw, version: (raw.replace("1.0", version), []),
+    )
+    monkeypatch.setattr(
+        conda_forge_tick.update_recipe,
+        "update_build_number",
+        lambda raw, number: raw,
+    )
+    curr_head = feedstock.head.commit
+
+    assert version_updater.update_version(
+        feedstock, "conda-forge/foo-feedstock", input_version="2.0'; ls"
+    ) == (True, False)
+
+    head = feedstock.head.commit
+    assert head.parents == (curr_head,)
+    assert head.message == "ENH updated version to 2.0'; ls\n"
+    assert (head.tree / "recipe/meta.yaml").data_stream.read() == (
+        b"package:\n  name: foo\n  version: 2.0'; ls\n"
+    )
+    assert not feedstock.is_dirty()
@@ -0,0 +1,106 @@
+import io
+import json
+import os
+
+import pytest
+
+from webservices_dispatch_action.__main__ import handle_event
+from webservices_dispatch_action.worker import (
+    DirectoryEventQueue,
+    StreamEventQueue,
+    run_worker,
+)
+
+
+def _event(pr, action="rerender"):
+    return {
+        "action": action,
+        "client_payload": {"pr": pr},
+        "repository": {"full_name": "conda-forge/foo-feedstock"},
+    }
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, gh, event_name, event_data):
+        self.calls.append((gh, event_name, event_data))
+        if event_data["client_payload"]["pr"] < 0:
+            raise RuntimeError("bad PR!")
+
+
+def test_run_worker_directory(tmp_path):
+    for i, pr in enumerate([1, -2, 3]):
+        pth = tmp_path / ("event-%d.json" % i)
+        pth.write_text(json.dumps(_event(pr)))
+        os.utime(pth, (i, i))
+    (tmp_path / "broken.json").write_text("{")
+    os.utime(tmp_path / "broken.json", (10, 10))
+
+    gh = object()
+    handler = RecordingHandler()
+    queue = DirectoryEventQueue(str(tmp_path))
+    assert len(queue) == 4
+
+    num_ok, num_failed = run_worker(queue, gh, exit_when_empty=True, handler=handler)
+
+    assert (num_ok, num_failed) == (2, 1)
+    assert [c[2]["client_payload"]["pr"] for c in handler.calls] == [1, -2, 3]
+    assert all(c[0] is gh for c in handler.calls)
+    assert sorted(os.listdir(tmp_path / "done")) == ["event-0.json", "event-2.json"]
+    assert sorted(os.listdir(tmp_path / "failed")) == ["broken.json", "event-1.json"]
+    assert os.listdir(tmp_path / "processing") == []
+    assert len(queue) == 0
+
+
+def test_run_worker_stream():
+    stream = io.StringIO(
+        "\n".join([json.dumps(_event(1)), "", "not json", json.dumps(_event(2, "foo"))])
+        + "\n"
+    )
+    handler = RecordingHandler()
+
+    num_ok, num_failed = run_worker(
+        StreamEventQueue(stream), None, event_name="blah", handler=handler
+    )
+
+    assert (num_ok, num_failed) == (2, 0)
+    assert [c[1] for c in handler.calls] == ["blah", "blah"]
+
+
+def test_handle_event_rejects_unknown_events():
+    with pytest.raises(ValueError, match="GitHub event"):
+        handle_event(None, "push", _event(1))
+
+    with pytest.raises(ValueError, match="Dispatch action"):
+        handle_event(None, "repository_dispatch", _event(1, action="blah"))
+
+
+def _fail_on_negative_pr(gh, event_name, event_data):
+    if event_data["client_payload"]["pr"] < 0:
+        raise RuntimeError("bad PR!")
+
+
+def test_run_worker_directory_jobs(tmp_path):
+    for i, pr in enumerate([1, -2, 3, 1]):
+        pth = tmp_path / ("event-%d.json" % i)
+        pth.write_text(json.dumps(_event(pr)))
+        os.utime(pth, (i, i))
+
+    num_ok, num_failed = run_worker(
+        DirectoryEventQueue(str(tmp_path)),
+        None,
+        exit_when_empty=True,
+        handler=_fail_on_negative_pr,
+        jobs=2,
+        make_gh=dict,
+    )
+
+    assert (num_ok, num_failed) == (3, 1)
+    assert sorted(os.listdir(tmp_path / "done")) == [
+        "event-0.json",
+        "event-2.json",
+        "event-3.json",
+    ]
+    assert sorted(os.listdir(tmp_path / "failed")) == ["event-1.json"]
@@ -0,0 +1,269 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# passes the trace of a dispatch on to the processes it starts
+TRACE_PARENT_ENV_VAR = "CF_WEBSERVICES_TRACE_PARENT"
+
+_CURRENT_SPAN = contextvars.ContextVar("current_span", default=None)
+
+_LISTENERS = []
+
+
+def get_trace_file():
+    """Get the path of the JSON lines file spans are written to, if any."""
+    return os.environ.get("CF_WEBSERVICES_TRACE_FILE", "") or None
+
+
+def get_step_summary_file():
+    """Get the path of the GitHub Actions step summary, if timings should be
+    written to it."""
+    if os.environ.get("CF_WEBSERVICES_TRACE_STEP_SUMMARY", "").lower() not in [
+        "1",
+        "true",
+        "yes",
+    ]:
+        return None
+    return os.environ.get("GITHUB_STEP_SUMMARY", "") or None
+
+
+def _new_id():
+    return os.urandom(8).hex()
+
+
+class Span:
+    """A timed phase of a dispatch.
+
+    Attributes
+    ----------
+    name : str
+        The name of the phase (e.g., `clone`).
+    trace_id : str
+        The id shared by all of the spans of a dispatch.
+    span_id : str
+        The id of this span.
+    parent_id : str or None
+        The id of the enclosing span, if any.
+    attributes : dict
+        Facts about the phase (e.g., the repo, the PR, or the bytes fetched).
+    start : float
+        The time the span started, in seconds since the epoch.
+    duration : float or None
+        The duration of the span in seconds, once it has ended.
+    status : str
+        Either `ok` or `error`.
+    error : str or None
+        The type of the exception that ended the span, if any. The message is
+        left out since it may hold secrets (e.g., a push URL with a token).
+    """
+
+    def __init__(self, name, parent=None, remote_parent=None, attributes=None):
+        self.name = name
+        self.span_id = _new_id()
+        if parent is not None:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.depth = parent.depth + 1
+            self.trace_spans = parent.trace_spans
+        else:
+            if remote_parent is not None:
+                self.trace_id, self.parent_id = remote_parent
+            else:
+                self.trace_id, self.parent_id = _new_id(), None
+            self.depth = 0
+            self.trace_spans = []
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.duration = None
+        self.status = "ok"
+        self.error = None
+
+    @property
+    def is_local_root(self):
+        """True if the span has no enclosing span in this process."""
+        return self.depth == 0
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self):
+        self.duration = time.perf_counter() - self._t0
+        self.trace_spans.append(self)
+
+    def as_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+            "pid": os.getpid(),
+        }
+
+
+def _get_remote_parent():
+    value = os.environ.get(TRACE_PARENT_ENV_VAR, "")
+    if value.count(":") != 1:
+        return None
+    return tuple(value.split(":"))
+
+
+def add_span_listener(listener):
+    """Call `listener(span)` every time a span ends."""
+    _LISTENERS.append(listener)
+
+
+def remove_span_listener(listener):
+    _LISTENERS.remove(listener)
+
+
+def is_enabled():
+    """True if finished spans go anywhere. Use this to skip computing
+    attributes that are expensive to get."""
+    return bool(_LISTENERS or get_trace_file() or get_step_summary_file())
+
+
+def get_current_span():
+    return _CURRENT_SPAN.get()
+
+
+def set_span_attributes(**attributes):
+    """Set attributes on the current span, if there is one."""
+    sp = _CURRENT_SPAN.get()
+    if sp is not None:
+        sp.set_attributes(**attributes)
+
+
+def trace_context_env():
+    """Get the environment variables that make the spans of a subprocess part
+    of the current trace."""
+    sp = _CURRENT_SPAN.get()
+    if sp is None:
+        return {}
+    return {TRACE_PARENT_ENV_VAR: "%s:%s" % (sp.trace_id, sp.span_id)}
+
+
+def _write_json_line(pth, data):
+    line = json.dumps(data, sort_keys=True, default=str) + "\n"
+    # a single append per span so that processes can share the file
+    with open(pth, "a") as fp:
+        fp.write(line)
+
+
+def format_step_summary(spans):
+    """Format the spans of a dispatch as a markdown table."""
+    spans = sorted(spans, key=lambda sp: sp.start)
+    root = min(spans, key=lambda sp: sp.depth)
+    title = "Dispatch timings"
+    if "action" in root.attributes and "repo" in root.attributes:
+        title += " (`%s` for %s#%s)" % (
+            root.attributes["action"],
+            root.attributes["repo"],
+            root.attributes.get("pr", "?"),
+        )
+
+    lines = [
+        "### %s" % title,
+        "",
+        "| phase | duration (s) | status |",
+        "| --- | ---: | --- |",
+    ]
+    for sp in spans:
+        lines.append(
+            "| %s%s | %.3f | %s |"
+            % (
+                "&nbsp;&nbsp;" * (sp.depth - root.depth),
+                sp.name,
+                sp.duration,
+                sp.status,
+            )
+        )
+    return "\n".join(lines) + "\n\n"
+
+
+def _export(sp):
+    for listener in list(_LISTENERS):
+        try:
+            listener(sp)
+        except Exception:
+            LOGGER.exception("error in span listener %r", listener)
+
+    try:
+        pth = get_trace_file()
+        if pth is not None:
+            _write_json_line(pth, sp.as_dict())
+
+        pth = get_step_summary_file()
+        # subprocesses in a trace leave the summary to the dispatch itself
+        if pth is not None and sp.is_local_root and sp.parent_id is None:
+            with open(pth, "a") as fp:
+                fp.write(format_step_summary(sp.trace_spans))
+    except OSError as e:
+        LOGGER.warning("could not export span %s: %r", sp.name, e)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Time a phase of a dispatch.
+
+    Spans nest, so a span started within another one is its child. When the span
+    ends, it is passed to any listeners and, if `CF_WEBSERVICES_TRACE_FILE` is
+    set, written to that file as a line of JSON. When a span without a parent
+    ends and `CF_WEBSERVICES_TRACE_STEP_SUMMARY` is set, a table of all of the
+    spans of the trace is added to the GitHub Actions step summary.
+
+    Parameters
+    ----------
+    name : str
+        The name of the phase.
+    **attributes
+        Attributes of the span.
+
+    Yields
+    ------
+    span : Span
+        The span, which can be given more attributes with `set_attributes`.
+    """
+    parent = _CURRENT_SPAN.get()
+    sp = Span(
+        name,
+        parent=parent,
+        remote_parent=_get_remote_parent() if parent is None else None,
+        attributes=attributes,
+    )
+    token = _CURRENT_SPAN.set(sp)
+    try:
+        yield sp
+    except BaseException as e:
+        sp.status = "error"
+        sp.error = type(e).__name__
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        sp.end()
+        _export(sp)
+
+
+def traced(name):
+    """Decorate a function so that each call is timed in a span."""
+
+    def _decorator(func):
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return _wrapper
+
+    return _decorator
@@ -0,0 +1,184 @@
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+
+from webservices_dispatch_action.version_cache import get_version_cache
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SOURCE_TIMEOUT = 120
+
+_NOT_FETCHED = object()
+
+
+def get_source_timeout():
+    """Get the timeout in seconds for probing a single upstream version source."""
+    return float(
+        os.environ.get("CF_WEBSERVICES_VERSION_SOURCE_TIMEOUT", DEFAULT_SOURCE_TIMEOUT)
+    )
+
+
+class PrefetchedSource:
+    """A wrapper for an upstream version source whose answer was fetched
+    ahead of time.
+
+    `get_url` and `get_version` return the prefetched results, re-raising any
+    error the source raised. If nothing was prefetched (e.g., the source was
+    never probed), the calls go to the wrapped source. If a `cache` is given,
+    the versions are looked up in it before asking the source.
+    """
+
+    def __init__(self, source, feedstock_name=None, cache=None):
+        self.source = source
+        self.feedstock_name = feedstock_name
+        self.cache = cache
+        self.url = _NOT_FETCHED
+        self.version = _NOT_FETCHED
+        self.error = None
+
+    @property
+    def name(self):
+        return self.source.name
+
+    def __getattr__(self, attr):
+        return getattr(self.source, attr)
+
+    def __repr__(self):
+        return "PrefetchedSource(%r)" % self.source
+
+    def get_url(self, meta_yaml):
+        if self.error is not None:
+            raise self.error
+        if self.url is _NOT_FETCHED:
+            return self.source.get_url(meta_yaml)
+        return self.url
+
+    def get_version(self, url):
+        if self.version is _NOT_FETCHED or url != self.url:
+            return self._get_version(url)
+        return self.version
+
+    def _get_version(self, url):
+        if self.cache is None or self.feedstock_name is None:
+            return self.source.get_version(url)
+        return self.cache.get_version(
+            self.feedstock_name, self.name, url, self.source.get_version
+        )
+
+    def _start_probe(self, meta_yaml):
+        # the probe only ever writes to its own future, so that a probe that
+        # answers after it timed out or was abandoned changes nothing
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+
+        def _probe():
+            try:
+                url = self.source.get_url(meta_yaml)
+                version = self._get_version(url) if url is not None else None
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result((url, version))
+
+        # a daemon thread, so that exiting the process never waits on a probe
+        # whose answer is no longer needed
+        threading.Thread(
+            target=_probe, name="version-source-%s" % self.name, daemon=True
+        ).start()
+        return future
+
+
+def _get_configured_source_names(attrs):
+    try:
+        names = attrs["conda-forge.yml"]["bot"]["version_updates"]["sources"]
+    except (KeyError, TypeError):
+        return None
+    if names is None:
+        return None
+    return [n.lower() for n in names]
+
+
+def prefetch_version_sources(
+    attrs, sources, timeout=None, feedstock_name=None, cache=None
+):
+    """Probe upstream version sources one at a time, each with a timeout.
+
+    The sources are probed in priority order (the order of `sources`), like
+    cf-scripts does, so a lower priority source is only asked once every
+    higher priority one has no version or timed out. The first source with a
+    version, or that raises, stops the probing. A source that does not answer
+    within `timeout` seconds is treated as not having a version.
+
+    Each probe runs in its own daemon thread so that it can be timed out, and
+    every source object is only used by one thread at a time. A timed out
+    probe is abandoned rather than joined: its answer is ignored and its
+    source is never called again. That is the only case in which two probes
+    run at once, and then on different sources.
+
+    Parameters
+    ----------
+    attrs : dict
+        The feedstock attributes.
+    sources : sequence of version sources
+        The sources in priority order.
+    timeout : float, optional
+        The time in seconds to wait for a source to answer. Defaults to the
+        value of `CF_WEBSERVICES_VERSION_SOURCE_TIMEOUT`.
+    feedstock_name : str, optional
+        The name of the feedstock, used as the key of the version cache.
+    cache : VersionCache, optional
+        The cache of upstream versions. Defaults to the one configured with
+        `CF_WEBSERVICES_VERSION_CACHE`. The cache is only used if
+        `feedstock_name` is given.
+
+    Returns
+    -------
+    sources : list of PrefetchedSource
+        The wrapped sources, in the same order, for `get_latest_version`.
+    """
+    if timeout is None:
+        timeout = get_source_timeout()
+    if cache is None and feedstock_name is not None:
+        cache = get_version_cache()
+
+    wrapped = [
+        PrefetchedSource(source, feedstock_name=feedstock_name, cache=cache)
+        for source in sources
+    ]
+
+    # only probe the sources the feedstock asked for, if it did
+    names = _get_configured_source_names(attrs)
+    if names is not None:
+        to_probe = [w for n in names for w in wrapped if w.name.lower() == n]
+    else:
+        to_probe = list(wrapped)
+
+    start = time.monotonic()
+    num_probed = 0
+    for w in to_probe:
+        future = w._start_probe(attrs)
+        num_probed += 1
+        concurrent.futures.wait([future], timeout=timeout)
+        if not future.done():
+            LOGGER.warning("version source %s timed out", w.name)
+            w.url = None
+            w.version = None
+            continue
+
+        if future.exception() is not None:
+            # cf-scripts' sequential search would stop at this error too
+            w.error = future.exception()
+            LOGGER.info("version source %s raised %r", w.name, w.error)
+            break
+
+        w.url, w.version = future.result()
+        LOGGER.info("version source %s found version %s", w.name, w.version)
+        if w.version:
+            break
+
+    LOGGER.info(
+        "probed %d version sources in %.3fs", num_probed, time.monotonic() - start
+    )
+    return wrapped
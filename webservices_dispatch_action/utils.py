@@ -1,17 +1,43 @@
 import logging
 import os
+import urllib.parse
 
 from git import GitCommandError
 
 from .api_sessions import get_actor_token
+from .tracing import span
 
 LOGGER = logging.getLogger(__name__)
 
 
+def get_github_server_url():
+    """Get the URL of the GitHub server from `GITHUB_SERVER_URL` (default
+    `https://github.com`)."""
+    return (os.environ.get("GITHUB_SERVER_URL", "") or "https://github.com").rstrip("/")
+
+
+def get_repo_url(owner, repo, actor=None, token=None):
+    """Get the git URL of a repo on the GitHub server.
+
+    If `actor` and `token` are given, they are put in the URL to push with.
+    This is only done for `http(s)` servers.
+    """
+    url = "%s/%s/%s.git" % (get_github_server_url(), owner, repo)
+    parts = urllib.parse.urlsplit(url)
+    if actor is not None and token is not None and parts.scheme in ["http", "https"]:
+        url = urllib.parse.urlunsplit(
+            parts._replace(netloc="%s:%s@%s" % (actor, token, parts.netloc))
+        )
+    return url
+
+
 def get_gha_run_link(repo_name):
     """Get the link to the GHA run given a repo name like conda-forge/blah-feedstock."""
-    run_id = os.environ["GITHUB_RUN_ID"]
-    return f"https://github.com/{repo_name}/actions/runs/{run_id}"
+    run_id = os.environ.get("GITHUB_RUN_ID", None)
+    if run_id is None:
+        # not running in GitHub Actions (e.g., in the worker)
+        return None
+    return f"{get_github_server_url()}/{repo_name}/actions/runs/{run_id}"
 
 
 def comment_and_push_if_changed(
@@ -49,16 +75,11 @@ def comment_and_push_if_changed(
     if changed:
         try:
             git_repo.remotes.origin.set_url(
-                "https://%s:%s@github.com/%s/%s.git"
-                % (
-                    actor,
-                    token,
-                    pr_owner,
-                    pr_repo,
-                ),
+                get_repo_url(pr_owner, pr_repo, actor=actor, token=token),
                 push=True,
             )
-            git_repo.remotes.origin.push()
+            with span("push", branch=pr_branch, owner=pr_owner, repo=pr_repo):
+                git_repo.remotes.origin.push()
         except GitCommandError as e:
             push_error = True
             LOGGER.critical(repr(e))
@@ -77,11 +98,7 @@ into your personal GitHub account.
 """.format(action, pr_branch, pr_owner, pr_repo)
         finally:
             git_repo.remotes.origin.set_url(
-                "https://github.com/%s/%s.git"
-                % (
-                    pr_owner,
-                    pr_repo,
-                ),
+                get_repo_url(pr_owner, pr_repo),
                 push=True,
             )
     else:
@@ -120,9 +137,11 @@ Hi! This is the friendly automated conda-forge-webservice.
                 f"GitHub actions workflow run [{run_link}]({run_link}).\n"
             )
 
-        pull.create_issue_comment(message)
+        with span("comment", action=action):
+            pull.create_issue_comment(message)
 
     if close_pr_if_no_changes_or_errors and not changed and not error:
-        pull.edit(state="closed")
+        with span("close_pr"):
+            pull.edit(state="closed")
 
     return push_error
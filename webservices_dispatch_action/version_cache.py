@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+from .metrics import CACHE_LOOKUPS
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TTL = 3600
+DEFAULT_NEGATIVE_TTL = 6 * 3600
+
+_MISSING = object()
+
+
+class VersionCache:
+    """An on-disk cache of the latest versions found by upstream sources.
+
+    Entries are keyed by `(feedstock name, source name, url)` and stored in a
+    SQLite database so that they are shared between dispatch runs and worker
+    processes. A source that found no version (e.g., the package is not on
+    PyPI) is cached too, with its own TTL.
+
+    Parameters
+    ----------
+    path : str
+        The path to the SQLite database.
+    ttl : float, optional
+        The time in seconds a found version is kept.
+    negative_ttl : float, optional
+        The time in seconds the absence of a version is kept.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def _connect(self):
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS versions ("
+            "name TEXT, source TEXT, url TEXT, version TEXT, "
+            "found INTEGER, mtime REAL, PRIMARY KEY (name, source, url))"
+        )
+        return conn
+
+    def get(self, name, source, url, default=None):
+        """Get the cached version for `(name, source, url)`, if it is not
+        expired. Returns `default` otherwise.
+        """
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute(
+                    "SELECT version, found, mtime FROM versions "
+                    "WHERE name = ? AND source = ? AND url = ?",
+                    (name, source, url),
+                ).fetchone()
+        except sqlite3.Error as e:
+            LOGGER.warning("could not read the version cache: %r", e)
+            return default
+
+        if row is None:
+            return default
+        version, found, mtime = row
+        ttl = self.ttl if found else self.negative_ttl
+        if time.time() - mtime > ttl:
+            return default
+        return json.loads(version)
+
+    def put(self, name, source, url, version):
+        """Cache the version for `(name, source, url)`."""
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        name,
+                        source,
+                        url,
+                        json.dumps(version),
+                        1 if version else 0,
+                        time.time(),
+                    ),
+                )
+        except sqlite3.Error as e:
+            LOGGER.warning("could not write to the version cache: %r", e)
+
+    def get_version(self, name, source, url, get_version):
+        """Get the version from the cache or by calling `get_version(url)`."""
+        version = self.get(name, source, url, default=_MISSING)
+        if version is not _MISSING:
+            LOGGER.info("using cached version %r for %s from %s", version, name, source)
+            CACHE_LOOKUPS.inc(cache="version", result="hit")
+            return version
+        CACHE_LOOKUPS.inc(cache="version", result="miss")
+        version = get_version(url)
+        self.put(name, source, url, version)
+        return version
+
+
+def get_version_cache():
+    """Get the upstream version cache configured in the environment, if any."""
+    path = os.environ.get("CF_WEBSERVICES_VERSION_CACHE", "")
+    if not path:
+        return None
+    ttl = float(os.environ.get("CF_WEBSERVICES_VERSION_CACHE_TTL", DEFAULT_TTL))
+    negative_ttl = float(
+        os.environ.get(
+            "CF_WEBSERVICES_VERSION_CACHE_NEGATIVE_TTL", DEFAULT_NEGATIVE_TTL
+        )
+    )
+    return VersionCache(path, ttl=ttl, negative_ttl=negative_ttl)
@@ -1,39 +1,109 @@
 import logging
+import multiprocessing
 import os
 import pprint
 import subprocess
 import sys
 
 import click
-import conda_forge_tick.update_recipe
-from conda.models.version import VersionOrder
-from conda_forge_tick.feedstock_parser import load_feedstock
-from conda_forge_tick.update_sources import (
-    CRAN,
-    NPM,
-    NVIDIA,
-    Github,
-    IncrementAlphaRawURL,
-    PyPI,
-    RawURL,
-    ROSDistro,
-)
-from conda_forge_tick.update_upstream_versions import get_latest_version
-from conda_forge_tick.utils import setup_logging
-from git import Repo
 
-setup_logging()
+from webservices_dispatch_action.git_utils import stage_files
+from webservices_dispatch_action.metrics import flush_process_metrics
+from webservices_dispatch_action.profiling import profile
+from webservices_dispatch_action.tracing import (
+    set_span_attributes,
+    span,
+    trace_context_env,
+    traced,
+)
+from webservices_dispatch_action.upstream import prefetch_version_sources
 
 LOGGER = logging.getLogger(__name__)
 
+VERSION_UPDATER_ISOLATION = ["fork", "inprocess", "subprocess"]
+
+
+def preload():
+    """Import conda-forge-tick and conda ahead of time (e.g., so that forked
+    children do not pay for the imports)."""
+    import conda_forge_tick.feedstock_parser  # noqa: F401
+    import conda_forge_tick.update_recipe  # noqa: F401
+    import conda_forge_tick.update_sources  # noqa: F401
+    import conda_forge_tick.update_upstream_versions  # noqa: F401
+    from conda.models.version import VersionOrder  # noqa: F401
+
+
+def load_feedstock(name, sub_graph, **kwargs):
+    # imported here since conda-forge-tick is slow to import
+    from conda_forge_tick.feedstock_parser import load_feedstock
+
+    return load_feedstock(name, sub_graph, **kwargs)
+
+
+def _read_if_exists(pth):
+    if os.path.exists(pth):
+        with open(pth) as fp:
+            return fp.read()
+    return None
+
+
+def load_feedstock_attrs(git_repo, name):
+    """Compute the feedstock attributes from the recipe and `conda-forge.yml`
+    in the local checkout.
+
+    Parameters
+    ----------
+    git_repo : git.Repo
+        The feedstock repo.
+    name : str
+        The name of the feedstock (e.g., `foo` for `foo-feedstock`).
+
+    Returns
+    -------
+    attrs : dict
+        The feedstock attributes, as returned by `load_feedstock`.
+    """
+    wd = git_repo.working_dir
+    meta_yaml = _read_if_exists(os.path.join(wd, "recipe", "meta.yaml"))
+    recipe_yaml = _read_if_exists(os.path.join(wd, "recipe", "recipe.yaml"))
+    conda_forge_yaml = _read_if_exists(os.path.join(wd, "conda-forge.yml"))
 
+    # cf-scripts fetches the files it is not given from GitHub, so an absent
+    # `conda-forge.yml` is passed as an empty one
+    kwargs = {
+        "meta_yaml": meta_yaml,
+        "conda_forge_yaml": "{}" if conda_forge_yaml is None else conda_forge_yaml,
+    }
+    if recipe_yaml is not None:
+        kwargs["recipe_yaml"] = recipe_yaml
+    return load_feedstock(name, {}, **kwargs)
+
+
+@traced("update_version")
 def update_version(git_repo, repo_name, input_version=None):
+    # imported here since conda-forge-tick and conda are slow to import
+    import conda_forge_tick.update_recipe
+    from conda.models.version import VersionOrder
+    from conda_forge_tick.update_sources import (
+        CRAN,
+        NPM,
+        NVIDIA,
+        Github,
+        IncrementAlphaRawURL,
+        PyPI,
+        RawURL,
+        ROSDistro,
+    )
+    from conda_forge_tick.update_upstream_versions import get_latest_version
+
     name = os.path.basename(repo_name).rsplit("-", 1)[0]
     LOGGER.info("using feedstock name %s for repo %s", name, repo_name)
+    set_span_attributes(feedstock=name, input_version=input_version)
 
     try:
         LOGGER.info("computing feedstock attributes")
-        attrs = load_feedstock(name, {})
+        with span("load_feedstock_attrs"):
+            attrs = load_feedstock_attrs(git_repo, name)
         LOGGER.info("feedstock attrs:\n%s\n", pprint.pformat(attrs))
     except Exception:
         LOGGER.exception("error while computing feedstock attributes!")
@@ -42,21 +112,24 @@ def update_version(git_repo, repo_name, input_version=None):
     if input_version is None or input_version == "null":
         try:
             LOGGER.info("getting latest version")
-            new_version = get_latest_version(
-                name,
-                attrs,
-                (
-                    PyPI(),
-                    CRAN(),
-                    NPM(),
-                    ROSDistro(),
-                    RawURL(),
-                    Github(),
-                    IncrementAlphaRawURL(),
-                    NVIDIA(),
-                ),
-            )
-            new_version = new_version["new_version"]
+            with span("get_latest_version") as sp:
+                sources = prefetch_version_sources(
+                    attrs,
+                    (
+                        PyPI(),
+                        CRAN(),
+                        NPM(),
+                        ROSDistro(),
+                        RawURL(),
+                        Github(),
+                        IncrementAlphaRawURL(),
+                        NVIDIA(),
+                    ),
+                    feedstock_name=name,
+                )
+                new_version = get_latest_version(name, attrs, sources)
+                new_version = new_version["new_version"]
+                sp.set_attributes(new_version=new_version)
             if new_version:
                 LOGGER.info(
                     "curr version|latest version: %s|%s",
@@ -88,40 +161,33 @@ def update_version(git_repo, repo_name, input_version=None):
         return False, False
 
     try:
-        new_meta_yaml, errors = conda_forge_tick.update_recipe.update_version(
-            attrs["raw_meta_yaml"],
-            str(new_version),
-        )
-        if errors or new_meta_yaml is None:
-            LOGGER.critical("errors when updating the recipe: %r", errors)
-            raise RuntimeError("Error updating the recipe!")
-        new_meta_yaml = conda_forge_tick.update_recipe.update_build_number(
-            new_meta_yaml,
-            0,
-        )
+        with span("update_recipe"):
+            new_meta_yaml, errors = conda_forge_tick.update_recipe.update_version(
+                attrs["raw_meta_yaml"],
+                str(new_version),
+            )
+            if errors or new_meta_yaml is None:
+                LOGGER.critical("errors when updating the recipe: %r", errors)
+                raise RuntimeError("Error updating the recipe!")
+            new_meta_yaml = conda_forge_tick.update_recipe.update_build_number(
+                new_meta_yaml,
+                0,
+            )
     except Exception:
         LOGGER.exception("error while updating the recipe!")
         return False, True
 
     try:
-        with open(os.path.join(git_repo.working_dir, "recipe", "meta.yaml"), "w") as fp:
-            fp.write(new_meta_yaml)
-
-        subprocess.run(
-            "git add recipe/meta.yaml",
-            shell=True,
-            cwd=git_repo.working_dir,
-            check=True,
-            env=os.environ,
-        )
+        with span("commit"):
+            with open(
+                os.path.join(git_repo.working_dir, "recipe", "meta.yaml"), "w"
+            ) as fp:
+                fp.write(new_meta_yaml)
 
-        subprocess.run(
-            f"git commit -m 'ENH updated version to {new_version}'",
-            shell=True,
-            cwd=git_repo.working_dir,
-            check=True,
-            env=os.environ,
-        )
+            stage_files(git_repo, ["recipe/meta.yaml"])
+            git_repo.git.commit(
+                "--quiet", "-m", f"ENH updated version to {new_version}"
+            )
     except Exception:
         LOGGER.exception("error while committing new recipe to repo")
         return False, True
@@ -129,6 +195,95 @@ def update_version(git_repo, repo_name, input_version=None):
     return True, False
 
 
+def get_version_updater_isolation():
+    """Get how the version updater is isolated from the dispatcher (default `fork`)."""
+    isolation = os.environ.get("CF_WEBSERVICES_VERSION_UPDATER_ISOLATION", "") or "fork"
+    if isolation not in VERSION_UPDATER_ISOLATION:
+        raise ValueError("Unknown version updater isolation %r!" % isolation)
+    return isolation
+
+
+def _update_version_in_child(feedstock_dir, repo_name, input_version):
+    from git import Repo
+
+    with profile("version_updater"):
+        _, version_error = update_version(
+            Repo(feedstock_dir),
+            repo_name,
+            input_version=input_version,
+        )
+    flush_process_metrics()
+    sys.exit(1 if version_error else 0)
+
+
+def run_update_version(git_repo, repo_name, input_version=None, isolation=None):
+    """Update the version of a feedstock, isolated from the calling process.
+
+    Parameters
+    ----------
+    git_repo : git.Repo
+        The feedstock repo.
+    repo_name : str
+        The name of the repository (e.g., `conda-forge/foo-feedstock`).
+    input_version : str, optional
+        The version to update to. If not given, the latest version is found.
+    isolation : str, optional
+        One of `fork` (run in a forked child process that reuses the modules
+        already imported here), `inprocess` (run directly in this process) or
+        `subprocess` (run the `run-webservices-dispatch-action-version-updater`
+        CLI). Defaults to the value of `CF_WEBSERVICES_VERSION_UPDATER_ISOLATION`.
+
+    Returns
+    -------
+    version_error : bool
+        True if the version update failed.
+    """
+    isolation = isolation or get_version_updater_isolation()
+    LOGGER.info("updating the version (isolation: %s)", isolation)
+
+    with span("run_update_version", isolation=isolation) as sp:
+        version_error = _run_update_version(
+            git_repo, repo_name, input_version, isolation
+        )
+        sp.set_attributes(version_error=version_error)
+    return version_error
+
+
+def _run_update_version(git_repo, repo_name, input_version, isolation):
+    if isolation == "subprocess":
+        cmd = [
+            "run-webservices-dispatch-action-version-updater",
+            "--feedstock-dir",
+            git_repo.working_dir,
+            "--repo-name",
+            repo_name,
+        ]
+        if input_version:
+            cmd += ["--input-version", input_version]
+        LOGGER.info("Running command %s", cmd)
+        ret = subprocess.run(cmd, env={**os.environ, **trace_context_env()})
+        return ret.returncode != 0
+    elif isolation == "fork":
+        proc = multiprocessing.get_context("fork").Process(
+            target=_update_version_in_child,
+            args=(git_repo.working_dir, repo_name, input_version),
+        )
+        proc.start()
+        proc.join()
+        return proc.exitcode != 0
+    else:
+        try:
+            _, version_error = update_version(
+                git_repo,
+                repo_name,
+                input_version=input_version,
+            )
+        except Exception:
+            LOGGER.exception("error while updating the version!")
+            version_error = True
+        return version_error
+
+
 @click.command()
 @click.option(
     "--feedstock-dir",
@@ -154,13 +309,19 @@ def main(
     repo_name,
     input_version=None,
 ):
+    from conda_forge_tick.utils import setup_logging
+    from git import Repo
+
+    setup_logging()
+
     git_repo = Repo(feedstock_dir)
 
-    _, version_error = update_version(
-        git_repo,
-        repo_name,
-        input_version=input_version,
-    )
+    with profile("version_updater"):
+        _, version_error = update_version(
+            git_repo,
+            repo_name,
+            input_version=input_version,
+        )
 
     if version_error:
         sys.exit(1)
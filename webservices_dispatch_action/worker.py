@@ -0,0 +1,340 @@
+import functools
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import click
+
+import webservices_dispatch_action
+from webservices_dispatch_action import github_http, metrics
+from webservices_dispatch_action.__main__ import handle_event
+from webservices_dispatch_action.api_sessions import create_api_sessions
+from webservices_dispatch_action.scheduler import DispatchScheduler, get_pr_head_sha
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DirectoryEventQueue:
+    """A queue of event payloads stored as JSON files in a directory.
+
+    Files named `*.json` in `event_dir` are processed oldest first. A file is
+    claimed by moving it to `processing/` so that several workers can share the
+    same directory, and it is moved to `done/` or `failed/` once handled.
+    """
+
+    closed = False
+
+    def __init__(self, event_dir):
+        self.event_dir = event_dir
+        for subdir in ["processing", "done", "failed"]:
+            os.makedirs(os.path.join(self.event_dir, subdir), exist_ok=True)
+
+    def _move(self, pth, subdir):
+        dest = os.path.join(self.event_dir, subdir, os.path.basename(pth))
+        os.replace(pth, dest)
+        return dest
+
+    def get(self):
+        fnames = []
+        for fname in glob.glob(os.path.join(self.event_dir, "*.json")):
+            try:
+                fnames.append((os.path.getmtime(fname), fname))
+            except FileNotFoundError:
+                pass
+
+        for _, fname in sorted(fnames):
+            try:
+                pth = self._move(fname, "processing")
+            except FileNotFoundError:
+                # another worker claimed it
+                continue
+
+            try:
+                with open(pth, "r") as fp:
+                    return pth, json.load(fp)
+            except ValueError:
+                LOGGER.exception("could not read event %s", fname)
+                self._move(pth, "failed")
+
+        return None
+
+    def task_done(self, key, ok):
+        self._move(key, "done" if ok else "failed")
+
+    def __len__(self):
+        return len(glob.glob(os.path.join(self.event_dir, "*.json")))
+
+
+class StreamEventQueue:
+    """A queue of event payloads read as JSON lines from a stream."""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.closed = False
+        self.num_read = 0
+
+    def get(self):
+        while not self.closed:
+            line = self.fp.readline()
+            if not line:
+                self.closed = True
+                break
+
+            line = line.strip()
+            if not line:
+                continue
+
+            self.num_read += 1
+            try:
+                return self.num_read, json.loads(line)
+            except ValueError:
+                LOGGER.exception("could not read event on line %d", self.num_read)
+
+        return None
+
+    def task_done(self, key, ok):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+def make_gh_from_env():
+    """Make a GitHub client from the token in the environment."""
+    with webservices_dispatch_action.sensitive_env():
+        _, gh = create_api_sessions(os.environ["INPUT_GITHUB_TOKEN"])
+    return gh
+
+
+def run_worker(
+    queue,
+    gh,
+    event_name="repository_dispatch",
+    poll_interval=5.0,
+    exit_when_empty=False,
+    handler=None,
+    jobs=0,
+    make_gh=None,
+):
+    """Handle events from a queue in this process until it is exhausted.
+
+    Parameters
+    ----------
+    queue : DirectoryEventQueue or StreamEventQueue
+        The queue of events.
+    gh : github.MainClass.Github
+        A `Github` object from the PyGithub package, reused for every event.
+    event_name : str, optional
+        The name of the GitHub event for the payloads in the queue.
+    poll_interval : float, optional
+        The time in seconds to wait before polling an empty queue again.
+    exit_when_empty : bool, optional
+        If True, return as soon as the queue is empty instead of polling.
+    handler : callable, optional
+        The function called as `handler(gh, event_name, event_data)` for each
+        event. Defaults to the handler used by `run-webservices-dispatch-action`.
+    jobs : int, optional
+        The number of events to handle in parallel. If zero, events are handled
+        one at a time in this process. Otherwise, events are handled in a pool of
+        forked processes by a `DispatchScheduler`, one at a time per PR, and
+        duplicate events for the same PR head commit and inputs are dropped.
+    make_gh : callable, optional
+        Makes the GitHub client in each pool process when `jobs` is not zero.
+        Defaults to `make_gh_from_env`.
+
+    Returns
+    -------
+    num_ok : int
+        The number of events processed successfully.
+    num_failed : int
+        The number of events that failed.
+    """
+    handler = handler or handle_event
+    if jobs > 0:
+        return _run_worker_in_pool(
+            queue,
+            gh,
+            event_name,
+            poll_interval,
+            exit_when_empty,
+            handler,
+            jobs,
+            make_gh or make_gh_from_env,
+        )
+
+    metrics.QUEUE_DEPTH.set_function(lambda: len(queue))
+    num_ok = 0
+    num_failed = 0
+    while True:
+        item = queue.get()
+        if item is None:
+            if queue.closed or exit_when_empty:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        key, event_data = item
+        LOGGER.info("processing event %s", key)
+        metrics.RUNNING_JOBS.set(1)
+        try:
+            handler(gh, event_name, event_data)
+        except Exception:
+            LOGGER.exception("error processing event %s", key)
+            num_failed += 1
+            queue.task_done(key, False)
+        else:
+            num_ok += 1
+            queue.task_done(key, True)
+        finally:
+            metrics.RUNNING_JOBS.set(0)
+
+    LOGGER.info("processed %d events with %d failures", num_ok + num_failed, num_failed)
+    return num_ok, num_failed
+
+
+def _run_worker_in_pool(
+    queue, gh, event_name, poll_interval, exit_when_empty, handler, jobs, make_gh
+):
+    with DispatchScheduler(
+        jobs,
+        handler,
+        make_gh=make_gh,
+        on_done=lambda key, ok: queue.task_done(key, ok),
+        mp_context=multiprocessing.get_context("fork"),
+        resolve_head_sha=(
+            functools.partial(get_pr_head_sha, gh) if gh is not None else None
+        ),
+    ) as scheduler:
+        metrics.QUEUE_DEPTH.set_function(lambda: scheduler.queue_depth + len(queue))
+        metrics.RUNNING_JOBS.set_function(lambda: scheduler.num_running)
+        while True:
+            item = queue.get()
+            if item is None:
+                if queue.closed or exit_when_empty:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            key, event_data = item
+            LOGGER.info("queueing event %s", key)
+            scheduler.submit(event_name, event_data, tag=key)
+
+    num_skipped = scheduler.num_superseded + scheduler.num_duplicates
+    LOGGER.info(
+        "processed %d events with %d failures and %d skipped",
+        scheduler.num_ok + scheduler.num_failed + num_skipped,
+        scheduler.num_failed,
+        num_skipped,
+    )
+    return scheduler.num_ok + num_skipped, scheduler.num_failed
+
+
+@click.command()
+@click.option(
+    "--event-dir",
+    required=False,
+    type=str,
+    default=None,
+    help=(
+        "A directory of JSON event payloads to process. "
+        "If not given, JSON lines are read from stdin."
+    ),
+)
+@click.option(
+    "--event-name",
+    required=False,
+    type=str,
+    default="repository_dispatch",
+    help="The name of the GitHub event for the payloads",
+)
+@click.option(
+    "--poll-interval",
+    required=False,
+    type=float,
+    default=5.0,
+    help="The time in seconds between polls of an empty event directory",
+)
+@click.option(
+    "--exit-when-empty",
+    is_flag=True,
+    default=False,
+    help="Exit once the event directory is empty instead of waiting for more",
+)
+@click.option(
+    "--jobs",
+    required=False,
+    type=int,
+    default=1,
+    help=(
+        "The number of events to handle in parallel. "
+        "Use 0 to handle events one at a time in the worker process itself."
+    ),
+)
+@click.option(
+    "--metrics-port",
+    required=False,
+    type=int,
+    default=None,
+    help="Serve OpenMetrics metrics over HTTP on this port",
+)
+def main(event_dir, event_name, poll_interval, exit_when_empty, jobs, metrics_port):
+    logging.basicConfig(level=logging.INFO)
+
+    # unlike a GitHub Actions job, the worker can afford to wait out rate limits
+    github_http.set_default_rate_limit_max_wait(github_http.WORKER_RATE_LIMIT_MAX_WAIT)
+
+    LOGGER.info("making API clients")
+
+    with webservices_dispatch_action.sensitive_env():
+        _, gh = create_api_sessions(os.environ["INPUT_GITHUB_TOKEN"])
+
+    # import the handlers and the version updater once up front so that every
+    # event and every forked pool process reuses them
+    from webservices_dispatch_action import (
+        handlers,  # noqa: F401
+        rerendering,
+        version_updater,
+    )
+
+    version_updater.preload()
+    if rerendering.get_rerender_engine() == "fork":
+        rerendering.preload()
+
+    if event_dir is not None:
+        queue = DirectoryEventQueue(event_dir)
+    else:
+        queue = StreamEventQueue(sys.stdin)
+
+    metrics_dir = None
+    if metrics_port is not None or metrics.get_metrics_file() is not None:
+        # the pool processes and forked version updaters leave their metrics here
+        metrics_dir = tempfile.mkdtemp()
+        metrics.set_process_dir(metrics_dir)
+    if metrics_port is not None:
+        metrics.serve_metrics(metrics_port)
+
+    try:
+        _, num_failed = run_worker(
+            queue,
+            gh,
+            event_name=event_name.lower(),
+            poll_interval=poll_interval,
+            exit_when_empty=exit_when_empty,
+            jobs=jobs,
+        )
+    finally:
+        if metrics_dir is not None:
+            metrics.write_metrics_file()
+            metrics.set_process_dir(None)
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    if num_failed:
+        sys.exit(1)
+    else:
+        sys.exit(0)